@@ -23,6 +23,8 @@ import logging
 from multiprocessing import Process, Queue
 from multiprocessing import queues as mp_queues
 import threading
+import collections
+import time
 import json
 import bottle
 import diatomite_aux as dia_aux
@@ -33,9 +35,200 @@ class DiaApiSvcError(Exception):
     pass
 
 
+class IngestionStats(object):
+    """Keep metrics on the api service's input queue ingestion."""
+
+    # number of recent lag samples kept to compute percentiles
+    _lag_samples = 1000
+
+    def __init__(self):
+        """Initialize the metrics"""
+
+        self._data = {
+            # messages taken from the input queue
+            'messages': 0,
+            # wake-ups of the ingestion loop that found messages
+            'batches': 0,
+            # messages superseded by a newer one on the same batch
+            'coalesced': 0,
+            # size of the last batch and largest batch
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            # messages left on the queue after draining, None if the
+            # platform is unable to tell
+            'backlog': None,
+            'max_backlog': 0,
+            # time between a message's creation and it being applied,
+            # in seconds
+            'last_lag': None,
+            'max_lag': 0.0,
+            # lag for the priority lane messages (state changes)
+            'max_priority_lag': 0.0
+        }
+
+        self._lags = collections.deque(maxlen=self._lag_samples)
+        self._priority_lags = collections.deque(maxlen=self._lag_samples)
+
+    def update(self, batch_size, coalesced, lags, backlog,
+               priority_lags=None):
+        """Update the metrics after ingesting a batch
+        batch_size -- number of messages on the batch
+        coalesced -- number of messages that were superseded
+        lags -- list of lags for the messages on the batch, in seconds
+        backlog -- messages left on the queue, None if unknown
+        priority_lags -- list of lags for the priority messages on the
+            batch, in seconds"""
+
+        self._data['messages'] += batch_size
+        self._data['batches'] += 1
+        self._data['coalesced'] += coalesced
+        self._data['last_batch_size'] = batch_size
+        self._data['max_batch_size'] = max(self._data['max_batch_size'],
+                                           batch_size)
+
+        self._data['backlog'] = backlog
+        if backlog is not None:
+            self._data['max_backlog'] = max(self._data['max_backlog'],
+                                            backlog)
+
+        if lags:
+            self._lags.extend(lags)
+            self._data['last_lag'] = lags[-1]
+            self._data['max_lag'] = max(self._data['max_lag'], max(lags))
+
+        if priority_lags:
+            self._priority_lags.extend(priority_lags)
+            self._data['max_priority_lag'] = max(self._data['max_priority_lag'],
+                                                 max(priority_lags))
+
+    @staticmethod
+    def _get_percentile(samples, percentile):
+        """Return a percentile of the samples, None if there are no samples
+        samples -- the samples
+        percentile -- the percentile, between 0 and 100"""
+
+        samples = sorted(samples)
+        if not samples:
+            return None
+
+        idx = int(round((len(samples) - 1) * percentile / 100.0))
+
+        return samples[idx]
+
+    def get_lag_percentile(self, percentile):
+        """Return a percentile of the recent lags, None if there are no
+        samples
+        percentile -- the percentile, between 0 and 100"""
+
+        return self._get_percentile(self._lags, percentile)
+
+    def get_priority_lag_percentile(self, percentile):
+        """Return a percentile of the recent priority message lags, None if
+        there are no samples
+        percentile -- the percentile, between 0 and 100"""
+
+        return self._get_percentile(self._priority_lags, percentile)
+
+    def data_dump(self):
+        """Dumps the data, used for json decoding by nesting objects"""
+
+        ret_data = dict(self._data)
+        ret_data['lag_p50'] = self.get_lag_percentile(50)
+        ret_data['lag_p99'] = self.get_lag_percentile(99)
+        ret_data['priority_lag_p50'] = self.get_priority_lag_percentile(50)
+        ret_data['priority_lag_p99'] = self.get_priority_lag_percentile(99)
+
+        return ret_data
+
+
+class DeliveryStats(object):
+    """Keep account of the listener message sequence numbers received by
+    the api service, to tell lost, duplicated and reordered messages.
+    Signal level messages dropped by the probe's queues, under their level
+    policy, are also seen as missing, see the queue's dropped counters."""
+
+    def __init__(self):
+        """Initialize the metrics"""
+
+        self._data = {
+            # messages received with the next expected sequence number
+            'in_order': 0,
+            # times the sequence skipped ahead, and the messages skipped
+            'gaps': 0,
+            'missing': 0,
+            # messages with the same sequence number as the last one
+            'duplicates': 0,
+            # messages arriving after a newer one, these were also counted
+            # as missing when the newer one arrived
+            'reordered': 0,
+            # times a listener's sequence started over on a new run (eg:
+            # it's radio source subprocess was restarted)
+            'restarts': 0
+        }
+
+        # last sequence number received from each listener
+        self._last_seqs = {}
+
+        # run of the last sequence number received from each listener
+        self._last_runs = {}
+
+    def check(self, key, seq, run=None):
+        """Account for a received message, return True if it is newer
+        than all messages received before from the same listener
+        key -- the listener key, a tuple with the site, probe, radio
+            source and listener ids
+        seq -- the message sequence number
+        run -- id of the listener's run the sequence number belongs to"""
+
+        last_seq = self._last_seqs.get(key)
+        last_run = self._last_runs.get(key)
+
+        if last_seq is not None and run != last_run:
+            # the sequence numbers start over on each run
+            if last_run is not None:
+                self._data['restarts'] += 1
+            last_seq = None
+
+        if last_seq is None or seq == last_seq + 1:
+            self._data['in_order'] += 1
+        elif seq == last_seq:
+            self._data['duplicates'] += 1
+            return False
+        elif seq > last_seq:
+            self._data['gaps'] += 1
+            self._data['missing'] += seq - last_seq - 1
+        else:
+            self._data['reordered'] += 1
+            return False
+
+        self._last_seqs[key] = seq
+        self._last_runs[key] = run
+
+        return True
+
+    def get_last_seq(self, key):
+        """Return the last sequence number received from a listener, None
+        if none was received
+        key -- the listener key, a tuple with the site, probe, radio
+            source and listener ids"""
+
+        return self._last_seqs.get(key)
+
+    def data_dump(self):
+        """Dumps the data, used for json decoding by nesting objects"""
+
+        return dict(self._data)
+
+
 class ApiSvc(object):
     """Provide RESTFULL API services."""
 
+    # time to wait for messages before checking for a stop, in seconds
+    _ingest_wait = 0.5
+
+    # maximum number of messages taken from the queue on a single pass
+    _ingest_max_batch = 1000
+
     def __init__(self, probe_conf, site_conf, in_queue, out_queue):
         """Initialize the api service object.
         probe_conf -- a dictionary with a valid configuration for
@@ -52,6 +245,17 @@ class ApiSvc(object):
 
         self._data = {}
 
+        self._ingest_stats = IngestionStats()
+
+        # sequence number accounting for the listener's messages
+        self._delivery_stats = DeliveryStats()
+
+        # shared memory table with the listener's signal levels
+        self._level_table = None
+
+        # the probe's queues, DiaQueue objects, to report on
+        self._queues = []
+
         # Id of this component
         self._id = 'API_SRV'
 
@@ -112,6 +316,20 @@ class ApiSvc(object):
         msg = 'Top block set.'
         logging.debug(msg)
 
+    def set_level_table(self, level_table):
+        """Set the shared memory table from where listener signal levels
+        are read
+        level_table -- a DiaLevelTable object, None if levels are received
+            as messages"""
+
+        self._level_table = level_table
+
+    def set_queues(self, queues):
+        """Set the queues whose counters are reported on the metrics
+        queues -- a list of DiaQueue objects"""
+
+        self._queues = queues
+
     def get_output_pipe(self):
         """Return the output pipe for the listener."""
 
@@ -149,93 +367,154 @@ class ApiSvc(object):
             raise
 
     def _monitor_input_queue(self, stop_event):
-        """Monitor input queue"""
-        stop = False
+        """Monitor input queue
+        Waits for messages, then drains everything already available on
+        the queue and applies it on a single pass."""
+
         while not stop_event.is_set():
-            in_data = self._subprocess_in.get()
+            try:
+                in_data = self._subprocess_in.get(True, self._ingest_wait)
+            except mp_queues.Empty:
+                continue
+
+            batch = []
+            self._add_to_batch(batch, in_data)
+
+            # drain whatever else is already on the queue
+            while len(batch) < self._ingest_max_batch:
+                try:
+                    in_data = self._subprocess_in.get_nowait()
+                except mp_queues.Empty:
+                    break
+                self._add_to_batch(batch, in_data)
+
+            self._ingest_batch(batch)
+
+            # TODO: manage stop messages
+
+    @staticmethod
+    def _add_to_batch(batch, in_data):
+        """Add an item taken from the input queue to the batch being
+        ingested, unpacking DiaMsgBatch objects
+        batch -- list of messages being ingested
+        in_data -- item taken from the input queue"""
+
+        if isinstance(in_data, dia_aux.DiaMsgBatch):
+            batch.extend(in_data.get_msgs())
+        else:
+            batch.append(in_data)
+
+    def _ingest_batch(self, batch):
+        """Apply a batch of messages taken from the input queue.
+        Signal state messages carry the whole state for a listener, so
+        only the latest one for each listener is applied, and those older
+        than one already received, by sequence number, are skipped.
+        batch -- a list of DiaMsg objects"""
+
+        now = time.time()
+        lags = []
+        priority_lags = []
+        sig_msgs = 0
+        applied = 0
+
+        # latest signal state message for each listener
+        sig_updates = collections.OrderedDict()
+
+        for in_data in batch:
+            if not isinstance(in_data, dia_aux.DiaMsg):
+                msg = 'Ignoring unexpected message {d}'.format(d=in_data)
+                logging.warning(msg)
+                continue
+
+            lag = now - in_data.get_time()
+            lags.append(lag)
 
-            # extract commands from in_data
             msg_type = in_data.get_msg_type()
+            if msg_type not in dia_aux.DiaLaneQueue.bulk_msg_types:
+                priority_lags.append(lag)
+
+            key = (in_data.get_site_id(), in_data.get_probe_id(),
+                   in_data.get_source_id(), in_data.get_listener_id())
+
+            # the priority lane may overtake older level updates, those
+            # are stale
+            newest = True
+            if in_data.get_seq() is not None:
+                newest = self._delivery_stats.check(key, in_data.get_seq(),
+                                                    in_data.get_run())
+
             if msg_type in (dia_aux.DiaMsgType.LNR_SIG_STATE,
                             dia_aux.DiaMsgType.LNR_SIG_STATUS_CHANGE):
-                self._process_sig_state_update(in_data)
+                sig_msgs += 1
+                if not newest:
+                    continue
+
+                # keep the update order of the latest message
+                sig_updates.pop(key, None)
+                sig_updates[key] = in_data
             elif msg_type == dia_aux.DiaMsgType.RCV_SYS_STATE_CHANGE:
                 self._process_rcv_state_update(in_data)
             elif msg_type == dia_aux.DiaMsgType.LNR_SYS_STATE_CHANGE:
                 self._process_lnr_state_update(in_data)
 
-            # TODO: manage stop messages
-#             input_cmd = ''
-#             if input_cmd == 'STOP':
-#                 stop = True
+        for in_data in sig_updates.itervalues():
+            self._process_sig_state_update(in_data)
+            applied += 1
 
-            msg = 'in_data {d}, type {t}'.format(d=in_data, t=type(in_data))
-            logging.debug(msg)
+        try:
+            backlog = self._subprocess_in.qsize()
+        except NotImplementedError:
+            backlog = None
 
-            stop_event.wait(0.1)
+        coalesced = sig_msgs - applied
+
+        self._ingest_stats.update(len(batch), coalesced, lags, backlog,
+                                  priority_lags)
+
+        msg = ('ingested {n} messages, {c} coalesced,'
+               ' backlog {b}').format(n=len(batch), c=coalesced, b=backlog)
+        logging.debug(msg)
 
     def _process_sig_state_update(self, in_data):
         """process signal state update messages
-        in_data -- a DiaSiteMsg object"""
+        in_data -- a DiaMsg object"""
 
         # check if we were given an object of the right type
-        if not isinstance(in_data, dia_aux.DiaSiteMsg):
-            msg = ('in_data must be a DiaSiteMsg,'
+        if not isinstance(in_data, dia_aux.DiaMsg):
+            msg = ('in_data must be a DiaMsg,'
                    ' was {t}').format(t=type(in_data))
             raise TypeError(msg)
 
-        # extract the payload
-        payload = in_data.get_payload()
-        site_id = in_data.get_id()
-
-        # re-pack payload into a probe message
-        dia_probe_msg = dia_aux.DiaProbeMsg()
-        dia_probe_msg.set_json(payload)
-
-        dia_probe_msg_payload = dia_probe_msg.get_payload()
-        probe_id = dia_probe_msg.get_id()
-
-        # re-pack payload into a receiver message
-        dia_receiver_msg = dia_aux.DiaRadioReceiverMsg()
-        dia_receiver_msg.set_json(dia_probe_msg_payload)
-
-        dia_receiver_msg_payload = dia_receiver_msg.get_payload()
-        rcvr_id = dia_receiver_msg.get_id()
-
-        # re-pack payload into a listener message
-        dia_lnr_msg = dia_aux.DiaListenerMsg()
-        dia_lnr_msg.set_json(dia_receiver_msg_payload)
-
-        dia_lnr_msg_payload = dia_lnr_msg.get_payload()
-        lnr_id = dia_lnr_msg.get_id()
-
-        self._update_sig_state(site_id, probe_id, rcvr_id, lnr_id,
-                               dia_lnr_msg_payload)
+        self._update_sig_state(in_data.get_site_id(),
+                               in_data.get_probe_id(),
+                               in_data.get_source_id(),
+                               in_data.get_listener_id(),
+                               in_data.get_payload())
 
     def _process_rcv_state_update(self, in_data):
         """process receivar sys state update messages
-        in_data -- a DiaSiteMsg object"""
+        in_data -- a DiaMsg object"""
 
         # check if we were given an object of the right type
-        if not isinstance(in_data, dia_aux.DiaSiteMsg):
-            msg = ('in_data must be a DiaSiteMsg,'
+        if not isinstance(in_data, dia_aux.DiaMsg):
+            msg = ('in_data must be a DiaMsg,'
                    ' was {t}').format(t=type(in_data))
             raise TypeError(msg)
         # TODO: finish receiver state update
 
     def _process_lnr_state_update(self, in_data):
         """process listener sys state update messages
-        in_data -- a DiaSiteMsg object"""
+        in_data -- a DiaMsg object"""
 
         # check if we were given an object of the right type
-        if not isinstance(in_data, dia_aux.DiaSiteMsg):
-            msg = ('in_data must be a DiaSiteMsg,'
+        if not isinstance(in_data, dia_aux.DiaMsg):
+            msg = ('in_data must be a DiaMsg,'
                    ' was {t}').format(t=type(in_data))
             raise TypeError(msg)
         # TODO: finish listener state update
 
     def _update_sig_state(self, site_id, probe_id, rsrc_id, lnr_id, data):
-        """Update signal state info from a DiaSiteMsg
+        """Update signal state info from a DiaMsg
         site_id -- site id for the listener that will be updated
         probe_id -- probe id for the listener that will be updated
         rsrc_id -- receiver id for the listener that will be updated
@@ -276,7 +555,8 @@ class ApiSvc(object):
         self._monitor_input_queue_thread.start()
 
         # start flask
-        api = DiaApi('DiatomiteAPI', self._data)
+        api = DiaApi('DiatomiteAPI', self._data, self._ingest_stats,
+                     self._level_table, self._queues, self._delivery_stats)
         api.run(host='localhost', port=8000)
 
         msg = 'API server exiting.'.format(id=self.get_id())
@@ -287,20 +567,68 @@ class ApiSvc(object):
         """Get site data"""
         return self._data
 
+    def get_ingestion_stats(self):
+        """Get the input queue ingestion metrics, an IngestionStats"""
+        return self._ingest_stats
+
+    def get_delivery_stats(self):
+        """Get the message sequence accounting, a DeliveryStats"""
+        return self._delivery_stats
+
+
 class DiaApi(bottle.Bottle):
     """Class to provide an API server for Diatomite"""
 
     _base_url = '/diatomite'
 
-    def __init__(self, name, data):
+    def __init__(self, name, data, ingest_stats=None, level_table=None,
+                 queues=None, delivery_stats=None):
 
         super(DiaApi, self).__init__()
         self.name = name
         self._set_routes()
         self._data = data
+        self._ingest_stats = ingest_stats
+        self._delivery_stats = delivery_stats
+        self._level_table = level_table
+
+        if queues is None:
+            queues = []
+        self._queues = queues
+
+        if self._level_table is not None:
+            self.add_hook('before_request', self._apply_levels)
+
+    def _apply_levels(self):
+        """Update the listeners current signal level and time from the
+        shared memory level table"""
+
+        for site in self._data.itervalues():
+            for probe in site['probes'].itervalues():
+                for source_id, source in probe['RadioSources'].iteritems():
+                    for listener_id, listener in source['listeners'].iteritems():
+
+                        if 'signal_state' not in listener:
+                            continue
+
+                        slot = self._level_table.get_slot(source_id,
+                                                          listener_id)
+                        if slot is None:
+                            continue
+
+                        level_data = self._level_table.read(slot)
+                        if level_data is None:
+                            continue
+
+                        _, level, timestamp, metrics = level_data
+
+                        current = listener['signal_state'].get_current()
+                        current.set_level(level, timestamp)
+                        current.set_metrics(*metrics)
 
     def _set_routes(self):
         """Set routes for the api"""
+        self.route(self._base_url + '/metrics', callback=self.get_metrics, method='GET')
         self.route(self._base_url + '/sites', callback=self.get_sites, method='GET')
         self.route(self._base_url + '/sites/<site>', callback=self.get_site, method='GET')
         self.route(self._base_url + '/sites/<site>/probes', callback=self.get_probes,
@@ -329,6 +657,18 @@ class DiaApi(bottle.Bottle):
                    callback=self.get_listener_current_signal_state, method='GET')
 
 
+    def get_metrics(self):
+        """Get the api service metrics"""
+        bottle.response.headers['Content-Type'] = 'application/json'
+
+        metrics = {
+            'ingestion': self._ingest_stats,
+            'delivery': self._delivery_stats,
+            'queues': self._queues
+        }
+
+        return json.dumps(metrics, cls=dia_aux.DataDumpEnconder)
+
     def get_sites(self):
         """Get all sites know to this probe"""
         bottle.response.headers['Content-Type'] = 'application/json'
@@ -23,15 +23,32 @@ import logging
 import os
 import sys
 import errno
+import math
+import mmap
+import struct
 import threading
+import select
+import collections
+import multiprocessing
+from multiprocessing import queues as mp_queues
+from multiprocessing import util as mp_util
 import exceptions
 import datetime
+import calendar
+import time
 from string import ascii_letters, digits
 from enum import IntEnum
 import json
+import hashlib
+import tempfile
+import ctypes
+import ctypes.util
+import numpy
+from gnuradio import gr
 from gnuradio import analog
 from gnuradio import blocks
 from gnuradio import filter as grfilter
+from gnuradio import fft as grfft
 
 class BadIdError(Exception):
     """Raised when an object is passed an id with unacceptable
@@ -76,121 +93,390 @@ class DiaMsgType(IntEnum):
     # reporting a change on receiver state
     RCV_SYS_STATE_CHANGE = 4
 
+
+# code to member tables, used to decode the integer codes stored by the
+# state and message classes. Aliases decode to their canonical member, as
+# they do with the enums themselves.
+_SYS_STATUS_BY_CODE = dict((member.value, member) for member in DiaSysStatus)
+_SIG_STATUS_BY_CODE = dict((member.value, member) for member in DiaSigStatus)
+_MSG_TYPE_BY_CODE = dict((member.value, member) for member in DiaMsgType)
+
+
+def _code_to_name(by_code, code):
+    """Return the member name for an integer code, None if there's no code
+    by_code -- code to member table
+    code -- the integer code"""
+
+    if code is None:
+        return None
+
+    return by_code[code].name
+
+
+def _name_to_code(enum_class, name):
+    """Return the integer code for a member name, None if there's no name
+    enum_class -- the enum class
+    name -- the member name"""
+
+    if name is None:
+        return None
+
+    return enum_class[name].value
+
+
+# second last formatted by format_time, and it's formatting, consecutive
+# timestamps mostly fall on the same second
+_format_time_cache = (None, None)
+
+
+def format_time(timestamp):
+    """Return a timestamp in iso format, utc timezone, None if there's no
+    timestamp. Times are kept as seconds since epoch and only formatted when
+    published.
+    timestamp -- seconds since epoch, a float"""
+
+    global _format_time_cache
+
+    if timestamp is None:
+        return None
+
+    second = int(math.floor(timestamp))
+    micro = int((timestamp - second) * 1e6)
+
+    cached_second, formatted = _format_time_cache
+    if cached_second != second:
+        formatted = datetime.datetime.utcfromtimestamp(second).strftime(
+            '%Y-%m-%dT%H:%M:%S')
+        _format_time_cache = (second, formatted)
+
+    return '{s}.{m:06d}'.format(s=formatted, m=micro)
+
+
+def parse_time(text):
+    """Return the seconds since epoch of a time in iso format, utc
+    timezone, None if there's no time
+    text -- the time in iso format, with or without microseconds"""
+
+    if text is None:
+        return None
+
+    if '.' in text:
+        parsed = datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f')
+    else:
+        parsed = datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S')
+
+    return calendar.timegm(parsed.timetuple()) + parsed.microsecond / 1e6
+
+
+# the single precision FFTW library GNU Radio plans it's FFTs with, loaded
+# on first use, False if not available
+_fftw_lib = None
+
+
+def _get_fftw_lib():
+    """Return the FFTW library, None if not available"""
+
+    global _fftw_lib
+
+    if _fftw_lib is None:
+        lib_name = ctypes.util.find_library('fftw3f')
+        try:
+            _fftw_lib = ctypes.CDLL(lib_name) if lib_name else False
+        except OSError, exc:
+            msg = 'Unable to load FFTW with {m}'.format(m=str(exc))
+            logging.warning(msg)
+            _fftw_lib = False
+
+        if not _fftw_lib:
+            msg = 'FFTW library not found, FFTW wisdom not available'
+            logging.warning(msg)
+
+    return _fftw_lib or None
+
+
+def load_fftw_wisdom(path):
+    """Import FFTW wisdom from a file, FFTs planned afterwards on this
+    process reuse it instead of measuring again, returns True if imported.
+    Wisdom is imported on top of what GNU Radio keeps on it's own.
+    path -- path to the wisdom file"""
+
+    fftw_lib = _get_fftw_lib()
+    if fftw_lib is None:
+        return False
+
+    if not os.path.isfile(path):
+        msg = ('FFTW wisdom file {p} not found, FFTs will be planned on'
+               ' startup').format(p=path)
+        logging.warning(msg)
+        return False
+
+    if not fftw_lib.fftwf_import_wisdom_from_filename(path):
+        msg = 'Unable to import FFTW wisdom from {p}'.format(p=path)
+        logging.warning(msg)
+        return False
+
+    msg = 'FFTW wisdom imported from {p}'.format(p=path)
+    logging.debug(msg)
+
+    return True
+
+
+def save_fftw_wisdom(path):
+    """Export the FFTW wisdom of this process to a file, replacing it
+    atomically, returns True if exported
+    path -- path to the wisdom file"""
+
+    fftw_lib = _get_fftw_lib()
+    if fftw_lib is None:
+        return False
+
+    handle, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    os.close(handle)
+
+    if not fftw_lib.fftwf_export_wisdom_to_filename(tmp_path):
+        os.remove(tmp_path)
+        msg = 'Unable to export FFTW wisdom to {p}'.format(p=path)
+        logging.error(msg)
+        return False
+
+    os.rename(tmp_path, path)
+
+    msg = 'FFTW wisdom exported to {p}'.format(p=path)
+    logging.debug(msg)
+
+    return True
+
+
+def set_process_affinity(cores):
+    """Restrict this process, and the threads it starts afterwards, to a
+    set of CPU cores.
+    cores -- list of core numbers"""
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    # a cpu_set_t, 1024 cores
+    word_bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    cpu_set = (ctypes.c_ulong * (1024 / word_bits))()
+    for core in cores:
+        if not 0 <= core < 1024:
+            msg = 'Invalid CPU core {c}'.format(c=core)
+            raise OSError(errno.EINVAL, msg)
+        cpu_set[core / word_bits] |= 1 << (core % word_bits)
+
+    if libc.sched_setaffinity(0, ctypes.sizeof(cpu_set),
+                              ctypes.byref(cpu_set)) != 0:
+        err = ctypes.get_errno()
+        msg = 'Unable to set CPU affinity to {c} with {m}'.format(
+            c=cores, m=os.strerror(err))
+        raise OSError(err, msg)
+
+    msg = 'Process {p} CPU affinity set to {c}'.format(p=os.getpid(),
+                                                        c=cores)
+    logging.debug(msg)
+
+
+def plan_ffts(fft_sizes):
+    """Plan forward FFTs of each size, as logpwrfft blocks do, so their
+    wisdom is on this process
+    fft_sizes -- list of FFT sizes"""
+
+    for fft_size in fft_sizes:
+        start = time.time()
+        grfft.fft_vcc(fft_size, True, (), True)
+        msg = 'Planned FFT of size {s} in {t:.3f}s'.format(
+            s=fft_size, t=time.time() - start)
+        logging.info(msg)
+
+
 class DiaSigInfo(object):
     """Defines signal state info
     This class will contain either current or historical info"""
 
+    __slots__ = ('_status', '_level', '_time', '_snr', '_peak_offset',
+                 '_occupied_bw')
+
+    # units for the level
+    _level_units = 'DBm'
+
     def __init__(self, sig_status=None, sig_level=None, time=None):
         """Initializes the signal information
         sig_status -- a DiaSigStatus object
         sig_level -- signal level, in DBm
         time -- the time when the status change was affected/detected
-            in iso format utc timezone"""
-
-        self._data = {
-            # status of the signal, a DiaSigStatus object
-            'status': None,
-            # time at which the change was effected
-            'time': None,
-            # signal level in DBM
-            'level': None,
-            # units for the level
-            'level_units': 'DBm',
-        }
+            in seconds since epoch"""
+
+        # status of the signal, the code of a DiaSigStatus object
+        self._status = None
+        # signal level in DBM
+        self._level = None
+        # time at which the change was effected
+        self._time = None
+        # signal quality metrics, None if not measured: signal to noise
+        # ratio in dB, offset of the peak from the listener's frequency and
+        # occupied bandwidth, in Hz
+        self._snr = None
+        self._peak_offset = None
+        self._occupied_bw = None
 
         if (sig_status is not None and sig_level is not None and
                 time is not None):
-            if not isinstance(sig_status, DiaSigStatus):
-                msg = 'Invalid signal status type, must be DiaSigStatus'
-                raise TypeError(msg)
-
-            self._data['status'] = sig_status.name
-            self._data['level'] = sig_level
-            self._data['time'] = time
+            self.set(sig_status, sig_level, time)
 
     def set(self, sig_status, sig_level, time):
         """Initializes the signal information
         sig_status -- a DiaSigStatus object
         sig_level -- signal level, in DBm
         time -- the time when the status change was affected/detected
-            in iso format utc timezone"""
+            in seconds since epoch"""
 
         if not isinstance(sig_status, DiaSigStatus):
             msg = 'Invalid signal status type, must be DiaSigStatus'
             raise TypeError(msg)
 
-        self._data['status'] = sig_status.name
-        self._data['level'] = sig_level
-        self._data['time'] = time
-
-        self._data['test'] = datetime.datetime.utcnow().isoformat()
+        self._status = sig_status.value
+        self._level = sig_level
+        self._time = time
 
     def get_json(self):
         """Return a json representation of this data"""
-        return json.dumps(self._data)
+        return json.dumps(self.data_dump())
 
     def get_status(self):
         """returns the status info"""
-        ret_val = eval('DiaSigStatus.' + self._data['status'])
-        return ret_val
+        return _SIG_STATUS_BY_CODE.get(self._status)
 
     def get_time(self):
         """returns the time at which the state change was affected/detected"""
-        return self._data['time']
+        return self._time
 
     def get_level(self):
         """Returns the signal level"""
-        return self._data['level']
+        return self._level
+
+    def set_level(self, sig_level, time):
+        """Updates the signal level, keeping the status
+        sig_level -- signal level, in DBm
+        time -- the time when the level was detected
+            in seconds since epoch"""
+
+        self._level = sig_level
+        self._time = time
+
+    def set_metrics(self, snr, peak_offset, occupied_bw):
+        """Sets the signal quality metrics
+        snr -- signal to noise ratio, in dB, None if not measured
+        peak_offset -- offset of the strongest bin from the listener's
+            frequency, in Hz, None if not measured
+        occupied_bw -- bandwidth holding 99% of the signal power, in Hz,
+            None if not measured"""
+
+        self._snr = snr
+        self._peak_offset = peak_offset
+        self._occupied_bw = occupied_bw
+
+    def get_snr(self):
+        """Returns the signal to noise ratio, in dB"""
+        return self._snr
+
+    def get_peak_offset(self):
+        """Returns the offset of the signal peak from the listener's
+        frequency, in Hz"""
+        return self._peak_offset
+
+    def get_occupied_bw(self):
+        """Returns the occupied bandwidth, in Hz"""
+        return self._occupied_bw
 
     def set_json(self, data):
         """Sets the data from json"""
-        self._data = json.loads(data)
+
+        t_data = json.loads(data)
+
+        self._status = _name_to_code(DiaSigStatus, t_data.get('status'))
+        self._level = t_data.get('level')
+        self._time = parse_time(t_data.get('time'))
+        self._snr = t_data.get('snr')
+        self._peak_offset = t_data.get('peak_offset')
+        self._occupied_bw = t_data.get('occupied_bw')
 
     def data_dump(self):
         """Dumps the data, used for json decoding by nesting objects"""
-        return self._data
+
+        return {
+            'status': _code_to_name(_SIG_STATUS_BY_CODE, self._status),
+            'time': format_time(self._time),
+            'level': self._level,
+            'level_units': self._level_units,
+            'snr': self._snr,
+            'peak_offset': self._peak_offset,
+            'occupied_bw': self._occupied_bw
+        }
+
+    def __getstate__(self):
+        return (self._status, self._level, self._time, self._snr,
+                self._peak_offset, self._occupied_bw)
+
+    def __setstate__(self, state):
+        (self._status, self._level, self._time, self._snr,
+         self._peak_offset, self._occupied_bw) = state
 
 
 class DiaSysInfo(object):
     """Defines receiver and listener state info
     This class will contain either current or historical info"""
 
+    __slots__ = ('_status', '_time')
+
     def __init__(self, sys_status, time):
         """Initializes the system information
         sys_status -- a DiaSysStatus object
         time -- the time when the status change was affected/detected
-            in iso format utc timezone"""
-
-        self._data = {
-            # status of the receiver or listener, a DiaSysStatus object
-            'status': None,
-            # time at which the change was effected
-            'time': None
-        }
+            in seconds since epoch"""
 
         if not isinstance(sys_status, DiaSysStatus):
             msg = 'Invalid system status type, must be DiaSysStatus'
             raise TypeError(msg)
 
-        self._data['status'] = sys_status.name
-        self._data['time'] = time
+        # status of the receiver or listener, the code of a DiaSysStatus
+        # object
+        self._status = sys_status.value
+        # time at which the change was effected
+        self._time = time
 
     def get_json(self):
         """Return a json representation of this data"""
-        return json.dumps(self._data)
+        return json.dumps(self.data_dump())
 
     def get_status(self):
         """returns the status info"""
-        ret_val = eval('DiaSysStatus.' + self._data['status'])
-        return ret_val
+        return _SYS_STATUS_BY_CODE.get(self._status)
 
     def get_time(self):
         """returns the time at which the state change was affected/detected"""
-        return self._data['time']
+        return self._time
 
     def set_json(self, data):
         """Sets the data from json"""
-        self._data = json.loads(data)
+
+        t_data = json.loads(data)
+
+        self._status = _name_to_code(DiaSysStatus, t_data.get('status'))
+        self._time = parse_time(t_data.get('time'))
+
+    def data_dump(self):
+        """Dumps the data, used for json decoding by nesting objects"""
+
+        return {
+            'status': _code_to_name(_SYS_STATUS_BY_CODE, self._status),
+            'time': format_time(self._time)
+        }
+
+    def __getstate__(self):
+        return (self._status, self._time)
+
+    def __setstate__(self, state):
+        self._status, self._time = state
 
 
 class DataDumpEnconder(json.JSONEncoder):
@@ -206,26 +492,36 @@ class DataDumpEnconder(json.JSONEncoder):
 class DiaSigState(object):
     """Defines a signal status, both current state and previous state"""
 
-    def __init__(self):
+    __slots__ = ('_current', '_previous')
+
+    def __init__(self, current=None, previous=None):
         """"Initialize the state,
         both current and previous will be initialized as DiaSysStatus.INIT,
-        and a current time"""
+        and a current time, unless given.
+        current -- the current status, a DiaSigInfo object
+        previous -- the previous status, a DiaSigInfo object"""
 
-        self._data = {
+        if current is not None and previous is not None:
             # the current status, a DiaSigInfo Object
-            'current': None,
+            self._current = current
             # the previous status, a DiaSigInfo Object
-            'previous': None
-        }
+            self._previous = previous
+            return
 
-        current_time = datetime.datetime.utcnow().isoformat()
+        current_time = time.time()
 
         level = 0
 
-        self._data['current'] = DiaSigInfo(DiaSigStatus.PRE_INIT,
-                                           level, current_time)
-        self._data['previous'] = DiaSigInfo(DiaSigStatus.PRE_INIT,
-                                            level, current_time)
+        self._current = DiaSigInfo(DiaSigStatus.PRE_INIT, level, current_time)
+        self._previous = DiaSigInfo(DiaSigStatus.PRE_INIT, level,
+                                    current_time)
+
+    def get_snapshot(self):
+        """Return a new DiaSigState holding the current and previous
+        states, safe to hand over to a queue while this one keeps
+        being updated."""
+
+        return DiaSigState(self._current, self._previous)
 
     def set_new(self, sig_info):
         """Sets the current state to a new state, and updates the previous
@@ -235,8 +531,8 @@ class DiaSigState(object):
             msg = 'Invalid system info type, must be DiaSigInfo'
             raise TypeError(msg)
 
-        self._data['previous'] = self._data['current']
-        self._data['current'] = sig_info
+        self._previous = self._current
+        self._current = sig_info
 
     def update_current(self, sig_info):
         """Updates the current state to, does NOT change previous
@@ -246,25 +542,25 @@ class DiaSigState(object):
             msg = 'Invalid system info type, must be DiaSigInfo'
             raise TypeError(msg)
 
-        self._data['current'] = sig_info
+        self._current = sig_info
 
     def get_current(self):
         """returns the current state
         returns a DiaSigInfo object"""
 
-        return self._data['current']
+        return self._current
 
     def get_previous(self):
         """returns the previous state
         returns a DiaSigInfo object"""
 
-        return self._data['previous']
+        return self._previous
 
     def get_json(self):
         """Return a json representation of this data"""
 
-        current = self._data['current'].get_json()
-        previous = self._data['previous'].get_json()
+        current = self._current.get_json()
+        previous = self._previous.get_json()
 
         ret_data = {
             'current': current,
@@ -284,306 +580,1850 @@ class DiaSigState(object):
         previous = DiaSigInfo()
         previous.set_json(t_data['previous'])
 
-        self._data['current'] = current
-        self._data['previous'] = previous
+        self._current = current
+        self._previous = previous
 
     def data_dump(self):
         """Dumps the data, used for json decoding by nesting objects"""
-        return self._data
 
-    def __getitem__(self, item):
-        return self._data[item]
+        return {
+            'current': self._current,
+            'previous': self._previous
+        }
 
+    def __getitem__(self, item):
+        if item == 'current':
+            return self._current
+        elif item == 'previous':
+            return self._previous
 
-class DiaListenerMsg(object):
-    """Class to encapsulate data sent by a listener"""
+        raise KeyError(item)
 
-    def __init__(self, msg_type=None, objid=None, payload=None):
-        """initialize the object
-        msg_type -- message type, a DiaMsgType object
-        objid -- Listener Id
-        payload -- data to send, either a json string or a DiaListernerMsg"""
+    def __getstate__(self):
+        return (self._current, self._previous)
 
-        self._data = {
-            # the type of signal to send, of type DiaMsgType
-            'msg_type': None,
+    def __setstate__(self, state):
+        self._current, self._previous = state
 
-            # the id for the listener that originated the message
-            'id': None,
 
-            # the payload of the message
-            'payload': None
-        }
+class DiaMsg(object):
+    """Class to encapsulate data sent between diatomite components.
+    A single flat record, created by a listener or a receiver and routed
+    as is up to the api service. Each component it goes through only
+    stamps it's own id, the payload is kept as an object and is only
+    serialized when leaving the system (eg: on the api server)."""
 
-        if (msg_type is not None and objid is not None and
-                payload is not None):
+    __slots__ = ('_msg_type', '_site_id', '_probe_id', '_source_id',
+                 '_listener_id', '_payload', '_time', '_seq', '_run')
 
+    def __init__(self, msg_type=None, payload=None, source_id=None,
+                 listener_id=None, probe_id=None, site_id=None, seq=None,
+                 run=None):
+        """initialize the object
+        msg_type -- message type, a DiaMsgType object
+        payload -- data to send, a DiaSigState snapshot for signal messages
+            or a DiaSysState snapshot for system state messages
+        source_id -- id of the radio source that sent the message
+        listener_id -- id of the listener that sent the message, None for
+            messages from a radio source
+        probe_id -- id of the probe that sent the message
+        site_id -- id of the site that sent the message
+        seq -- sequence number of the message, counted for each listener
+        run -- id of the listener's run the sequence number belongs to,
+            set each time the listener is started"""
+
+        # the type of signal to send, the code of a DiaMsgType object
+        self._msg_type = None
+
+        if msg_type is not None:
             if not isinstance(msg_type, DiaMsgType):
                 msg = 'Invalid message type, must be DiaMsgType'
                 raise TypeError(msg)
 
-            self._data['id'] = objid
-            self._data['msg_type'] = msg_type.name
-            self._data['payload'] = payload
+            self._msg_type = msg_type.value
+
+        # ids for the components that originated and routed the message
+        self._site_id = site_id
+        self._probe_id = probe_id
+        self._source_id = source_id
+        self._listener_id = listener_id
+
+        # the payload of the message, a DiaSigState or DiaSysState
+        self._payload = payload
+
+        # time at which the message was created, seconds since epoch
+        self._time = time.time()
+
+        # sequence number, increasing by one on each message sent by a
+        # listener, starting at 1, None for messages from a radio source
+        self._seq = seq
+
+        # the listener's run, sequence numbers start over on each run, None
+        # for messages sent before the listener was started
+        self._run = run
 
     def get_msg_type(self):
         """Return the message type, a DiaMsgType"""
-        ret_val = eval('DiaMsgType.' + self._data['msg_type'])
-        return ret_val
+        return _MSG_TYPE_BY_CODE.get(self._msg_type)
+
+    def set_site_id(self, site_id):
+        """Set the id of the site routing the message
+        site_id -- the site id"""
+        self._site_id = site_id
 
-    def get_id(self):
-        """Return sending listener's id"""
-        return self._data['id']
+    def get_site_id(self):
+        """Return the id of the site that routed the message"""
+        return self._site_id
+
+    def set_probe_id(self, probe_id):
+        """Set the id of the probe routing the message
+        probe_id -- the probe id"""
+        self._probe_id = probe_id
+
+    def get_probe_id(self):
+        """Return the id of the probe that routed the message"""
+        return self._probe_id
+
+    def set_source_id(self, source_id):
+        """Set the id of the radio source routing the message
+        source_id -- the radio source id"""
+        self._source_id = source_id
+
+    def get_source_id(self):
+        """Return the id of the radio source that sent the message"""
+        return self._source_id
+
+    def get_listener_id(self):
+        """Return the id of the listener that sent the message"""
+        return self._listener_id
 
     def get_payload(self):
         """Return the payload"""
-        return self._data['payload']
+        return self._payload
+
+    def get_time(self):
+        """Return the time at which the message was created,
+        in seconds since epoch"""
+        return self._time
+
+    def set_seq(self, seq):
+        """Set the message sequence number
+        seq -- the sequence number"""
+        self._seq = seq
+
+    def get_seq(self):
+        """Return the message sequence number, None if not set"""
+        return self._seq
+
+    def get_run(self):
+        """Return the id of the listener's run the sequence number belongs
+        to, None if not set"""
+        return self._run
 
     def get_json(self):
         """Return a json representation of this data"""
-        return json.dumps(self._data)
+        return json.dumps(self, cls=DataDumpEnconder)
 
-    def set_json(self, data):
-        """Sets the data from json"""
-        self._data = json.loads(data)
+    def data_dump(self):
+        """Dumps the data, used for json decoding by nesting objects"""
 
+        return {
+            'msg_type': _code_to_name(_MSG_TYPE_BY_CODE, self._msg_type),
+            'site_id': self._site_id,
+            'probe_id': self._probe_id,
+            'source_id': self._source_id,
+            'listener_id': self._listener_id,
+            'payload': self._payload,
+            'time': self._time,
+            'seq': self._seq,
+            'run': self._run
+        }
 
-class DiaSiteMsg(object):
-    """Class to encapsulate data sent by a site"""
+    def __getstate__(self):
+        return (self._msg_type, self._site_id, self._probe_id,
+                self._source_id, self._listener_id, self._payload,
+                self._time, self._seq, self._run)
 
-    def __init__(self, msg_type=None, objid=None, payload=None):
-        """initialize the object
-        msg_type -- message type, a DiaMsgType object
-        objid -- probe Id
-        payload -- data to send, either a json string or a DiaProbeMsg"""
+    def __setstate__(self, state):
+        (self._msg_type, self._site_id, self._probe_id, self._source_id,
+         self._listener_id, self._payload, self._time, self._seq,
+         self._run) = state
 
-        self._data = {
-            # the type of signal to send, of type DiaMsgType
-            'msg_type': None,
 
-            # the id for the site that originated the message
-            'id': None,
+class DiaSysState(object):
+    """Defines a receiver and listener status, both current state
+    and the previous state"""
 
-            # the payload of the message, json or dict
-            'payload': None
-        }
+    __slots__ = ('_current', '_previous')
 
-        if (msg_type is not None and objid is not None and
-                payload is not None):
+    def __init__(self, current=None, previous=None):
+        """"Initialize the state,
+        both current and previous will be initialized as DiaSysStatus.INIT,
+        and a current time, unless given.
+        current -- the current status, a DiaSysInfo object
+        previous -- the previous status, a DiaSysInfo object"""
 
-            if not isinstance(msg_type, DiaMsgType):
-                msg = 'Invalid message type, must be DiaMsgType'
-                raise TypeError(msg)
+        if current is not None and previous is not None:
+            # the current status, a DiaSysInfo Object
+            self._current = current
+            # the previous status, a DiaSysInfo Object
+            self._previous = previous
+            return
 
-            self._data['id'] = objid
-            self._data['msg_type'] = msg_type.name
+        current_time = time.time()
 
-            if isinstance(payload, DiaProbeMsg):
-                self._data['payload'] = payload.get_json()
-            else:
-                self._data['payload'] = payload
+        # the current status, a DiaSysInfo Object
+        self._current = DiaSysInfo(DiaSysStatus.INIT, current_time)
+        # the previous status, a DiaSysInfo Object
+        self._previous = DiaSysInfo(DiaSysStatus.INIT, current_time)
 
-    def get_msg_type(self):
-        """Return the message type, a DiaMsgType"""
-        ret_val = eval('DiaMsgType.' + self._data['msg_type'])
-        return ret_val
+    def get_snapshot(self):
+        """Return a new DiaSysState holding the current and previous
+        states, safe to hand over to a queue while this one keeps
+        being updated."""
 
-    def get_id(self):
-        """Return sending radio receiver's id"""
-        return self._data['id']
+        return DiaSysState(self._current, self._previous)
 
-    def get_payload(self):
-        """Return the payload"""
-        return self._data['payload']
+    def set_curent(self, sys_info):
+        """Sets the new current state to a new state, and updates the previous
+        sys_info -- a DiaSysInfo object"""
+
+        if not isinstance(sys_info, DiaSysInfo):
+            msg = 'Invalid system info type, must be DiaSysInfo'
+            raise TypeError(msg)
+
+        self._previous = self._current
+        self._current = sys_info
+
+    def get_current(self):
+        """returns the current state
+        returns a DiaSysInfo object"""
+
+        return self._current
+
+    def get_previous(self):
+        """returns the previous state
+        returns a DiaSysInfo object"""
+
+        return self._previous
 
     def get_json(self):
         """Return a json representation of this data"""
-        return json.dumps(self._data)
+
+        current = self._current.get_json()
+        previous = self._previous.get_json()
+
+        ret_data = {
+            'current': current,
+            'previous': previous
+            }
+
+        return json.dumps(ret_data)
 
     def set_json(self, data):
         """Sets the data from json"""
-        self._data = json.loads(data)
+        t_data = json.loads(data)
 
+        current_time = time.time()
 
-class DiaProbeMsg(object):
-    """Class to encapsulate data sent by a probe"""
+        current = DiaSysInfo(DiaSysStatus.INIT, current_time)
+        current.set_json(t_data['current'])
 
-    def __init__(self, msg_type=None, objid=None, payload=None):
-        """initialize the object
-        msg_type -- message type, a DiaMsgType object
-        objid -- probe Id
-        payload -- data to send, either a json string or a DiaReceiverMsg"""
+        previous = DiaSysInfo(DiaSysStatus.INIT, current_time)
+        previous.set_json(t_data['previous'])
 
-        self._data = {
-            # the type of signal to send, of type DiaMsgType
-            'msg_type': None,
+        self._current = current
+        self._previous = previous
 
-            # the id for the probe that originated the message
-            'id': None,
+    def data_dump(self):
+        """Dumps the data, used for json decoding by nesting objects"""
 
-            # the payload of the message, json or dict
-            'payload': None
+        return {
+            'current': self._current,
+            'previous': self._previous
         }
 
-        if (msg_type is not None and id is not None and
-                payload is not None):
+    def __getstate__(self):
+        return (self._current, self._previous)
 
-            if not isinstance(msg_type, DiaMsgType):
-                msg = 'Invalid message type, must be DiaMsgType'
-                raise TypeError(msg)
+    def __setstate__(self, state):
+        self._current, self._previous = state
 
-            self._data['id'] = objid
-            self._data['msg_type'] = msg_type.name
 
-            if isinstance(payload, DiaRadioReceiverMsg):
-                self._data['payload'] = payload.get_json()
-            else:
-                self._data['payload'] = payload
+class DiaMsgBatch(object):
+    """Class to group several DiaMsg objects, so that they are sent
+    through a queue as a single item."""
 
-    def get_msg_type(self):
-        """Return the message type, a DiaMsgType"""
-        ret_val = eval('DiaMsgType.' + self._data['msg_type'])
-        return ret_val
+    def __init__(self, msgs=None):
+        """initialize the object
+        msgs -- a list of DiaMsg objects"""
 
-    def get_id(self):
-        """Return sending radio receiver's id"""
-        return self._data['id']
+        if msgs is None:
+            msgs = []
 
-    def get_payload(self):
-        """Return the payload"""
-        return self._data['payload']
+        self._msgs = msgs
 
-    def get_json(self):
-        """Return a json representation of this data"""
-        return json.dumps(self._data)
+    def append(self, msg):
+        """Add a message to the batch
+        msg -- a DiaMsg object"""
 
-    def set_json(self, data):
-        """Sets the data from json"""
-        self._data = json.loads(data)
+        if not isinstance(msg, DiaMsg):
+            err_msg = 'Invalid message, must be DiaMsg'
+            raise TypeError(err_msg)
 
+        self._msgs.append(msg)
 
-class DiaRadioReceiverMsg(object):
-    """Class to encapsulate data sent by a receiver"""
+    def get_msgs(self):
+        """Return the list of messages on the batch"""
+        return self._msgs
 
-    def __init__(self, msg_type=None, objid=None, payload=None):
+    def __len__(self):
+        return len(self._msgs)
+
+    def __iter__(self):
+        return iter(self._msgs)
 
-        """initialize the object
-        msg_type -- message type, a DiaMsgType object
-        objid -- RadioReceiver Id
-        payload -- data to send, either a json string or a DiaListernerMsg"""
 
-        self._data = {
-            # the type of signal to send, of type DiaMsgType
-            'msg_type': None,
+class DiaQueue(mp_queues.Queue):
+    """A bounded multiprocessing queue for DiaMsg and DiaMsgBatch objects,
+    with a drop policy for each message class.
+    Signal level messages (LNR_SIG_STATE) are held back by the producer
+    while the queue is full, and either coalesced, keeping only the latest
+    one for each listener, or dropped oldest first. Held back messages are
+    put on the next put, or by a thread retrying until there's room,
+    without ever blocking.
+    All other messages and objects (state changes, commands) are never
+    dropped, putting them blocks while the queue is full.
+    Counters are kept in shared memory, so they can be read on any
+    process."""
+
+    # policies for signal level messages
+    POLICY_COALESCE = 'coalesce'
+    POLICY_DROP_OLDEST = 'drop_oldest'
+    LEVEL_POLICIES = (POLICY_COALESCE, POLICY_DROP_OLDEST)
+
+    # message types that may be held back and dropped
+    _level_msg_types = (DiaMsgType.LNR_SIG_STATE,)
+
+    # message types superseding the held back levels of their sender
+    _superseding_msg_types = (DiaMsgType.LNR_SIG_STATUS_CHANGE,)
+
+    # maximum level messages held back by each producer, for drop_oldest
+    _max_pending = 1000
+
+    # time between retries to put the held back messages, in seconds
+    _flush_interval = 0.1
+
+    # position of each counter, puts and dropped count messages, the
+    # ones in a DiaMsgBatch included, high_water counts queue items
+    _counter_names = ('puts', 'full', 'dropped', 'high_water')
+
+    def __init__(self, name, maxsize=0, level_policy=POLICY_COALESCE):
+        """Initialize the queue
+        name -- name for the queue, used on the counters
+        maxsize -- maximum number of items on the queue, 0 for unbounded
+        level_policy -- policy for signal level messages on a full queue,
+            one of LEVEL_POLICIES"""
+
+        if level_policy not in self.LEVEL_POLICIES:
+            msg = 'Invalid level policy {p}'.format(p=level_policy)
+            raise ValueError(msg)
+
+        mp_queues.Queue.__init__(self, maxsize)
+
+        self._name = name
+        self._max_items = maxsize
+        self._level_policy = level_policy
+
+        self._counters = multiprocessing.Array('l', len(self._counter_names))
+
+        # level messages held back by this producer, and the thread
+        # retrying to put them
+        self._pending = None
+        self._pending_lock = None
+        self._flush_thread = None
+        self._reset_pending()
+
+        # each producer process holds back it's own messages
+        mp_util.register_after_fork(self, DiaQueue._reset_pending)
+
+    def _reset_pending(self):
+        """Start with no held back messages"""
+
+        if self._level_policy == self.POLICY_COALESCE:
+            self._pending = collections.OrderedDict()
+        else:
+            self._pending = collections.deque()
+
+        self._pending_lock = threading.Lock()
+        self._flush_thread = None
+
+    @staticmethod
+    def _get_msg_key(msg):
+        """Return the key identifying the sender of a message"""
+
+        return (msg.get_site_id(), msg.get_probe_id(), msg.get_source_id(),
+                msg.get_listener_id())
+
+    def _count(self, counter, value=1):
+        """Increment a counter
+        counter -- the counter name
+        value -- value to add"""
+
+        index = self._counter_names.index(counter)
+        with self._counters.get_lock():
+            self._counters[index] += value
+
+    def _count_put(self, item):
+        """Count the messages of an item put on the queue, updating the
+        high water mark
+        item -- the item put"""
+
+        if isinstance(item, DiaMsgBatch):
+            msg_qty = len(item)
+        else:
+            msg_qty = 1
+
+        try:
+            qsize = mp_queues.Queue.qsize(self)
+        except NotImplementedError:
+            # qsize is not available on all platforms
+            qsize = 0
+
+        index = self._counter_names.index('high_water')
+        with self._counters.get_lock():
+            self._counters[self._counter_names.index('puts')] += msg_qty
+            if qsize > self._counters[index]:
+                self._counters[index] = qsize
+
+    def _hold_back(self, msg):
+        """Hold back a level message, applying the level policy
+        msg -- a DiaMsg object"""
+
+        if self._level_policy == self.POLICY_COALESCE:
+            key = self._get_msg_key(msg)
+            if self._pending.pop(key, None) is not None:
+                self._count('dropped')
+            self._pending[key] = msg
+        else:
+            if len(self._pending) >= self._max_pending:
+                self._pending.popleft()
+                self._count('dropped')
+            self._pending.append(msg)
 
-            # the id for the RadioReceiver that originated the message
-            'id': None,
+        self._start_flush_thread()
 
-            # the payload of the message, json or dict
-            'payload': None
+    def _start_flush_thread(self):
+        """Start retrying to put the held back messages, if not already
+        retrying, called holding the pending lock"""
+
+        if self._flush_thread is not None:
+            return
+
+        self._flush_thread = threading.Thread(target=self._retry_flush,
+                                              name=self._name + '_flush')
+        self._flush_thread.daemon = True
+        self._flush_thread.start()
+
+    def _retry_flush(self):
+        """Retry putting the held back messages until they are all on the
+        queue, or dropped"""
+
+        while True:
+            time.sleep(self._flush_interval)
+
+            with self._pending_lock:
+                self._flush_pending()
+                if not self._pending:
+                    self._flush_thread = None
+                    return
+
+    def _discard_pending(self, msg):
+        """Drop the held back level messages superseded by a signal status
+        change, other messages do not carry a signal level
+        msg -- a DiaMsg object"""
+
+        if msg.get_msg_type() not in self._superseding_msg_types:
+            return
+
+        key = self._get_msg_key(msg)
+
+        if self._level_policy == self.POLICY_COALESCE:
+            if self._pending.pop(key, None) is not None:
+                self._count('dropped')
+        else:
+            kept = [p_msg for p_msg in self._pending
+                    if self._get_msg_key(p_msg) != key]
+            dropped = len(self._pending) - len(kept)
+            if dropped:
+                self._pending = collections.deque(kept)
+                self._count('dropped', dropped)
+
+    def _flush_pending(self):
+        """Try to put the held back messages on the queue, as a single
+        batch, without blocking"""
+
+        if not self._pending:
+            return
+
+        if self._level_policy == self.POLICY_COALESCE:
+            msgs = self._pending.values()
+        else:
+            msgs = list(self._pending)
+
+        batch = DiaMsgBatch(msgs)
+        try:
+            self.put_nowait(batch)
+        except mp_queues.Full:
+            return
+
+        self._pending.clear()
+        self._count_put(batch)
+
+    def _put_blocking(self, item):
+        """Put an item on the queue, waiting for room if needed
+        item -- the item to put"""
+
+        if self.full():
+            self._count('full')
+
+        self.put(item)
+        self._count_put(item)
+
+    def put_msg(self, item):
+        """Put an item on the queue applying the drop policies
+        item -- a DiaMsg or DiaMsgBatch object, other objects are never
+            dropped"""
+
+        if isinstance(item, DiaMsgBatch):
+            msgs = item.get_msgs()
+        elif isinstance(item, DiaMsg):
+            msgs = [item]
+        else:
+            self._put_blocking(item)
+            return
+
+        state_msgs = []
+
+        with self._pending_lock:
+            # held back messages go first, keeping the order
+            self._flush_pending()
+
+            if not self._pending:
+                try:
+                    self.put_nowait(item)
+                except mp_queues.Full:
+                    self._count('full')
+                else:
+                    self._count_put(item)
+                    return
+
+            for msg in msgs:
+                if msg.get_msg_type() in self._level_msg_types:
+                    self._hold_back(msg)
+                else:
+                    self._discard_pending(msg)
+                    state_msgs.append(msg)
+
+        # state changes are never dropped
+        self._put_state_msgs(state_msgs)
+
+    def _put_state_msgs(self, state_msgs):
+        """Put state change messages on the queue, waiting for room if
+        needed
+        state_msgs -- a list of DiaMsg objects"""
+
+        if len(state_msgs) == 1:
+            self._put_blocking(state_msgs[0])
+        elif state_msgs:
+            self._put_blocking(DiaMsgBatch(state_msgs))
+
+    def _discard_superseded(self, msgs):
+        """Drop the held back level messages superseded by signal status
+        changes sent elsewhere
+        msgs -- a list of DiaMsg objects"""
+
+        with self._pending_lock:
+            for msg in msgs:
+                self._discard_pending(msg)
+
+    def get_name(self):
+        """Return the queue name"""
+        return self._name
+
+    def get_stats(self):
+        """Return the queue counters, as a dictionary"""
+
+        with self._counters.get_lock():
+            stats = dict(zip(self._counter_names, self._counters[:]))
+
+        stats['name'] = self._name
+        stats['maxsize'] = self._max_items
+        stats['level_policy'] = self._level_policy
+
+        return stats
+
+    def data_dump(self):
+        """Dumps the data, used for json decoding by nesting objects"""
+        return self.get_stats()
+
+
+class DiaReportRules(object):
+    """Rules deciding when a listener reports it's signal level.
+    A level is reported when it moved at least min_change dB from the last
+    reported level, and at least min_interval seconds went by since the
+    last report. A level is always reported after max_silence seconds
+    without a report, as a heartbeat."""
+
+    def __init__(self, min_change=0, min_interval=0, max_silence=0):
+        """Initialize the rules
+        min_change -- minimum level change to report, in dB, 0 to report
+            every level
+        min_interval -- minimum time between reports, in seconds
+        max_silence -- maximum time without a report, in seconds, 0 for
+            no heartbeat"""
+
+        self._min_change = None
+        self._min_interval = None
+        self._max_silence = None
+
+        self.set_rules(min_change, min_interval, max_silence)
+
+        # last reported level, and when it was reported
+        self._last_level = None
+        self._last_time = None
+
+    def set_rules(self, min_change, min_interval, max_silence):
+        """Set the rules
+        min_change -- minimum level change to report, in dB, 0 to report
+            every level
+        min_interval -- minimum time between reports, in seconds
+        max_silence -- maximum time without a report, in seconds, 0 for
+            no heartbeat"""
+
+        for value in (min_change, min_interval, max_silence):
+            if value < 0:
+                msg = 'Report rules must not be negative, got {v}'.format(v=value)
+                raise ValueError(msg)
+
+        self._min_change = float(min_change)
+        self._min_interval = float(min_interval)
+        self._max_silence = float(max_silence)
+
+    def get_min_change(self):
+        """Return the minimum level change to report, in dB"""
+        return self._min_change
+
+    def get_min_interval(self):
+        """Return the minimum time between reports, in seconds"""
+        return self._min_interval
+
+    def get_max_silence(self):
+        """Return the maximum time without a report, in seconds"""
+        return self._max_silence
+
+    def reset(self, level, timestamp):
+        """Record a level as reported, eg: sent on a state change
+        level -- the reported level
+        timestamp -- time of the report, in seconds"""
+
+        self._last_level = level
+        self._last_time = timestamp
+
+    def check(self, level, timestamp):
+        """Return True if a level is to be reported, recording it as
+        reported
+        level -- the current level
+        timestamp -- the current time, in seconds"""
+
+        if self._last_time is None:
+            self.reset(level, timestamp)
+            return True
+
+        elapsed = timestamp - self._last_time
+
+        if self._max_silence and elapsed >= self._max_silence:
+            report = True
+        elif elapsed < self._min_interval:
+            report = False
+        else:
+            report = abs(level - self._last_level) >= self._min_change
+
+        if report:
+            self.reset(level, timestamp)
+
+        return report
+
+
+class DiaSigDetector(object):
+    """State machine deciding if a listener's signal is present, with
+    hysteresis and dwell times.
+    An absent signal becomes present when the level stays at or above
+    on_threshold for on_dwell seconds, a present signal becomes absent when
+    the level stays below off_threshold for off_dwell seconds. A crossing
+    that does not last the dwell time is counted as suppressed."""
+
+    def __init__(self, on_threshold=0, off_threshold=None, on_dwell=0,
+                 off_dwell=0):
+        """Initialize the detector
+        on_threshold -- level at or above which the signal becomes present
+        off_threshold -- level below which the signal becomes absent, not
+            above on_threshold, None for the same as on_threshold
+        on_dwell -- time the level must stay at or above on_threshold, in
+            seconds
+        off_dwell -- time the level must stay below off_threshold, in
+            seconds"""
+
+        self._on_threshold = None
+        self._off_threshold = None
+        self._on_dwell = None
+        self._off_dwell = None
+
+        self.set_rules(on_threshold, off_threshold, on_dwell, off_dwell)
+
+        # current decision, None until the first level is checked
+        self._status = None
+
+        # when the level crossed the threshold, while waiting for the dwell
+        # time, None if not waiting
+        self._crossing_time = None
+
+        self._stats = {
+            'to_present': 0,
+            'to_absent': 0,
+            'suppressed': 0
         }
 
-        if (msg_type is not None and objid is not None and
-                payload is not None):
-            if not isinstance(msg_type, DiaMsgType):
-                msg = 'Invalid message type, must be DiaMsgType'
-                raise TypeError(msg)
+    def set_rules(self, on_threshold, off_threshold, on_dwell, off_dwell):
+        """Set the thresholds and dwell times
+        on_threshold -- level at or above which the signal becomes present
+        off_threshold -- level below which the signal becomes absent, not
+            above on_threshold, None for the same as on_threshold
+        on_dwell -- time the level must stay at or above on_threshold, in
+            seconds
+        off_dwell -- time the level must stay below off_threshold, in
+            seconds"""
+
+        if off_threshold is None:
+            off_threshold = on_threshold
+
+        if off_threshold > on_threshold:
+            msg = ('Off threshold {off} must not be above on threshold'
+                   ' {on}').format(off=off_threshold, on=on_threshold)
+            raise ValueError(msg)
+
+        for value in (on_dwell, off_dwell):
+            if value < 0:
+                msg = 'Dwell times must not be negative, got {v}'.format(v=value)
+                raise ValueError(msg)
+
+        self._on_threshold = float(on_threshold)
+        self._off_threshold = float(off_threshold)
+        self._on_dwell = float(on_dwell)
+        self._off_dwell = float(off_dwell)
+
+    def get_on_threshold(self):
+        """Return the level at or above which the signal becomes present"""
+        return self._on_threshold
+
+    def get_off_threshold(self):
+        """Return the level below which the signal becomes absent"""
+        return self._off_threshold
+
+    def get_on_dwell(self):
+        """Return the time the level must stay at or above the on
+        threshold, in seconds"""
+        return self._on_dwell
+
+    def get_off_dwell(self):
+        """Return the time the level must stay below the off threshold,
+        in seconds"""
+        return self._off_dwell
 
-            self._data['id'] = objid
-            self._data['msg_type'] = msg_type.name
+    def get_status(self):
+        """Return the current decision, a DiaSigStatus, None if no level
+        was checked yet"""
+        return self._status
+
+    def get_stats(self):
+        """Return a copy of the transition counters"""
+        return dict(self._stats)
+
+    def check(self, level, timestamp):
+        """Return the signal status, DiaSigStatus.PRESENT or
+        DiaSigStatus.ABSENT, after a new level
+        level -- the current level
+        timestamp -- the current time, in seconds"""
+
+        if self._status is None:
+            # first level, decide right away
+            if level >= self._on_threshold:
+                self._status = DiaSigStatus.PRESENT
+            else:
+                self._status = DiaSigStatus.ABSENT
+            return self._status
 
-            if isinstance(payload, DiaListenerMsg):
-                self._data['payload'] = payload.get_json()
+        if self._status == DiaSigStatus.PRESENT:
+            crossed = level < self._off_threshold
+            dwell = self._off_dwell
+        else:
+            crossed = level >= self._on_threshold
+            dwell = self._on_dwell
+
+        if not crossed:
+            if self._crossing_time is not None:
+                # went back before the dwell time, a flap
+                self._crossing_time = None
+                self._stats['suppressed'] += 1
+            return self._status
+
+        if self._crossing_time is None:
+            self._crossing_time = timestamp
+
+        if timestamp - self._crossing_time >= dwell:
+            self._crossing_time = None
+            if self._status == DiaSigStatus.PRESENT:
+                self._status = DiaSigStatus.ABSENT
+                self._stats['to_absent'] += 1
             else:
-                self._data['payload'] = payload
+                self._status = DiaSigStatus.PRESENT
+                self._stats['to_present'] += 1
 
-    def get_msg_type(self):
-        """Return the message type, a DiaMsgType"""
-        ret_val = eval('DiaMsgType.' + self._data['msg_type'])
-        return ret_val
+        return self._status
 
-    def get_id(self):
-        """Return sending radio receiver's id"""
-        return self._data['id']
 
-    def get_payload(self):
-        """Return the payload"""
-        return self._data['payload']
+class DiaLaneQueue(DiaQueue):
+    """A DiaQueue with a separate bulk lane for signal level messages.
+    State changes and other objects go on the priority lane, the queue
+    itself, while level messages go on the bulk lane, with the level
+    policy. Getting from the queue always services the priority lane
+    first, so state changes are not held behind a backlog of level
+    updates."""
 
-    def get_json(self):
-        """Return a json representation of this data"""
-        return json.dumps(self._data)
+    # message types sent on the bulk lane
+    bulk_msg_types = (DiaMsgType.LNR_SIG_STATE,)
 
-    def set_json(self, data):
-        """Sets the data from json"""
-        self._data = json.loads(data)
+    def __init__(self, name, maxsize=0, level_policy=DiaQueue.POLICY_COALESCE):
+        """Initialize the queue
+        name -- name for the queue, used on the counters
+        maxsize -- maximum number of items on each lane, 0 for unbounded
+        level_policy -- policy for signal level messages on a full bulk
+            lane, one of LEVEL_POLICIES"""
 
+        DiaQueue.__init__(self, name, maxsize, level_policy)
 
-class DiaSysState(object):
-    """Defines a receiver and listener status, both current state
-    and the previous state"""
+        self._bulk = DiaQueue(name + '_bulk', maxsize, level_policy)
 
-    def __init__(self):
-        """"Initialize the state,
-        both current and previous will be initialized as DiaSysStatus.INIT,
-        and a current time"""
+    def put_msg(self, item):
+        """Put an item on the right lane, applying the drop policies
+        item -- a DiaMsg or DiaMsgBatch object, other objects go on the
+            priority lane"""
 
-        self._data = {
-            # the current status, a DiaSysInfo Object
-            'current': None,
-            # the previous status, a DiaSysInfo Object
-            'previous': None
-        }
+        if isinstance(item, DiaMsgBatch):
+            msgs = item.get_msgs()
+        elif isinstance(item, DiaMsg):
+            msgs = [item]
+        else:
+            self._put_blocking(item)
+            return
+
+        bulk_msgs = []
+        priority_msgs = []
+        for msg in msgs:
+            if msg.get_msg_type() in self.bulk_msg_types:
+                bulk_msgs.append(msg)
+            else:
+                priority_msgs.append(msg)
 
-        current_time = datetime.datetime.utcnow().isoformat()
+        if priority_msgs:
+            # signal status changes supersede held back level messages
+            self._bulk._discard_superseded(priority_msgs)
+            self._put_state_msgs(priority_msgs)
 
-        self._data['current'] = DiaSysInfo(DiaSysStatus.INIT, current_time)
-        self._data['previous'] = DiaSysInfo(DiaSysStatus.INIT, current_time)
+        if len(bulk_msgs) == 1:
+            self._bulk.put_msg(bulk_msgs[0])
+        elif bulk_msgs:
+            self._bulk.put_msg(DiaMsgBatch(bulk_msgs))
 
-    def set_curent(self, sys_info):
-        """Sets the new current state to a new state, and updates the previous
-        sys_info -- a DiaSysInfo object"""
+    def get(self, block=True, timeout=None):
+        """Remove and return an item, from the priority lane if there's one
+        block -- wait for an item
+        timeout -- maximum time to wait, in seconds, None to wait forever"""
 
-        if not isinstance(sys_info, DiaSysInfo):
-            msg = 'Invalid system info type, must be DiaSysInfo'
-            raise TypeError(msg)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
 
-        self._data['previous'] = self._data['current']
-        self._data['current'] = sys_info
+        while True:
+            try:
+                return DiaQueue.get(self, False)
+            except mp_queues.Empty:
+                pass
 
-    def get_current(self):
-        """returns the current state
-        returns a DiaSysInfo object"""
+            try:
+                return self._bulk.get(False)
+            except mp_queues.Empty:
+                pass
 
-        return self._data['current']
+            if not block:
+                raise mp_queues.Empty
 
-    def get_json(self):
-        """Return a json representation of this data"""
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise mp_queues.Empty
 
-        current = self._data['current'].get_json()
-        previous = self._data['previous'].get_json()
+            # wait for either lane to have data
+            select.select([self._reader, self._bulk._reader], [], [],
+                          remaining)
 
-        ret_data = {
-            'current': current,
-            'previous': previous
-            }
+    def qsize(self):
+        """Return the approximate number of items on both lanes"""
+        return DiaQueue.qsize(self) + self._bulk.qsize()
 
-        return json.dumps(ret_data)
+    def empty(self):
+        """Return True if both lanes are empty"""
+        return DiaQueue.empty(self) and self._bulk.empty()
 
-    def set_json(self, data):
-        """Sets the data from json"""
-        t_data = json.loads(data)
+    def get_stats(self):
+        """Return the queue counters, for both lanes, as a dictionary"""
 
-        current_time = datetime.datetime.utcnow().isoformat()
+        stats = DiaQueue.get_stats(self)
+        stats['bulk'] = self._bulk.get_stats()
 
-        current = DiaSysInfo(DiaSysStatus.INIT, current_time)
-        current.set_json(t_data['current'])
+        return stats
 
-        previous = DiaSysInfo(DiaSysStatus.INIT, current_time)
-        previous.set_json(t_data['previous'])
 
-        self._data['current'] = current
-        self._data['previous'] = previous
+class DiaLevelTable(object):
+    """Shared memory table with the latest signal level of each listener.
+    The table is an anonymous shared memory map, to be created before the
+    radio source and api service subprocesses are started, with a fixed
+    size slot per listener.
+    Slots are written in place by the radio source subprocesses and read
+    by the api service. Each slot has a sequence number, odd while the slot
+    is being written, allowing readers to detect and retry torn reads."""
+
+    # sequence number at the start of each slot
+    _seq_format = struct.Struct('=I')
+
+    # slot data: signal status code, signal level, time (seconds since epoch),
+    # and the signal quality metrics, snr, peak offset and occupied
+    # bandwidth (NaN when not measured)
+    _data_format = struct.Struct('=iddddd')
+
+    _slot_size = _seq_format.size + _data_format.size
+
+    # attempts to read a slot while it's being written
+    _read_retries = 100
+
+    def __init__(self, keys):
+        """Create the table
+        keys -- a list of (radio source id, listener id), one per slot"""
+
+        self._slots = {}
+
+        for source_id, listener_id in keys:
+            slot_key = (source_id.lower(), listener_id.lower())
+            if slot_key not in self._slots:
+                self._slots[slot_key] = len(self._slots)
+
+        table_size = max(len(self._slots), 1) * self._slot_size
+
+        # anonymous maps are shared with subprocesses started afterwards
+        self._mmap = mmap.mmap(-1, table_size)
+
+    def get_slot(self, source_id, listener_id):
+        """Return the slot for a listener, None if there's no slot for it
+        source_id -- the radio source id
+        listener_id -- the listener id"""
+
+        return self._slots.get((source_id.lower(), listener_id.lower()))
+
+    def write(self, slot, sig_status, sig_level, timestamp, metrics=None):
+        """Write the latest level for a listener
+        slot -- the listener's slot
+        sig_status -- a DiaSigStatus object
+        sig_level -- signal level, in DBm
+        timestamp -- time when the level was detected, seconds since epoch
+        metrics -- (snr, peak offset, occupied bandwidth) tuple, None or
+            None items if not measured"""
+
+        if metrics is None:
+            metrics = (None, None, None)
+        metrics = [float('nan') if value is None else value
+                   for value in metrics]
+
+        offset = slot * self._slot_size
+        seq = self._seq_format.unpack_from(self._mmap, offset)[0]
+
+        # an odd sequence number marks the slot as being written
+        self._seq_format.pack_into(self._mmap, offset,
+                                   (seq + 1) & 0xffffffff)
+        self._data_format.pack_into(self._mmap,
+                                    offset + self._seq_format.size,
+                                    int(sig_status), sig_level, timestamp,
+                                    *metrics)
+        # 0 marks a slot never written, skipped when the sequence wraps
+        self._seq_format.pack_into(self._mmap, offset,
+                                   ((seq + 2) & 0xffffffff) or 2)
+
+    def read(self, slot):
+        """Read the latest level for a listener.
+        Returns a (status code, level, timestamp, metrics) tuple, metrics
+        being a (snr, peak offset, occupied bandwidth) tuple, None for the
+        ones not measured, or None if the slot was never written or is
+        being constantly written.
+        slot -- the listener's slot"""
+
+        offset = slot * self._slot_size
+
+        for _ in xrange(self._read_retries):
+            seq_before = self._seq_format.unpack_from(self._mmap, offset)[0]
+            if seq_before == 0:
+                return None
+            if seq_before % 2:
+                continue
+
+            data = self._data_format.unpack_from(self._mmap,
+                                                 offset +
+                                                 self._seq_format.size)
+
+            seq_after = self._seq_format.unpack_from(self._mmap, offset)[0]
+            if seq_before == seq_after:
+                metrics = tuple(None if value != value else value
+                                for value in data[3:])
+                return data[:3] + (metrics,)
+
+        return None
+
+
+class DiaBandMap(object):
+    """Map of the bins of a wideband FFT covering each listener's band.
+    Built once for a radio source, the average level of all the bands is
+    then taken from each FFT frame on a single vectorized pass, from the
+    cumulative sum of the frame."""
+
+    def __init__(self, fft_size, low_freq, high_freq):
+        """Create an empty map
+        fft_size -- number of bins on the FFT frames
+        low_freq -- frequency at the lower edge of the first bin, in hz
+        high_freq -- frequency at the upper edge of the last bin, in hz"""
+
+        self._fft_size = fft_size
+        self._low_freq = float(low_freq)
+        self._bin_width = (high_freq - low_freq) / float(fft_size)
+
+        # band keys, and their first and past the last bins
+        self._keys = []
+        self._bins = {}
+
+        # bin indexes as arrays, built on the first frame after a change
+        self._start_idx = None
+        self._end_idx = None
+        self._bin_qty = None
+
+    def add_band(self, key, low_freq, high_freq):
+        """Add a band to the map, bands may overlap. Returns a tuple with
+        the first and past the last bins of the band.
+        key -- key for the band (eg: the listener id)
+        low_freq -- lower frequency of the band, in hz
+        high_freq -- upper frequency of the band, in hz"""
+
+        if key in self._bins:
+            msg = 'Band {k} already on the map'.format(k=key)
+            raise ValueError(msg)
+
+        start = int(math.floor((low_freq - self._low_freq) / self._bin_width))
+        end = int(math.ceil((high_freq - self._low_freq) / self._bin_width))
+
+        # keep at least one bin, within the frame
+        start = min(max(start, 0), self._fft_size - 1)
+        end = min(max(end, start + 1), self._fft_size)
+
+        self._keys.append(key)
+        self._bins[key] = (start, end)
+        self._start_idx = None
+
+        return (start, end)
+
+    def get_keys(self):
+        """Return the band keys, in the order of the levels"""
+        return list(self._keys)
+
+    def get_bins(self, key):
+        """Return a tuple with the first and past the last bins of a band
+        key -- the band key"""
+        return self._bins[key]
+
+    def get_outside_ranges(self):
+        """Return a tuple of (start, end) ranges of the bins outside every
+        band"""
+
+        ranges = []
+        position = 0
+        for start, end in sorted(self._bins.values()):
+            if start > position:
+                ranges.append((position, start))
+            position = max(position, end)
+        if position < self._fft_size:
+            ranges.append((position, self._fft_size))
+
+        return tuple(ranges)
+
+    def _build_index(self):
+        """Build the bin index arrays"""
+
+        bins = [self._bins[key] for key in self._keys]
+
+        self._start_idx = numpy.array([start for start, _ in bins],
+                                      dtype=numpy.intp)
+        self._end_idx = numpy.array([end for _, end in bins],
+                                    dtype=numpy.intp)
+        self._bin_qty = (self._end_idx - self._start_idx).astype(numpy.float64)
+
+    def get_levels(self, fft_val):
+        """Return the average level on each band, a numpy array on the
+        same order as get_keys, for a batch of frames an array with a row
+        for each frame
+        fft_val -- an FFT frame, or a 2D array of frames, lower frequencies
+            first"""
+
+        if self._start_idx is None:
+            self._build_index()
+
+        fft_val = numpy.asarray(fft_val)
+
+        # the cumulative sum has a leading zero, so a band's sum is the
+        # difference between it's end and start
+        cum_sum = numpy.zeros(fft_val.shape[:-1] + (self._fft_size + 1,),
+                              dtype=numpy.float64)
+        numpy.cumsum(fft_val, axis=-1, out=cum_sum[..., 1:])
+
+        return ((cum_sum[..., self._end_idx] -
+                 cum_sum[..., self._start_idx]) / self._bin_qty)
+
+
+def join_bin_ranges(frames, ranges):
+    """Return the bins of each frame on a set of ranges, side by side, a
+    view of the frames when there's a single range
+    frames -- 2D numpy array, a frame on each row
+    ranges -- tuple of (start, end) ranges of bins"""
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return frames[:, start:end]
+
+    return numpy.hstack([frames[:, start:end] for start, end in ranges])
+
+
+class DiaFrameSlice(object):
+    """Average level on a slice of the bins of logpwrfft frames.
+    The level is taken straight from the frames as the FFT sends them,
+    with the lower and upper halves of the spectrum swapped, so frames are
+    neither reordered nor converted on each tick."""
+
+    __slots__ = ('_ranges', '_bin_qty', '_fft_size')
+
+    def __init__(self, fft_size, start, end):
+        """Initialize the slice
+        fft_size -- number of bins on the FFT frames
+        start -- first bin of the slice, lower frequencies first
+        end -- past the last bin of the slice, lower frequencies first"""
+
+        if not 0 <= start < end <= fft_size:
+            msg = ('Invalid slice {s} to {e} for a {n} bin'
+                   ' frame').format(s=start, e=end, n=fft_size)
+            raise ValueError(msg)
+
+        half = fft_size / 2
+
+        # position of the slice on the swapped frame, one or two ranges
+        if end <= half:
+            self._ranges = ((start + half, end + half),)
+        elif start >= half:
+            self._ranges = ((start - half, end - half),)
+        else:
+            self._ranges = ((start + half, fft_size), (0, end - half))
+
+        self._bin_qty = float(end - start)
+        self._fft_size = fft_size
+
+    def get_outside_ranges(self):
+        """Return a tuple of (start, end) ranges of the bins outside the
+        slice, on frames as sent by the FFT"""
+
+        ranges = []
+        position = 0
+        for start, end in sorted(self._ranges):
+            if start > position:
+                ranges.append((position, start))
+            position = end
+        if position < self._fft_size:
+            ranges.append((position, self._fft_size))
+
+        return tuple(ranges)
+
+    def get_level(self, frame):
+        """Return the average level on the slice
+        frame -- an FFT frame as sent by the FFT, a tuple (as returned by
+            a signal probe) or a numpy array"""
+
+        total = 0.0
+
+        # the builtin sum is faster on tuples than converting them
+        if isinstance(frame, numpy.ndarray):
+            for start, end in self._ranges:
+                total += numpy.add.reduce(frame[start:end])
+        else:
+            for start, end in self._ranges:
+                total += sum(frame[start:end])
+
+        return total / self._bin_qty
+
+    def get_levels(self, frames):
+        """Return the average level on the slice for a batch of frames, a
+        numpy array with a level for each frame
+        frames -- a 2D numpy array, a frame on each row, as sent by the FFT"""
+
+        total = numpy.zeros(len(frames), dtype=numpy.float64)
+
+        for start, end in self._ranges:
+            total += numpy.add.reduce(frames[:, start:end], axis=1,
+                                      dtype=numpy.float64)
+
+        return total / self._bin_qty
+
+    def get_spectrum(self, frames):
+        """Return the levels of the slice's bins averaged over a batch of
+        frames, a numpy array, lower frequencies first
+        frames -- a 2D numpy array, a frame on each row, as sent by the FFT"""
+
+        spectrum = numpy.concatenate([numpy.add.reduce(frames[:, start:end],
+                                                       axis=0,
+                                                       dtype=numpy.float64)
+                                      for start, end in self._ranges])
+
+        return spectrum / len(frames)
+
+
+class DiaSigMetrics(object):
+    """Signal quality metrics of a listener's band, from the levels of the
+    band's FFT bins: signal to noise ratio against the noise floor, offset
+    of the strongest bin from the band's center and the bandwidth holding
+    99% of the power above the noise floor, all in a single pass over the
+    bins."""
+
+    __slots__ = ('_bin_width', '_offsets')
+
+    # fraction of the power left out on each side of the occupied bandwidth
+    _obw_tail = 0.005
+
+    def __init__(self, bin_qty, bin_width):
+        """Initialize the metrics
+        bin_qty -- number of bins on the band, centered on the listener's
+            frequency
+        bin_width -- bandwidth of a bin, in Hz"""
+
+        if bin_qty < 1 or bin_width <= 0:
+            msg = ('Invalid band of {n} bins of {w}Hz').format(n=bin_qty,
+                                                               w=bin_width)
+            raise ValueError(msg)
+
+        self._bin_width = float(bin_width)
+
+        # frequency of each bin, relative to the band's center
+        self._offsets = ((numpy.arange(bin_qty) - (bin_qty - 1) / 2.0) *
+                         self._bin_width)
+
+    def get_metrics(self, band, noise_floor):
+        """Return a (snr, peak offset, occupied bandwidth) tuple, snr in
+        dB, None if there's no noise floor, offset and bandwidth in Hz
+        band -- numpy array with the levels of the band's bins, in dB,
+            lower frequencies first
+        noise_floor -- noise floor level of a bin, in dB, None if not
+            estimated yet"""
+
+        if len(band) != len(self._offsets):
+            msg = ('Band has {n} bins, expected'
+                   ' {e}').format(n=len(band), e=len(self._offsets))
+            raise ValueError(msg)
+
+        power = numpy.power(10.0, band * 0.1)
+
+        peak_offset = float(self._offsets[numpy.argmax(band)])
+
+        if noise_floor is None:
+            snr = None
+            signal = power
+        else:
+            noise = 10.0 ** (noise_floor * 0.1)
+            snr = float(10 * math.log10(numpy.add.reduce(power) /
+                                        len(power)) - noise_floor)
+            signal = numpy.maximum(power - noise, 0)
+
+        cumulative = numpy.cumsum(signal)
+        total = cumulative[-1]
+        if total <= 0:
+            occupied_bw = 0.0
+        else:
+            low, high = numpy.searchsorted(
+                cumulative, (total * self._obw_tail,
+                             total * (1 - self._obw_tail)))
+            occupied_bw = (high - low + 1) * self._bin_width
+
+        return (snr, peak_offset, occupied_bw)
+
+
+class DiaNoiseFloor(object):
+    """Streaming estimate of the noise floor, a quantile of the levels of
+    FFT bins, kept in constant memory.
+    Each update moves the estimate by up to step dB, by how much the
+    fraction of bins below the estimate differs from the quantile, the
+    whole batch of bins at once."""
+
+    __slots__ = ('_quantile', '_step', '_floor')
+
+    def __init__(self, quantile=0.5, step=0.2):
+        """Initialize the estimator
+        quantile -- quantile of the bin levels taken as the floor, between
+            0 and 1
+        step -- largest change of the estimate on each frame, in dB"""
+
+        if not 0 < quantile < 1:
+            msg = 'Invalid noise floor quantile {q}'.format(q=quantile)
+            raise ValueError(msg)
+
+        if step <= 0:
+            msg = 'Invalid noise floor step {s}'.format(s=step)
+            raise ValueError(msg)
+
+        self._quantile = float(quantile)
+        self._step = float(step)
+
+        # current estimate, None until the first update
+        self._floor = None
+
+    def update(self, bins):
+        """Update the estimate, return the noise floor
+        bins -- numpy array with bin levels, 1D for a frame, 2D for a batch
+            of frames, a frame on each row"""
+
+        if self._floor is None:
+            # start from the quantile of the first batch
+            self._floor = float(numpy.percentile(bins,
+                                                 self._quantile * 100))
+            return self._floor
+
+        below = numpy.count_nonzero(bins < self._floor) / float(bins.size)
+
+        # a batch counts as a step per frame
+        frame_qty = len(bins) if bins.ndim > 1 else 1
+
+        self._floor += self._step * frame_qty * (self._quantile - below)
+
+        return self._floor
+
+    def get_floor(self):
+        """Return the noise floor, None if not estimated yet"""
+        return self._floor
+
+
+class DiaFrameDemand(object):
+    """Frame rate an FFT has to run at, the highest of the rates it's
+    consumers read frames at, or an idle rate if none is reading, and the
+    FFT averaging factor keeping the averaging time of a reference rate."""
+
+    __slots__ = ('_avg_alpha', '_ref_rate', '_idle_rate', '_demands')
+
+    def __init__(self, avg_alpha=1.0, ref_rate=30.0, idle_rate=1.0):
+        """Initialize the demand, with no consumers
+        avg_alpha -- FFT averaging factor at the reference rate, 1.0 for no
+            averaging
+        ref_rate -- frame rate the averaging factor is set for, in hz
+        idle_rate -- frame rate when no consumer is reading, in hz"""
+
+        if not 0 < avg_alpha <= 1 or ref_rate <= 0 or idle_rate <= 0:
+            msg = ('Invalid frame demand, averaging factor {a}, reference'
+                   ' rate {r}, idle rate {i}').format(a=avg_alpha,
+                                                      r=ref_rate,
+                                                      i=idle_rate)
+            raise ValueError(msg)
+
+        self._avg_alpha = float(avg_alpha)
+        self._ref_rate = float(ref_rate)
+        self._idle_rate = float(idle_rate)
+
+        # frame rate read by each consumer
+        self._demands = {}
+
+    def set_demand(self, consumer, rate):
+        """Set the frame rate a consumer reads at, returns True if the
+        FFT's frame rate changed
+        consumer -- the consumer's name
+        rate -- frames per second, 0 when not reading"""
+
+        if rate < 0:
+            msg = 'Invalid frame rate {r} for {c}'.format(r=rate, c=consumer)
+            raise ValueError(msg)
+
+        old_rate = self.get_rate()
+
+        if rate:
+            self._demands[consumer] = float(rate)
+        else:
+            self._demands.pop(consumer, None)
+
+        return self.get_rate() != old_rate
+
+    def get_demands(self):
+        """Return a dict with the frame rate of each consumer reading"""
+        return dict(self._demands)
+
+    def get_rate(self):
+        """Return the frame rate the FFT has to run at, in hz"""
+
+        if not self._demands:
+            return self._idle_rate
+
+        return max(self._demands.values())
+
+    def get_avg_alpha(self):
+        """Return the FFT averaging factor at the current frame rate, so
+        the frames are averaged over the same time as at the reference
+        rate"""
+
+        return 1 - (1 - self._avg_alpha) ** (self._ref_rate /
+                                             self.get_rate())
+
+
+class DiaRunningAverage(object):
+    """Average of the latest samples, kept on a ring buffer with a running
+    sum, so adding a sample takes constant time."""
+
+    __slots__ = ('_samples', '_pos', '_sum')
+
+    def __init__(self, size, initial=0.0):
+        """Initialize the buffer
+        size -- number of samples averaged
+        initial -- value for the samples, until replaced"""
+
+        if size < 1:
+            msg = 'Running average size must be at least 1, was {s}'.format(
+                s=size)
+            raise ValueError(msg)
+
+        self._samples = size * [float(initial)]
+        self._pos = 0
+        self._sum = math.fsum(self._samples)
+
+    def add(self, sample):
+        """Add a sample, replacing the oldest one, returns the average
+        sample -- the new sample"""
+
+        self._sum += sample - self._samples[self._pos]
+        self._samples[self._pos] = sample
+        self._pos += 1
+
+        if self._pos == len(self._samples):
+            self._pos = 0
+            # recompute the sum once per turn, so rounding errors do not
+            # build up
+            self._sum = math.fsum(self._samples)
+
+        return self._sum / len(self._samples)
+
+    def get_average(self):
+        """Return the average of the samples"""
+        return self._sum / len(self._samples)
+
+    def get_size(self):
+        """Return the number of samples averaged"""
+        return len(self._samples)
+
+    def get_samples(self):
+        """Return the samples, newest first"""
+
+        size = len(self._samples)
+        return [self._samples[(self._pos - n) % size]
+                for n in xrange(1, size + 1)]
+
+
+class DiaDecimationPlan(object):
+    """Stages decimating a signal from a radio source's rate down to the
+    lowest integer fraction of it at or above a minimum rate.
+    The decimation is split on it's prime factors, largest first, so the
+    stages at high rates drop the most samples. Each stage only has to
+    keep aliases off the final passband, so all but the last have wide
+    transitions and few taps, factors of 2 get half-band shaped
+    filters."""
+
+    __slots__ = ('_in_rate', '_decimation', '_passband', '_stages')
+
+    def __init__(self, in_rate, min_rate, passband=0.8):
+        """Plan the stages
+        in_rate -- input sample rate, in Hz
+        min_rate -- lowest acceptable output rate, in Hz
+        passband -- fraction of the output rate kept flat, centered on
+            0Hz, between 0 and 1"""
+
+        if in_rate <= 0 or min_rate <= 0:
+            msg = ('Invalid rates, input {i}Hz, minimum output'
+                   ' {m}Hz').format(i=in_rate, m=min_rate)
+            raise ValueError(msg)
+
+        if not 0 < passband < 1:
+            msg = 'Invalid passband {p}'.format(p=passband)
+            raise ValueError(msg)
+
+        self._in_rate = float(in_rate)
+        self._decimation = max(int(self._in_rate // min_rate), 1)
+
+        # edge of the passband, each side of 0Hz
+        self._passband = passband * self.get_out_rate() / 2
+
+        self._stages = []
+        factors = self._get_factors(self._decimation)
+        rate = self._in_rate
+        for pos, factor in enumerate(factors):
+            out_rate = rate / factor
+            if pos == len(factors) - 1:
+                # the last stage keeps everything off the output's band
+                stop = out_rate / 2
+            else:
+                # later stages remove what aliases outside the passband
+                stop = out_rate - self._passband
+            self._stages.append((factor, rate, (self._passband + stop) / 2,
+                                 stop - self._passband))
+            rate = out_rate
+
+    @staticmethod
+    def _get_factors(decimation):
+        """Return the prime factors of a decimation, largest first
+        decimation -- the decimation"""
+
+        factors = []
+        factor = 2
+        while factor * factor <= decimation:
+            while decimation % factor == 0:
+                factors.append(factor)
+                decimation /= factor
+            factor += 1
+        if decimation > 1:
+            factors.append(decimation)
+
+        factors.sort(reverse=True)
+        return factors
+
+    def get_decimation(self):
+        """Return the total decimation"""
+        return self._decimation
+
+    def get_out_rate(self):
+        """Return the output rate, in Hz"""
+        return self._in_rate / self._decimation
+
+    def get_passband(self):
+        """Return the edge of the passband, on each side of 0Hz, in Hz"""
+        return self._passband
+
+    def get_stages(self):
+        """Return a list of (decimation, input rate, cutoff, transition
+        width) tuples, one for each stage, in order, rates and frequencies
+        in Hz, empty if there's no decimation"""
+        return list(self._stages)
+
+
+class DiaTapCache(object):
+    """Cache of low pass FIR filter taps, so filters with the same design
+    are only designed once, kept in memory and, optionally, on disk, so
+    they survive restarts.
+    On disk, each design is a json file, named after a hash of it's
+    parameters, written atomically so processes may share the directory."""
+
+    def __init__(self, path=None):
+        """Initialize the cache
+        path -- directory for the disk cache, None to keep taps only in
+            memory"""
+
+        self._path = None
+        self._taps = {}
+
+        # (memory hits, disk hits, designs)
+        self._stats = [0, 0, 0]
+
+        self.set_path(path)
+
+    def set_path(self, path):
+        """Set the directory for the disk cache, creating it if missing
+        path -- the directory, None to keep taps only in memory"""
+
+        if path is not None and not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError, exc:
+                if exc.errno != errno.EEXIST:
+                    msg = ('Unable to create FIR tap cache directory {p}'
+                           ' with {m}').format(p=path, m=str(exc))
+                    logging.error(msg)
+                    raise
+
+        self._path = path
+
+    def get_path(self):
+        """Return the directory for the disk cache, None if taps are only
+        kept in memory"""
+        return self._path
+
+    def get_stats(self):
+        """Return a (memory hits, disk hits, designs) tuple"""
+        return tuple(self._stats)
+
+    def low_pass(self, gain, rate, cutoff, transition, attenuation=None,
+                 window=None):
+        """Return the taps of a low pass filter, as designed by
+        firdes.low_pass, or firdes.low_pass_2 when the attenuation is set
+        gain -- the filter's gain
+        rate -- sample rate, in Hz
+        cutoff -- cutoff frequency, in Hz
+        transition -- transition width, in Hz
+        attenuation -- stop band attenuation, in dB, None for the window's
+        window -- firdes window, None for hamming"""
+
+        if window is None:
+            window = grfilter.firdes.WIN_HAMMING
+
+        key = ('low_pass', float(gain), float(rate), float(cutoff),
+               float(transition),
+               None if attenuation is None else float(attenuation),
+               int(window))
+
+        taps = self._taps.get(key)
+        if taps is not None:
+            self._stats[0] += 1
+            return taps
+
+        taps = self._read(key)
+        if taps is not None:
+            self._stats[1] += 1
+        else:
+            if attenuation is None:
+                taps = grfilter.firdes.low_pass(gain, rate, cutoff,
+                                                transition, window)
+            else:
+                taps = grfilter.firdes.low_pass_2(gain, rate, cutoff,
+                                                  transition, attenuation,
+                                                  window)
+            taps = tuple(taps)
+            self._stats[2] += 1
+            self._write(key, taps)
+
+        self._taps[key] = taps
+
+        return taps
+
+    def _get_file_path(self, key):
+        """Return the path of a design's file on the disk cache
+        key -- the design's parameters"""
+
+        name = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self._path, name + '.json')
+
+    def _read(self, key):
+        """Return the taps of a design from the disk cache, None if not
+        there
+        key -- the design's parameters"""
+
+        if self._path is None:
+            return None
+
+        try:
+            with open(self._get_file_path(key)) as taps_file:
+                design = json.load(taps_file)
+        except IOError:
+            return None
+        except ValueError, exc:
+            msg = 'Ignoring malformed cached FIR taps with {m}'.format(
+                m=str(exc))
+            logging.warning(msg)
+            return None
+
+        # guard against hash collisions
+        if design.get('key') != list(key):
+            return None
+
+        return tuple(design['taps'])
+
+    def _write(self, key, taps):
+        """Write the taps of a design to the disk cache
+        key -- the design's parameters
+        taps -- the taps"""
+
+        if self._path is None:
+            return
+
+        try:
+            handle, tmp_path = tempfile.mkstemp(dir=self._path,
+                                                suffix='.tmp')
+            with os.fdopen(handle, 'w') as taps_file:
+                json.dump({'key': key, 'taps': taps}, taps_file)
+            os.rename(tmp_path, self._get_file_path(key))
+        except (IOError, OSError), exc:
+            # the cache is only an optimization
+            msg = 'Unable to cache FIR taps with {m}'.format(m=str(exc))
+            logging.warning(msg)
+
+
+# FIR taps designed on this process
+fir_tap_cache = DiaTapCache()
+
+
+class DiaTopBlock(gr.top_block):
+    """GNU Radio top block keeping the blocks connected on it, so
+    scheduler settings can be applied to all of them once the flowgraph
+    is built.
+    Blocks can be given a role, so each role's blocks get their own
+    settings, blocks without a role have the DEFAULT_ROLE."""
+
+    # source -- the radio hardware source block
+    # channelizer -- the radio source's channelizer blocks
+    # fft -- the FFTs and their frame sinks
+    # listener -- every other block, the listeners' filters, demodulators
+    #   and the audio sink
+    BLOCK_ROLES = ('source', 'channelizer', 'fft', 'listener')
+    DEFAULT_ROLE = 'listener'
+
+    def __init__(self, name='diatomite'):
+        """Initialize the top block
+        name -- the top block name"""
+
+        gr.top_block.__init__(self, name)
+
+        # blocks connected, in the order they were first connected
+        self._dia_blocks = []
+
+        # (block, role) for the blocks given a role
+        self._dia_block_roles = []
+
+    def connect(self, *points):
+        """Connect blocks, as gr.top_block.connect, keeping the blocks
+        points -- blocks or (block, port) tuples"""
+
+        gr.top_block.connect(self, *points)
+
+        for point in points:
+            block = point[0] if isinstance(point, tuple) else point
+            if not any(block is known for known in self._dia_blocks):
+                self._dia_blocks.append(block)
+
+    def get_blocks(self):
+        """Return the blocks connected, in the order they were first
+        connected"""
+        return list(self._dia_blocks)
+
+    def set_block_role(self, block, role):
+        """Set the role of a block, selecting the scheduler settings
+        applied to it
+        block -- the block
+        role -- one of BLOCK_ROLES"""
+
+        if role not in self.BLOCK_ROLES:
+            msg = ('Unknown block role {r}, must be one of'
+                   ' {l}').format(r=role, l=self.BLOCK_ROLES)
+            raise ValueError(msg)
+
+        self._dia_block_roles = [(known, known_role) for known, known_role
+                                 in self._dia_block_roles
+                                 if known is not block]
+        self._dia_block_roles.append((block, role))
+
+    def get_block_role(self, block):
+        """Return the role of a block, DEFAULT_ROLE if it was not given
+        one
+        block -- the block"""
+
+        for known, role in self._dia_block_roles:
+            if known is block:
+                return role
+
+        return self.DEFAULT_ROLE
+
+    def set_block_tuning(self, max_output_buffer=0, affinity=None):
+        """Apply scheduler settings to every block connected, must be
+        called before the top block is started. Each setting is either
+        a single value for every block, or a dict with the value for each
+        block role, roles missing are left to GNU Radio's default.
+        max_output_buffer -- maximum items on each block's output buffers,
+            0 for GNU Radio's default
+        affinity -- list of CPU cores the block threads run on, None for
+            any"""
+
+        for block in self._dia_blocks:
+            role = self.get_block_role(block)
+            block_max_output_buffer = max_output_buffer
+            if isinstance(block_max_output_buffer, dict):
+                block_max_output_buffer = block_max_output_buffer.get(role,
+                                                                      0)
+            block_affinity = affinity
+            if isinstance(block_affinity, dict):
+                block_affinity = block_affinity.get(role)
+
+            if block_max_output_buffer:
+                try:
+                    block.set_max_output_buffer(block_max_output_buffer)
+                except AttributeError:
+                    # hierarchical blocks on older GNU Radio versions
+                    msg = ('Unable to set the output buffer of'
+                           ' {b}').format(b=block)
+                    logging.debug(msg)
+
+            if block_affinity is not None:
+                try:
+                    block.set_processor_affinity(block_affinity)
+                except AttributeError:
+                    # hierarchical blocks on older GNU Radio versions
+                    msg = ('Unable to set the affinity of'
+                           ' {b}').format(b=block)
+                    logging.debug(msg)
+
+        msg = ('Set output buffers to {b} and affinity to {a} for {n}'
+               ' blocks').format(b=max_output_buffer, a=affinity,
+                                 n=len(self._dia_blocks))
+        logging.debug(msg)
+
+
+class DiaFrameSink(gr.sync_block):
+    """GNU Radio sink for FFT frames.
+    Consumes every frame produced on the flowgraph, passing each batch of
+    frames available to a callback, from the flowgraph's thread, instead
+    of having a thread poll a signal probe for the latest frame."""
+
+    def __init__(self, fft_size, callback):
+        """Initialize the block
+        fft_size -- number of bins on each frame
+        callback -- called with each batch of frames, a 2D numpy array
+            with a frame on each row, as sent by the FFT. The array is only
+            valid during the call, it must be copied to be kept"""
+
+        gr.sync_block.__init__(self, name='dia_frame_sink',
+                               in_sig=[(numpy.float32, fft_size)],
+                               out_sig=None)
+
+        self._callback = callback
+
+    def work(self, input_items, output_items):
+        """Pass the available frames to the callback"""
+
+        frames = input_items[0]
+
+        try:
+            self._callback(frames)
+        except Exception, exc:
+            # an exception would stop the flowgraph
+            msg = 'Failed processing FFT frames with: {m}'.format(m=str(exc))
+            logging.error(msg)
+
+        return len(frames)
 
 
 class RadioSpectrum(object):
@@ -665,6 +2505,9 @@ class DataTap(object):
             raise
 
         # set the tap update on it's own thread
+        # time of the last value read from the tap
+        self._read_time = 0
+
         self._update_tap_thread = threading.Thread(target=self._output_value,
                                                    name=self._get_id(),
                                                    args=(self._tap_thread_stop,
@@ -744,6 +2587,7 @@ class DataTap(object):
 
                 try:
                     f_handle.writelines(output)
+                    self._read_time = time.time()
                 except IOError, exc:
                     if exc.errno == errno.EPIPE:
                         msg = ('Broken pipe on tap {t} with:'
@@ -771,6 +2615,13 @@ class DataTap(object):
         # signal the worker thread
         self._tap_value_update.set()
 
+    def has_reader(self, timeout):
+        """Return True if a reader read the tap recently
+        timeout -- time since the last read, in seconds, after which the
+            reader is gone"""
+
+        return time.time() - self._read_time < timeout
+
     def _get_value(self):
         """Get the value, with locking"""
         self._tap_lock.acquire()
@@ -22,10 +22,11 @@
 import logging
 import sys
 import os
-from multiprocessing import Queue
+from multiprocessing import queues as mp_queues
 import yaml
 import diatomite_api
 import radiosource
+import freqlistener
 import diatomite_aux as dia_aux
 
 
@@ -165,6 +166,13 @@ class DiatomiteProbe(object):
     A diatomite probe has one or more radio sources
     """
 
+    # time to wait for radio source messages before checking for a stop,
+    # in seconds
+    _monitor_wait = 0.5
+
+    # directory, on the tap directory, where designed FIR taps are cached
+    FIR_TAP_CACHE_DIR = 'fir_taps'
+
     def __init__(self, conf=None, full_conf=None, dia_site=None):
         """Configure the Probe
         conf -- a dictionary with a valid probe configuration
@@ -185,6 +193,12 @@ class DiatomiteProbe(object):
         self._api_svc_input_pipe = None
         self._api_svc_output_pipe = None
 
+        # shared memory table for listener signal levels
+        self._level_table = None
+
+        # if radio sources send their messages straight to the api service
+        self._direct_api_path = False
+
         # pipe inputs for each radio source
         # index is the radio source ID
         self._source_inputs = {}
@@ -194,7 +208,7 @@ class DiatomiteProbe(object):
         self._source_outputs = {}
 
         # output queue for all radio sources
-        self._source_output_queue = Queue()
+        self._source_output_queue = None
 
         if dia_site is not None:
             self.set_site(dia_site)
@@ -218,13 +232,63 @@ class DiatomiteProbe(object):
 
         self.set_tap_dir_path(conf['tap_dir_path'])
 
+        self.configure_queues(conf)
+
         self.set_radio_sources(conf['RadioSources'])
+        self._radio_sources.set_route_ids(self.get_id(),
+                                          self.get_site().get_id())
+
+        # designed FIR taps are kept on the tap directory, if there's one
+        if conf['fir_tap_cache'] and self.get_tap_dir_path():
+            self._radio_sources.set_fir_tap_cache_path(
+                os.path.join(self.get_tap_dir_path(), self.FIR_TAP_CACHE_DIR))
+
+        # radio sources load the FFTW wisdom before planning their FFTs
+        if conf['fftw_wisdom_path']:
+            self._radio_sources.set_fftw_wisdom_path(conf['fftw_wisdom_path'])
+
+        if conf['shared_level_table']:
+            self.configure_level_table(conf['RadioSources'])
 
         self.configure_api_srv(conf, full_conf)
 
         # TODO:this willl need to be moved to a proper start phase
         self.start_api_srv()
 
+    @staticmethod
+    def get_fft_sizes(conf):
+        """Return the sorted list of FFT sizes used by a probe's radio
+        sources and listeners
+        conf -- a dictionary with a valid probe configuration"""
+
+        fft_sizes = set()
+        for rs_conf in conf['RadioSources'].values():
+            fft_sizes.add(rs_conf['fft_size'])
+            for l_conf in rs_conf['listeners'].values():
+                fft_sizes.add(l_conf['detection']['fft_size'])
+
+        return sorted(fft_sizes)
+
+    @staticmethod
+    def plan_fftw_wisdom(conf):
+        """Plan the FFTs of a probe and save their FFTW wisdom to the
+        probe's wisdom file, if set, GNU Radio also keeps it on it's own
+        wisdom file, returns True if the wisdom was saved
+        conf -- a dictionary with a valid probe configuration"""
+
+        fft_sizes = DiatomiteProbe.get_fft_sizes(conf)
+
+        msg = 'Planning FFTs of sizes {s} for probe {p}'.format(
+            s=fft_sizes, p=conf['id'])
+        logging.info(msg)
+
+        dia_aux.plan_ffts(fft_sizes)
+
+        if conf['fftw_wisdom_path']:
+            return dia_aux.save_fftw_wisdom(conf['fftw_wisdom_path'])
+
+        return False
+
     def _configure_logging(self):
         """Configure log output for this probe"""
 
@@ -259,12 +323,56 @@ class DiatomiteProbe(object):
         full_conf -- a dictionary with the full configuration
             received by diatomite"""
 
-        self._api_svc_input_pipe = Queue()
-        self._api_svc_output_pipe = Queue()
-
         self._api_svc = diatomite_api.ApiSvc(conf, full_conf,
                                              self._api_svc_input_pipe,
                                              self._api_svc_output_pipe)
+        self._api_svc.set_level_table(self._level_table)
+
+        queues = [self._api_svc_input_pipe, self._api_svc_output_pipe]
+        if not self._direct_api_path:
+            queues.insert(0, self._source_output_queue)
+        self._api_svc.set_queues(queues)
+
+    def configure_queues(self, conf):
+        """Setup the queues between the radio sources, this probe and
+        the api service.
+        With a direct api path, the radio sources send their messages
+        straight to the api service input queue.
+        conf -- a dictionary with a valid probe configuration"""
+
+        # state changes and level updates travel on separate lanes
+        self._api_svc_input_pipe = dia_aux.DiaLaneQueue('api_input',
+                                                        conf['queue_size'],
+                                                        conf['level_queue_policy'])
+        self._api_svc_output_pipe = dia_aux.DiaQueue('api_output',
+                                                     conf['queue_size'])
+
+        self._direct_api_path = conf['direct_api_path']
+
+        if self._direct_api_path:
+            self._source_output_queue = self._api_svc_input_pipe
+        else:
+            self._source_output_queue = dia_aux.DiaLaneQueue('sources_output',
+                                                             conf['queue_size'],
+                                                             conf['level_queue_policy'])
+
+    def configure_level_table(self, radio_sources_dict):
+        """Setup a shared memory table where listeners write their signal
+        levels, to be read by the api service, instead of sending a message
+        for each level update.
+        Must be done before the api service and radio sources are started.
+        radio_sources_dict -- a dictionaty of radio sources configurations"""
+
+        keys = []
+        for rs_id in radio_sources_dict:
+            for l_id in radio_sources_dict[rs_id]['listeners']:
+                keys.append((rs_id, l_id))
+
+        self._level_table = dia_aux.DiaLevelTable(keys)
+        self._radio_sources.set_level_table(self._level_table)
+
+        msg = 'Level table set with {n} slots'.format(n=len(keys))
+        logging.debug(msg)
 
     def set_radio_sources(self, radio_sources_dict):
         """set the radio sources info
@@ -373,6 +481,21 @@ class DiatomiteProbe(object):
 
         return self._tap_dir_path
 
+    def get_source_output_queue(self):
+        """Return the queue where the radio sources send their messages"""
+
+        return self._source_output_queue
+
+    def get_api_svc_input_pipe(self):
+        """Return the api service input queue"""
+
+        return self._api_svc_input_pipe
+
+    def get_api_svc_output_pipe(self):
+        """Return the api service output queue"""
+
+        return self._api_svc_output_pipe
+
     def add_radio_source(self, conf):
         """Add a radio source to this probe's radio source list.
         conf -- a dictionary with a valid configuration"""
@@ -398,54 +521,54 @@ class DiatomiteProbe(object):
         self._source_inputs = self._radio_sources.get_source_input_pipes()
         self._source_outputs = self._radio_sources.get_source_output_pipes()
 
-    def _monitor_radio_sources(self):
+    def _monitor_radio_sources(self, stop_event=None):
         """Monitor radio source output queue
         Gets messages from the monitor source output queue
-        and processes them."""
+        and processes them.
+        stop_event -- event to stop monitoring, None to monitor forever"""
 
-        while True:
+        while stop_event is None or not stop_event.is_set():
 
             # get stuff from queue
             # messages should be in a format:
             # {radio source id}:{listener_id}:....
             # only radio source id is mandatory
-            queue_item = self._source_output_queue.get()
+            if stop_event is None:
+                queue_item = self._source_output_queue.get()
+            else:
+                try:
+                    queue_item = self._source_output_queue.get(True,
+                                                               self._monitor_wait)
+                except mp_queues.Empty:
+                    continue
 
             msg = "got a queue item:{qi}".format(qi=queue_item)
             logging.debug(msg)
 
-            if isinstance(queue_item, dia_aux.DiaRadioReceiverMsg):
-                msg = ('Received message from a'
-                       ' Radio Receiver:{m}').format(m=queue_item.get_json())
-
-                # package message onto a DiaProbeMsg
-                prb_id = self.get_id()
-                sig_type = queue_item.get_msg_type()
-                payload = queue_item
-                new_p_msg = dia_aux.DiaProbeMsg(sig_type, prb_id, payload)
-
-                # package message onto a SiteProbeMSg
-                site_id = self.get_site().get_id()
-
-                sig_type = queue_item.get_msg_type()
-                payload = new_p_msg
-                new_msg = dia_aux.DiaSiteMsg(sig_type, site_id, payload)
+            if isinstance(queue_item, dia_aux.DiaMsg):
 
+                # messages come stamped with the probe and site ids,
+                # and are forwarded as is
                 msg = ('Site {si} sending {msg}'
-                       ' message:{m}').format(si=site_id,
-                                              msg=sig_type,
-                                              m=new_msg.get_json())
+                       ' message:{m}').format(si=queue_item.get_site_id(),
+                                              msg=queue_item.get_msg_type(),
+                                              m=queue_item)
                 logging.debug(msg)
 
                 # send the message to the API server
-                self.send_data_to_api(new_msg)
+                self.send_data_to_api(queue_item)
+
+            elif isinstance(queue_item, dia_aux.DiaMsgBatch):
+
+                # forward the batch as a whole
+                self.send_data_to_api(queue_item)
 
     def send_data_to_api(self, data):
         """Sends data to the API server.
         data -- data to send"""
 
-        if isinstance(data, dia_aux.DiaSiteMsg):
-            self._api_svc_input_pipe.put(data)
+        if isinstance(data, (dia_aux.DiaMsg, dia_aux.DiaMsgBatch)):
+            self._api_svc_input_pipe.put_msg(data)
             msg = 'sending data to parent:{d}'.format(d=data)
             logging.debug(msg)
 
@@ -459,7 +582,12 @@ class DiatomiteProbe(object):
         # TODO: add remaining code to start
         self._radio_sources.start()
 
-        self._monitor_radio_sources()
+        if self._direct_api_path:
+            # radio sources send straight to the api service,
+            # nothing to relay
+            self._radio_sources.join()
+        else:
+            self._monitor_radio_sources()
 
     def stop(self):
         """Stop the object and it's children"""
@@ -539,6 +667,130 @@ class DiaConfParser(object):
 
         return conf
 
+    def _process_cpu_list(self, value, option):
+        """Check a list of CPU cores, "" for none, return the list of core
+        numbers, None if empty.
+        value -- the cores, comma separated, e.g. "0,2"
+        option -- the option name, for error messages"""
+
+        value = str(value).strip()
+        if not value:
+            return None
+
+        msg = ('FATAL: configuration error, malformed'
+               ' radio source {o} option').format(o=option)
+
+        try:
+            cores = [int(core) for core in value.split(',')]
+        except ValueError:
+            raise DiaConfParserError(msg)
+
+        if min(cores) < 0:
+            raise DiaConfParserError(msg)
+
+        return sorted(set(cores))
+
+    def _process_buffer_size(self, value, option):
+        """Check a number of items, 0 or more, return it as an int.
+        value -- the number of items
+        option -- the option name, for error messages"""
+
+        msg = ('FATAL: configuration error, malformed'
+               ' radio source {o} option').format(o=option)
+
+        try:
+            value = int(value)
+        except ValueError:
+            raise DiaConfParserError(msg)
+
+        if value < 0:
+            raise DiaConfParserError(msg)
+
+        return value
+
+    def _process_block_option(self, value, option, process):
+        """Check a flowgraph block option, either a single value for every
+        block, or a dict with the value for each block role, return the
+        value, or a dict of values, as returned by process.
+        value -- the option value
+        option -- the option name, for error messages
+        process -- method checking a single value, called with the value
+            and option name"""
+
+        if not isinstance(value, dict):
+            return process(value, option)
+
+        values = {}
+        for role, role_value in value.items():
+            if role not in dia_aux.DiaTopBlock.BLOCK_ROLES:
+                msg = ('FATAL: configuration error, unknown block role {r}'
+                       ' on radio source {o} option, must be one of'
+                       ' {l}').format(r=role, o=option,
+                                      l=dia_aux.DiaTopBlock.BLOCK_ROLES)
+                raise DiaConfParserError(msg)
+            values[role] = process(role_value, option)
+
+        return values
+
+    def _process_detection_profile(self, name, profile):
+        """Check a detection profile, fill missing values from the built in
+        profile it overrides, or from the default profile, return the
+        profile.
+        name -- the profile name
+        profile -- a dict with the profile options"""
+
+        built_in = freqlistener.FreqListener.DETECTION_PROFILES
+        default_profile = built_in.get(name, built_in['default'])
+
+        if not isinstance(profile, dict):
+            msg = ('FATAL: configuration error, malformed'
+                   ' detection profile {n}').format(n=name)
+            raise DiaConfParserError(msg)
+
+        for option in profile:
+            if option not in default_profile:
+                msg = ('FATAL: configuration error, unknown detection'
+                       ' profile {n} option {o}').format(n=name, o=option)
+                raise DiaConfParserError(msg)
+
+        new_profile = {}
+        for option in default_profile:
+            if option not in profile:
+                new_profile[option] = default_profile[option]
+                continue
+
+            msg = ('FATAL: configuration error, malformed detection'
+                   ' profile {n} {o} option').format(n=name, o=option)
+
+            if option == 'window':
+                value = str(profile[option]).lower()
+                if value not in freqlistener.FreqListener.FFT_WINDOWS:
+                    raise DiaConfParserError(msg)
+            elif option == 'fft_size':
+                try:
+                    value = int(profile[option])
+                except (TypeError, ValueError):
+                    raise DiaConfParserError(msg)
+                # must be a power of two, large enough to slice
+                if value < 16 or value & (value - 1):
+                    raise DiaConfParserError(msg)
+            else:
+                try:
+                    value = float(profile[option])
+                except (TypeError, ValueError):
+                    raise DiaConfParserError(msg)
+                if value <= 0:
+                    raise DiaConfParserError(msg)
+                if option in ('avg_alpha', 'slice_percentage'):
+                    # a factor and a percentage
+                    limit = 1.0 if option == 'avg_alpha' else 100.0
+                    if value > limit:
+                        raise DiaConfParserError(msg)
+
+            new_profile[option] = value
+
+        return new_profile
+
     def _process_config(self, conf):
         """Check configuration file for completeness, add default values.
         conf -- a dict of configurations"""
@@ -622,6 +874,97 @@ class DiaConfParser(object):
 
                 this_probe['logging'] = new_log_conf
 
+                if 'shared_level_table' not in this_probe:
+                    this_probe['shared_level_table'] = False
+                else:
+                    if this_probe['shared_level_table'].lower() not in ('false', 'true'):
+                        msg = ('FATAL: configuration error, malformed'
+                               ' probe shared_level_table option')
+                        raise DiaConfParserError(msg)
+                    else:
+                        if this_probe['shared_level_table'].lower() == 'false':
+                            this_probe['shared_level_table'] = False
+                        elif this_probe['shared_level_table'].lower() == 'true':
+                            this_probe['shared_level_table'] = True
+
+                if 'direct_api_path' not in this_probe:
+                    this_probe['direct_api_path'] = False
+                else:
+                    if this_probe['direct_api_path'].lower() not in ('false', 'true'):
+                        msg = ('FATAL: configuration error, malformed'
+                               ' probe direct_api_path option')
+                        raise DiaConfParserError(msg)
+                    else:
+                        if this_probe['direct_api_path'].lower() == 'false':
+                            this_probe['direct_api_path'] = False
+                        elif this_probe['direct_api_path'].lower() == 'true':
+                            this_probe['direct_api_path'] = True
+
+                if 'fftw_wisdom_path' not in this_probe:
+                    this_probe['fftw_wisdom_path'] = ''
+
+                if 'fir_tap_cache' not in this_probe:
+                    this_probe['fir_tap_cache'] = False
+                else:
+                    if this_probe['fir_tap_cache'].lower() not in ('false', 'true'):
+                        msg = ('FATAL: configuration error, malformed'
+                               ' probe fir_tap_cache option')
+                        raise DiaConfParserError(msg)
+                    else:
+                        if this_probe['fir_tap_cache'].lower() == 'false':
+                            this_probe['fir_tap_cache'] = False
+                        elif this_probe['fir_tap_cache'].lower() == 'true':
+                            this_probe['fir_tap_cache'] = True
+
+                if 'queue_size' not in this_probe:
+                    this_probe['queue_size'] = 1000
+                else:
+                    try:
+                        # convert from string to an int
+                        queue_size = int(this_probe['queue_size'])
+                    except ValueError:
+                        msg = ('FATAL: configuration error, malformed'
+                               ' probe queue_size option')
+                        raise DiaConfParserError(msg)
+                    else:
+                        if queue_size < 0:
+                            msg = ('FATAL: configuration error, malformed'
+                                   ' probe queue_size option')
+                            raise DiaConfParserError(msg)
+                        else:
+                            this_probe['queue_size'] = queue_size
+
+                if 'level_queue_policy' not in this_probe:
+                    this_probe['level_queue_policy'] = dia_aux.DiaQueue.POLICY_COALESCE
+                else:
+                    if (this_probe['level_queue_policy'].lower() not in
+                            dia_aux.DiaQueue.LEVEL_POLICIES):
+                        msg = ('FATAL: configuration error, malformed'
+                               ' probe level_queue_policy option')
+                        raise DiaConfParserError(msg)
+                    else:
+                        this_probe['level_queue_policy'] = this_probe['level_queue_policy'].lower()
+
+                # detection profiles, built in ones may be overridden
+                profiles = dict(freqlistener.FreqListener.DETECTION_PROFILES)
+                if 'detection_profiles' in this_probe:
+                    if not isinstance(this_probe['detection_profiles'], dict):
+                        msg = ('FATAL: configuration error, malformed'
+                               ' probe detection_profiles section')
+                        raise DiaConfParserError(msg)
+                    for prof_name in this_probe['detection_profiles']:
+                        profiles[prof_name] = self._process_detection_profile(
+                            prof_name,
+                            this_probe['detection_profiles'][prof_name])
+                this_probe['detection_profiles'] = profiles
+
+                if 'detection_profile' not in this_probe:
+                    this_probe['detection_profile'] = 'default'
+                elif this_probe['detection_profile'] not in profiles:
+                    msg = ('FATAL: configuration error, malformed'
+                           ' probe detection_profile option')
+                    raise DiaConfParserError(msg)
+
                 # check for 'RadioSources' section
                 try:
                     radio_sources = this_probe['RadioSources']
@@ -714,6 +1057,88 @@ class DiaConfParser(object):
                             elif this_r_source['freq_analyzer_tap'].lower() == 'true':
                                 this_r_source['freq_analyzer_tap'] = True
 
+                    if 'detection_mode' not in this_r_source:
+                        this_r_source['detection_mode'] = radiosource.RadioSource.DETECTION_LISTENER
+                    else:
+                        if (this_r_source['detection_mode'].lower() not in
+                                radiosource.RadioSource.DETECTION_MODES):
+                            msg = ('FATAL: configuration error, malformed'
+                                   ' radio source detection_mode option')
+                            raise DiaConfParserError(msg)
+                        else:
+                            this_r_source['detection_mode'] = this_r_source['detection_mode'].lower()
+
+                    if 'fft_size' not in this_r_source:
+                        this_r_source['fft_size'] = 1024
+                    else:
+                        try:
+                            # convert from string to an int
+                            fft_size = int(this_r_source['fft_size'])
+                        except ValueError:
+                            msg = ('FATAL: configuration error, malformed'
+                                   ' radio source fft_size option')
+                            raise DiaConfParserError(msg)
+                        else:
+                            # must be a power of two
+                            if fft_size < 2 or fft_size & (fft_size - 1):
+                                msg = ('FATAL: configuration error, malformed'
+                                       ' radio source fft_size option')
+                                raise DiaConfParserError(msg)
+                            else:
+                                this_r_source['fft_size'] = fft_size
+
+                    if 'channels' not in this_r_source:
+                        this_r_source['channels'] = 0
+                    else:
+                        try:
+                            # convert from string to an int
+                            channels = int(this_r_source['channels'])
+                        except ValueError:
+                            msg = ('FATAL: configuration error, malformed'
+                                   ' radio source channels option')
+                            raise DiaConfParserError(msg)
+                        else:
+                            # 0 for no channelizer, or an even number
+                            if channels < 0 or channels == 1 or channels % 2:
+                                msg = ('FATAL: configuration error, malformed'
+                                       ' radio source channels option')
+                                raise DiaConfParserError(msg)
+                            else:
+                                this_r_source['channels'] = channels
+
+                    # scheduler and process tuning, empty or 0 to leave
+                    # them to GNU Radio and the operating system
+                    this_r_source['cpu_affinity'] = self._process_cpu_list(
+                        this_r_source.get('cpu_affinity', ''), 'cpu_affinity')
+
+                    # flowgraph block settings, for every block or by role
+                    this_r_source['block_affinity'] = (
+                        self._process_block_option(
+                            this_r_source.get('block_affinity', ''),
+                            'block_affinity', self._process_cpu_list))
+                    this_r_source['max_output_buffer'] = (
+                        self._process_block_option(
+                            this_r_source.get('max_output_buffer', 0),
+                            'max_output_buffer', self._process_buffer_size))
+
+                    for option in ('max_noutput_items', 'niceness'):
+                        if option not in this_r_source:
+                            this_r_source[option] = 0
+                        else:
+                            msg = ('FATAL: configuration error, malformed'
+                                   ' radio source {o} option').format(o=option)
+                            try:
+                                # convert from string to an int
+                                value = int(this_r_source[option])
+                            except ValueError:
+                                raise DiaConfParserError(msg)
+                            else:
+                                if value < 0 or (option == 'niceness' and
+                                                 value > 19):
+                                    raise DiaConfParserError(msg)
+                                else:
+                                    this_r_source[option] = value
+
                     # check if there are listeners
                     try:
                         listeners = this_r_source['listeners']
@@ -777,27 +1202,99 @@ class DiaConfParser(object):
                             else:
                                 this_listener['bandwidth'] = l_bw
 
-                        if 'level_threshold' not in this_listener:
-                            msg = ('FATAL: configuration error, missing'
-                                   ' listener level_threshold definition')
-                            raise DiaConfParserError(msg)
-                        try:
-                            # convert from string to a float
-                            l_threshold = float(this_listener['level_threshold'])
-                        except ValueError:
-                            msg = ('FATAL: configuration error, malformed'
-                                   'listener level_threshold definition')
+                        # thresholds relative to the noise floor, when set
+                        # level_threshold is not needed
+                        if 'threshold_above_floor' not in this_listener:
+                            this_listener['threshold_above_floor'] = None
+                        else:
+                            try:
+                                # convert from string to a float
+                                l_above = float(this_listener['threshold_above_floor'])
+                            except ValueError:
+                                msg = ('FATAL: configuration error, malformed'
+                                       ' listener threshold_above_floor option')
+                                raise DiaConfParserError(msg)
+                            else:
+                                if l_above <= 0:
+                                    msg = ('FATAL: configuration error, malformed'
+                                           ' listener threshold_above_floor option')
+                                    raise DiaConfParserError(msg)
+                                else:
+                                    this_listener['threshold_above_floor'] = l_above
+
+                        if 'threshold_off_above_floor' not in this_listener:
+                            this_listener['threshold_off_above_floor'] = this_listener['threshold_above_floor']
+                        elif this_listener['threshold_above_floor'] is None:
+                            msg = ('FATAL: configuration error, listener'
+                                   ' threshold_off_above_floor option without'
+                                   ' threshold_above_floor')
                             raise DiaConfParserError(msg)
                         else:
-                            if not l_threshold.is_integer():
-                                # check if number is integer
+                            try:
+                                # convert from string to a float
+                                l_off_above = float(this_listener['threshold_off_above_floor'])
+                            except ValueError:
+                                msg = ('FATAL: configuration error, malformed'
+                                       ' listener threshold_off_above_floor option')
+                                raise DiaConfParserError(msg)
+                            else:
+                                # hysteresis, must not be above threshold_above_floor
+                                if l_off_above > this_listener['threshold_above_floor']:
+                                    msg = ('FATAL: configuration error, malformed'
+                                           ' listener threshold_off_above_floor option')
+                                    raise DiaConfParserError(msg)
+                                else:
+                                    this_listener['threshold_off_above_floor'] = l_off_above
+
+                        if 'level_threshold' not in this_listener:
+                            if this_listener['threshold_above_floor'] is None:
+                                msg = ('FATAL: configuration error, missing'
+                                       ' listener level_threshold definition')
+                                raise DiaConfParserError(msg)
+                            else:
+                                this_listener['level_threshold'] = None
+                        else:
+                            try:
+                                # convert from string to a float
+                                l_threshold = float(this_listener['level_threshold'])
+                            except ValueError:
                                 msg = ('FATAL: configuration error, malformed'
                                        'listener level_threshold definition')
                                 raise DiaConfParserError(msg)
                             else:
-                                this_listener['level_threshold'] = l_threshold
+                                if not l_threshold.is_integer():
+                                    # check if number is integer
+                                    msg = ('FATAL: configuration error, malformed'
+                                           'listener level_threshold definition')
+                                    raise DiaConfParserError(msg)
+                                else:
+                                    this_listener['level_threshold'] = l_threshold
 
                         # define optional fields
+                        if 'level_threshold_off' not in this_listener:
+                            this_listener['level_threshold_off'] = this_listener['level_threshold']
+                        elif this_listener['level_threshold'] is None:
+                            msg = ('FATAL: configuration error, listener'
+                                   ' level_threshold_off option without'
+                                   ' level_threshold')
+                            raise DiaConfParserError(msg)
+                        else:
+                            try:
+                                # convert from string to a float
+                                l_threshold_off = float(this_listener['level_threshold_off'])
+                            except ValueError:
+                                msg = ('FATAL: configuration error, malformed'
+                                       ' listener level_threshold_off option')
+                                raise DiaConfParserError(msg)
+                            else:
+                                # hysteresis, must not be above level_threshold
+                                if l_threshold_off > this_listener['level_threshold']:
+                                    msg = ('FATAL: configuration error, malformed'
+                                           ' listener level_threshold_off option')
+                                    raise DiaConfParserError(msg)
+                                else:
+                                    this_listener['level_threshold_off'] = l_threshold_off
+
                         if 'modulation' not in this_listener:
                             this_listener['modulation'] = ''
                         if (this_listener['modulation'].lower() not in
@@ -835,6 +1332,33 @@ class DiaConfParser(object):
                                    ' Disabling audio output for the listener.')
                             logging.info(msg)
 
+                        # signal level reporting rules
+                        # and signal status dwell times
+                        for option, default in [('report_min_change', 1.0),
+                                                ('report_min_interval', 0.0),
+                                                ('report_max_silence', 5.0),
+                                                ('dwell_present', 0.0),
+                                                ('dwell_absent', 0.0)]:
+                            if option not in this_listener:
+                                this_listener[option] = default
+                            else:
+                                try:
+                                    # convert from string to a float
+                                    value = float(this_listener[option])
+                                except ValueError:
+                                    msg = ('FATAL: configuration error,'
+                                           ' malformed listener'
+                                           ' {o} option').format(o=option)
+                                    raise DiaConfParserError(msg)
+                                else:
+                                    if value < 0:
+                                        msg = ('FATAL: configuration error,'
+                                               ' malformed listener'
+                                               ' {o} option').format(o=option)
+                                        raise DiaConfParserError(msg)
+                                    else:
+                                        this_listener[option] = value
+
                         if 'freq_analyzer_tap' not in this_listener:
                             this_listener['freq_analyzer_tap'] = False
                         else:
@@ -848,6 +1372,16 @@ class DiaConfParser(object):
                                 elif this_listener['freq_analyzer_tap'].lower() == 'true':
                                     this_listener['freq_analyzer_tap'] = True
 
+                        # detection profile, defaults to the probe's
+                        if 'detection_profile' not in this_listener:
+                            this_listener['detection_profile'] = this_probe['detection_profile']
+                        elif this_listener['detection_profile'] not in profiles:
+                            msg = ('FATAL: configuration error, malformed'
+                                   ' listener detection_profile option')
+                            raise DiaConfParserError(msg)
+                        this_listener['detection'] = dict(
+                            profiles[this_listener['detection_profile']])
+
         # return configuration
         return conf
 
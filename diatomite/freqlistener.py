@@ -21,16 +21,18 @@
 """
 
 import os
-from datetime import datetime
+import math
+import fractions
+import time
 import threading
 from string import ascii_letters, digits
 import logging
-import collections
+import itertools
 import numpy
 from gnuradio import gr
-from gnuradio import blocks
 from gnuradio import filter as grfilter
 from gnuradio.fft import logpwrfft
+from gnuradio.fft import window
 from gnuradio import analog
 import radiosource
 import diatomite_aux as dia_aux
@@ -195,6 +197,14 @@ class FreqListeners(object):
 
         return self._freq_listener_dict[lid]
 
+    def set_level_table(self, level_table):
+        """Set the shared memory table where the listeners write their
+        signal levels
+        level_table -- a DiaLevelTable object, None to send messages"""
+
+        for freq_listener_id in self._freq_listener_dict:
+            self._freq_listener_dict[freq_listener_id].set_level_table(level_table)
+
     def start(self):
         """Start this object and it's children"""
 
@@ -245,6 +255,64 @@ class FreqListener(object):
     from a radio signal.
     """
 
+    # the listener's signal is decimated to the lowest rate at least this
+    # many times it's bandwidth, keeping bins around the band for the
+    # noise floor
+    RATE_OVERSAMPLE = 2
+
+    # fraction of the listener's signal rate kept flat by the decimation
+    DECIMATION_PASSBAND = 0.8
+
+    # the demodulators take audio at a multiple of this rate, in Hz
+    AUDIO_RATE = 50000
+
+    # fft windows available to detection profiles, gnuradio.fft.window
+    # function names
+    FFT_WINDOWS = ('blackmanharris', 'blackman', 'hamming', 'hanning',
+                   'rectangular', 'flattop')
+
+    # built in detection profiles, trading CPU for detection latency and
+    # accuracy, the configuration may override them or add new ones:
+    #  fft_size -- number of bins of the FFT
+    #  frame_rate -- FFT frames per second
+    #  window -- FFT window, one of FFT_WINDOWS
+    #  avg_alpha -- FFT averaging factor, 1.0 for no averaging
+    #  avg_time -- time the signal level is averaged over, in seconds
+    #  slice_percentage -- percentage of the bins, around the center
+    #      frequency, where the signal level is evaluated
+    #  tap_rate -- frequency analyzer tap updates per second
+    DETECTION_PROFILES = {
+        'default': {
+            'fft_size': 1024,
+            'frame_rate': 30.0,
+            'window': 'blackmanharris',
+            'avg_alpha': 1.0,
+            'avg_time': 1.0,
+            'slice_percentage': 10.0,
+            'tap_rate': 10.0
+        },
+        # for Raspberry Pi class hardware
+        'lightweight': {
+            'fft_size': 256,
+            'frame_rate': 10.0,
+            'window': 'hamming',
+            'avg_alpha': 1.0,
+            'avg_time': 1.0,
+            'slice_percentage': 10.0,
+            'tap_rate': 2.0
+        },
+        # for critical stations, faster detection
+        'fast': {
+            'fft_size': 512,
+            'frame_rate': 60.0,
+            'window': 'blackmanharris',
+            'avg_alpha': 1.0,
+            'avg_time': 0.25,
+            'slice_percentage': 10.0,
+            'tap_rate': 10.0
+        }
+    }
+
     def __init__(self, conf, radio_source, tap_dir_path):
         """init the FreqListener
         conf -- a dictionary with a valid configuration
@@ -266,10 +334,13 @@ class FreqListener(object):
 
         self._supported_modulations = ['fm', 'am']
 
-        self._decimation = 1
         self._samp_rate = 500000
-        self._transition_bw = 2000
-        self._filter_taps = None
+
+        # stages decimating the radio source's signal to the listener's
+        # rate, and the (interpolation, decimation) of the resampler
+        # taking it to a rate the demodulators take, None if not needed
+        self._decimation_plan = None
+        self._audio_resampling = None
         self._gr_top_block = None
 
         self._log_fft = None
@@ -278,10 +349,24 @@ class FreqListener(object):
         self._fft_frame_rate = 30
         self._fft_avg_alpha = 1.0
         self._fft_average = False
+        self._fft_window = 'blackmanharris'
+
+        # time the signal level is averaged over, in seconds, and the
+        # running average keeping it, sized for the rate levels are checked
+        # at, see set_level_rate
+        self._avg_time = 1.0
+        self._avg_sig = None
+        self._level_rate = None
 
-        # probe poll rate in hz
+        # percentage of the fft bins where the signal level is evaluated
+        self._slice_percentage = 10
+
+        # probe poll rate in hz, the rate at which taps are updated
         self._probe_poll_rate = 10
 
+        # time of the last signal metrics and tap update
+        self._poll_time = 0
+
         # Signal power threshold to determine if it's transmitting.
         self._signal_pwr_threshold = None
 
@@ -292,7 +377,8 @@ class FreqListener(object):
 
         self._tap_directory = None
 
-        self._sys_state = None
+        # the component's system state, a DiaSysState object
+        self._sys_state = dia_aux.DiaSysState()
         self._sig_state = dia_aux.DiaSigState()
 
         self._probe_stop = threading.Event()
@@ -308,12 +394,47 @@ class FreqListener(object):
         self._freq_translation_filter_input = None
         self._freq_translation_filter_output = None
 
-        self._retrieve_fft_thread = None
-
         # frequency offset from the radio source
         self._frequency_offset = 0
 
-        self._fft_signal_probe = None
+        # radio source channelizer channel this listener is on, None if
+        # filtering the whole band, and the offset from the channel's center
+        self._channel = None
+        self._channel_offset = 0
+
+        # sink receiving the fft frames, and a lock held while processing
+        # them
+        self._fft_sink = None
+        self._fft_frames_lock = threading.Lock()
+
+        # shared memory table for signal levels, and this listener's slot
+        self._level_table = None
+        self._level_slot = None
+
+        # rules deciding when signal levels are reported
+        self._report_rules = dia_aux.DiaReportRules()
+
+        # state machine deciding when the signal is present
+        self._sig_detector = dia_aux.DiaSigDetector()
+
+        # noise floor estimate, from the bins outside the fft slice, and
+        # thresholds relative to it, None for fixed thresholds
+        self._floor_estimator = dia_aux.DiaNoiseFloor()
+        self._noise_floor = None
+        self._threshold_above_floor = None
+        self._threshold_off_above_floor = None
+
+        # signal quality metrics, on the bins of the listener's bandwidth,
+        # and the latest (snr, peak offset, occupied bandwidth)
+        self._band_slice = None
+        self._sig_metrics = None
+        self._metrics = (None, None, None)
+
+        # sequence numbers for the messages sent, shared by all message
+        # types, so the api service can tell lost or reordered messages,
+        # they start over on each run of the listener, see start
+        self._msg_seqs = itertools.count(1)
+        self._msg_run = None
 
         if (conf is not None and radio_source is not None
                 and tap_dir_path is not None):
@@ -323,19 +444,19 @@ class FreqListener(object):
                    ' tap_dir_pat:{tp}').format(c=conf, tp=tap_dir_path)
             raise FreqListenerError(msg)
 
-        # initialize the queue, will keep enough for a second of signals
-        # (self._probe_poll_rate is the number of times the probe happens
-        # per second)
-        self._avg_sig_col = collections.deque(self._probe_poll_rate*[0],
-                                              self._probe_poll_rate)
+        # levels are checked on each of the listener's fft frames, on
+        # wideband detection the radio source sets it's own fft rate
+        self.set_level_rate(self._fft_frame_rate)
 
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.INIT,
-                                             current_time)
+        self._setup_fft_slices()
+
+        current_time = time.time()
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.INIT, current_time))
 
         self._notify_sys_state_change()
 
-        current_time = datetime.utcnow().isoformat()
+        current_time = time.time()
         level = 0
         new_sig_state = dia_aux.DiaSigInfo(dia_aux.DiaSigStatus.INIT, level,
                                            current_time)
@@ -352,9 +473,9 @@ class FreqListener(object):
         self.set_radio_source(radio_source)
         self.set_id(conf['id'])
 
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.PRE_INIT,
-                                             current_time)
+        current_time = time.time()
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.PRE_INIT, current_time))
 
         self._notify_sys_state_change()
 
@@ -369,14 +490,33 @@ class FreqListener(object):
 
         self.set_bandwidth(conf['bandwidth'])
 
-        self.set_signal_pwr_threshold(conf['level_threshold'])
+        if conf['level_threshold'] is not None:
+            self.set_signal_pwr_threshold(conf['level_threshold'])
         msg = '----->> LT:{lt}'.format(lt=conf['level_threshold'])
         logging.debug(msg)
 
+        self.set_floor_thresholds(conf['threshold_above_floor'],
+                                  conf['threshold_off_above_floor'])
+
+        self.set_signal_detection_rules(conf['level_threshold_off'],
+                                        conf['dwell_present'],
+                                        conf['dwell_absent'])
+
+        self.set_report_rules(conf['report_min_change'],
+                              conf['report_min_interval'],
+                              conf['report_max_silence'])
+
+        self.set_detection_profile(conf['detection'])
+
         self.set_spectrum_analyzer_tap_enable(conf['freq_analyzer_tap'])
 
         self.set_audio_enable(conf['audio_output'])
 
+        if radio_source.get_channel_count() and self.get_band_filter_enable():
+            self._set_channel()
+        else:
+            self._set_decimation()
+
         msg = ('Initialized with freq {f}, bw:{bw}, modulation:{md},'
                ' tap_dir:{td}, tap_out:{to} , audio_out:{ao}'
                ' id:{id}').format(f=self.get_frequency(),
@@ -481,6 +621,26 @@ class FreqListener(object):
 
         self._tap_directory = tmp_tap_directory
 
+    def set_level_table(self, level_table):
+        """Set the shared memory table where signal levels are written,
+        instead of being sent as messages.
+        level_table -- a DiaLevelTable object, None to send messages"""
+
+        if level_table is None:
+            self._level_table = None
+            self._level_slot = None
+            return
+
+        slot = level_table.get_slot(self._radio_source.get_id(),
+                                    self.get_id())
+        if slot is None:
+            msg = ('Listener {id} has no slot on the level'
+                   ' table').format(id=self.get_id())
+            raise FreqListenerError(msg)
+
+        self._level_table = level_table
+        self._level_slot = slot
+
     def get_supported_modulations(self):
         """Retrieves the supported modulations"""
 
@@ -575,8 +735,9 @@ class FreqListener(object):
 
         type_gr_top_block = type(gr_top_block)
 
-        # check if we were given an object of the right type
-        if not type_gr_top_block == gr.top_block:
+        # check if we were given an object of the right type, radio
+        # sources use a derived dia_aux.DiaTopBlock
+        if not isinstance(gr_top_block, gr.top_block):
             msg = ('gr_top_block must be of type gr.top_block,'
                    ' was {tgtb}').format(tgtb=type_gr_top_block)
             raise TypeError(msg)
@@ -643,10 +804,249 @@ class FreqListener(object):
                                   pt=self._signal_pwr_threshold)
         logging.debug(msg)
 
+    def set_signal_detection_rules(self, off_threshold, present_dwell,
+                                   absent_dwell):
+        """Set the hysteresis and dwell times deciding signal status
+        changes, the signal power threshold must be set first.
+        Thresholds relative to the noise floor take over once the floor is
+        estimated.
+        off_threshold -- level below which a present signal becomes absent,
+            not above the signal power threshold, None for the same as the
+            signal power threshold
+        present_dwell -- time the level must stay at or above the signal
+            power threshold for the signal to become present, in seconds
+        absent_dwell -- time the level must stay below off_threshold for the
+            signal to become absent, in seconds"""
+
+        on_threshold = self.get_signal_pwr_threshold()
+        if on_threshold is None:
+            # only thresholds relative to the noise floor, the signal is
+            # absent until the floor is estimated
+            on_threshold = 0
+            off_threshold = None
+
+        try:
+            self._sig_detector.set_rules(on_threshold, off_threshold,
+                                         present_dwell, absent_dwell)
+        except ValueError, exc:
+            msg = ('Invalid signal detection rules:{e}').format(e=str(exc))
+            logging.error(msg)
+            raise FreqListenerError(msg)
+
+        msg = ('{li} signal present at {on} for {pd}s, absent below {off}'
+               ' for {ad}s').format(li=self.get_id(),
+                                    on=self._sig_detector.get_on_threshold(),
+                                    pd=present_dwell,
+                                    off=self._sig_detector.get_off_threshold(),
+                                    ad=absent_dwell)
+        logging.debug(msg)
+
+    def set_floor_thresholds(self, above_floor, off_above_floor):
+        """Set the signal thresholds relative to the noise floor, taking
+        over from the fixed ones once the floor is estimated
+        above_floor -- level above the noise floor at or above which the
+            signal becomes present, in dB, None for fixed thresholds
+        off_above_floor -- level above the noise floor below which a
+            present signal becomes absent, in dB, not above above_floor"""
+
+        if above_floor is not None:
+            if off_above_floor is None:
+                off_above_floor = above_floor
+            if off_above_floor > above_floor:
+                msg = ('Off threshold {off}dB above the floor must not be'
+                       ' above the on threshold {on}dB').format(
+                           off=off_above_floor, on=above_floor)
+                logging.error(msg)
+                raise FreqListenerError(msg)
+
+        self._threshold_above_floor = above_floor
+        self._threshold_off_above_floor = off_above_floor
+
+        msg = ('{li} signal thresholds {on}dB and {off}dB above the noise'
+               ' floor').format(li=self.get_id(), on=above_floor,
+                                off=off_above_floor)
+        logging.debug(msg)
+
+    def set_noise_floor(self, noise_floor):
+        """Set the current noise floor, moving the signal thresholds when
+        they are relative to it. Called on every batch of frames, by the
+        radio source on wideband detection.
+        noise_floor -- the noise floor, in dB"""
+
+        self._noise_floor = noise_floor
+
+        if self._threshold_above_floor is not None:
+            self._sig_detector.set_rules(
+                noise_floor + self._threshold_above_floor,
+                noise_floor + self._threshold_off_above_floor,
+                self._sig_detector.get_on_dwell(),
+                self._sig_detector.get_off_dwell())
+
+    def get_noise_floor(self):
+        """Return the current noise floor, None if not estimated yet"""
+        return self._noise_floor
+
+    def set_signal_metrics(self, snr, peak_offset, occupied_bw):
+        """Set the latest signal quality metrics, published with the
+        signal levels. Called at the probe poll rate, by the radio source on
+        wideband detection.
+        snr -- signal to noise ratio, in dB
+        peak_offset -- offset of the signal peak from the listener's
+            frequency, in Hz
+        occupied_bw -- bandwidth holding 99% of the signal power, in Hz"""
+
+        self._metrics = (snr, peak_offset, occupied_bw)
+
+    def get_signal_metrics(self):
+        """Return the latest (snr, peak offset, occupied bandwidth),
+        None items if not measured yet"""
+        return self._metrics
+
+    def get_signal_detection_stats(self):
+        """Return the signal status transition counters, transitions to
+        present, to absent, and suppressed flaps"""
+        return self._sig_detector.get_stats()
+
+    def set_report_rules(self, min_change, min_interval, max_silence):
+        """Set the rules deciding when the signal level is reported,
+        signal status changes are always reported.
+        min_change -- minimum level change to report, in dB
+        min_interval -- minimum time between reports, in seconds
+        max_silence -- maximum time without a report, in seconds, 0 for
+            no heartbeat"""
+
+        try:
+            self._report_rules.set_rules(min_change, min_interval,
+                                         max_silence)
+        except ValueError, exc:
+            msg = ('Invalid report rules:{e}').format(e=str(exc))
+            logging.error(msg)
+            raise FreqListenerError(msg)
+
+        msg = ('{li} level reported on changes of {mc}dB, at most every'
+               ' {mi}s, at least every {ms}s').format(li=self.get_id(),
+                                                      mc=min_change,
+                                                      mi=min_interval,
+                                                      ms=max_silence)
+        logging.debug(msg)
+
+    def set_detection_profile(self, profile):
+        """Set the FFT and signal averaging parameters used to detect the
+        signal, must be set before the listener is started
+        profile -- a dictionary with a detection profile, as on
+            DETECTION_PROFILES"""
+
+        if profile['window'] not in self.FFT_WINDOWS:
+            msg = 'Invalid FFT window {w}'.format(w=profile['window'])
+            raise FreqListenerError(msg)
+
+        self._fft_size = profile['fft_size']
+        self._fft_frame_rate = profile['frame_rate']
+        self._fft_window = profile['window']
+        self._fft_avg_alpha = profile['avg_alpha']
+        self._fft_average = profile['avg_alpha'] < 1.0
+        self._avg_time = profile['avg_time']
+        self._slice_percentage = profile['slice_percentage']
+        self._probe_poll_rate = profile['tap_rate']
+
+        msg = ('Listener {id} detection profile set to'
+               ' {p}').format(id=self.get_id(), p=profile)
+        logging.debug(msg)
+
+    def _set_channel(self):
+        """Take the listener's signal from the radio source's channelizer,
+        on the channel closest to it's frequency"""
+
+        channel, center_offset = self._radio_source.get_channel(
+            self.get_frequency_offset())
+        channel_offset = self.get_frequency_offset() - center_offset
+
+        # the listener's band must be within the channel's passband
+        if (abs(channel_offset) + self.get_bandwidth() / 2.0 >
+                self._radio_source.get_channel_passband()):
+            msg = ('Listener {id} band does not fit on channel {c}, {o}Hz'
+                   ' from the channel center, passband is {p}Hz on each'
+                   ' side').format(id=self.get_id(), c=channel,
+                                   o=channel_offset,
+                                   p=self._radio_source.get_channel_passband())
+            logging.error(msg)
+            raise FreqListenerError(msg)
+
+        self._channel = channel
+        self._channel_offset = channel_offset
+        self._samp_rate = self._radio_source.get_channel_rate()
+
+        self._set_audio_resampling(
+            max(self.RATE_OVERSAMPLE * self.get_bandwidth(),
+                self.AUDIO_RATE))
+
+        msg = ('Listener {id} on channel {c}, {o}Hz from the channel'
+               ' center, resampling {a}').format(id=self.get_id(), c=channel,
+                                                 o=channel_offset,
+                                                 a=self._audio_resampling)
+        logging.debug(msg)
+
+    def _set_decimation(self):
+        """Plan the decimation of the radio source's signal to the lowest
+        rate fitting the listener's bandwidth"""
+
+        min_rate = self.RATE_OVERSAMPLE * self.get_bandwidth()
+        if self.get_audio_enable():
+            min_rate = max(min_rate, self.AUDIO_RATE)
+
+        self._decimation_plan = dia_aux.DiaDecimationPlan(
+            self.get_radio_source_bw(), min_rate, self.DECIMATION_PASSBAND)
+        self._samp_rate = self._decimation_plan.get_out_rate()
+
+        self._set_audio_resampling(min_rate)
+
+        msg = ('Listener {id} decimating by {d} in stages of {s}, at'
+               ' {r}Hz, resampling {a}').format(
+                   id=self.get_id(),
+                   d=self._decimation_plan.get_decimation(),
+                   s=[stage[0] for stage in
+                      self._decimation_plan.get_stages()],
+                   r=self._samp_rate, a=self._audio_resampling)
+        logging.debug(msg)
+
+    def _set_audio_resampling(self, min_rate):
+        """The demodulators need a multiple of the audio rate, when the audio
+        output is enabled and the listener's rate is not one, plan the
+        resampling to the nearest one at or above the minimum rate
+        min_rate -- lowest rate fitting the listener's bandwidth, in Hz"""
+
+        self._audio_resampling = None
+
+        if (not self.get_audio_enable() or
+                self._samp_rate % self.AUDIO_RATE == 0):
+            return
+
+        audio_rate = int(math.ceil(float(min_rate) / self.AUDIO_RATE) *
+                         self.AUDIO_RATE)
+        in_rate = int(round(self._samp_rate))
+        common = fractions.gcd(audio_rate, in_rate)
+        self._audio_resampling = (audio_rate / common, in_rate / common)
+        self._samp_rate = audio_rate
+
     def get_audio_enable(self):
         """Return True if the audio output is to be enabled."""
         return self._audio_enable
 
+    def get_band_filter_enable(self):
+        """Return True if the listener filters it's band out of the radio
+        source's signal, on wideband detection the radio source passes it
+        the band level and only listeners with audio output do"""
+
+        wideband = (self._radio_source.get_detection_mode() ==
+                    radiosource.RadioSource.DETECTION_WIDEBAND)
+
+        return not wideband or self.get_audio_enable()
+
+    def get_channel(self):
+        """Return the radio source's channelizer channel the listener takes
+        it's signal from, None when it filters the radio source's signal"""
+        return self._channel
+
     def get_id(self):
         """Returns the frequency listener id."""
         return self._id
@@ -698,6 +1098,46 @@ class FreqListener(object):
         """Returns the instance's audio sink."""
         return self._audio_sink
 
+    def set_level_rate(self, level_rate):
+        """Set the rate the signal levels are checked at, sizing the
+        running average to keep self._avg_time of levels. The listener's
+        fft frame rate on listener detection, the radio source's fft frame
+        rate on wideband detection.
+        level_rate -- levels checked per second"""
+
+        if level_rate <= 0:
+            msg = ('Listener {id} level rate must be positive, was'
+                   ' {r}').format(id=self.get_id(), r=level_rate)
+            raise FreqListenerError(msg)
+
+        avg_size = max(int(round(level_rate * self._avg_time)), 1)
+        self._level_rate = level_rate
+
+        if self._avg_sig is None:
+            self._avg_sig = dia_aux.DiaRunningAverage(avg_size)
+        elif self._avg_sig.get_size() != avg_size:
+            # start from the current average, so the signal status does
+            # not change because of the new size
+            self._avg_sig = dia_aux.DiaRunningAverage(
+                avg_size, self._avg_sig.get_average())
+
+        msg = ('Listener {id} levels checked at {r}/s, averaging {n}'
+               ' levels').format(id=self.get_id(), r=level_rate, n=avg_size)
+        logging.debug(msg)
+
+    def get_level_rate(self):
+        """Return the rate the signal levels are checked at"""
+        return self._level_rate
+
+    def get_avg_window(self):
+        """Return the time the signal levels are averaged over, in
+        seconds"""
+        return self._avg_sig.get_size() / float(self._level_rate)
+
+    def get_fft_frame_rate(self):
+        """Return the FFT frames per second the signal is checked on"""
+        return self._fft_frame_rate
+
     def get_signal_pwr_threshold(self):
         """ set the threshold above which the signal is considered present."""
         return self._signal_pwr_threshold
@@ -705,57 +1145,94 @@ class FreqListener(object):
     def _config_frequency_translation(self):
         """Configure the frequency translation filter."""
 
-        filter_samp_rate = 500e3
-        gain = 1
-        cutoff_freq = filter_samp_rate/(2 * self._decimation)
-        _filter_taps = grfilter.firdes.low_pass(gain,
-                                                filter_samp_rate,
-                                                cutoff_freq,
-                                                self._transition_bw)
+        if self._channel is not None:
+            self._config_channel_translation()
+            return
+
+        stages = self._decimation_plan.get_stages()
+
+        # the first stage shifts the listener's frequency to 0Hz, a single
+        # tap if there's nothing to decimate
+        if stages:
+            decimation, rate, cutoff, transition = stages[0]
+            _filter_taps = dia_aux.fir_tap_cache.low_pass(1, rate, cutoff,
+                                                          transition, 60)
+        else:
+            decimation = 1
+            _filter_taps = (1,)
 
         self._freq_translation_filter_input = (
-            grfilter.freq_xlating_fir_filter_ccc(self._decimation,
+            grfilter.freq_xlating_fir_filter_ccc(decimation,
                                                  (_filter_taps),
                                                  self.get_frequency_offset(),
                                                  self.get_radio_source_bw()))
+        self._freq_translation_filter_output = (
+            self._freq_translation_filter_input)
+
+        # the following stages decimate with real taps
+        for decimation, rate, cutoff, transition in stages[1:]:
+            _filter_taps = dia_aux.fir_tap_cache.low_pass(1, rate, cutoff,
+                                                          transition, 60)
+            stage_filter = grfilter.fir_filter_ccf(decimation, _filter_taps)
+            self._connect_translation_stage(stage_filter)
+
+        self._connect_audio_resampler()
+
+        msg = 'Frequency translation set.'
+        logging.debug(msg)
+
+    def _connect_audio_resampler(self):
+        """Append the resampler to a multiple of the audio rate to the
+        frequency translation, when needed"""
 
+        if self._audio_resampling is None:
+            return
+
+        interpolation, decimation = self._audio_resampling
         r_resampler = grfilter.rational_resampler_ccc(
-            interpolation=int(filter_samp_rate),
-            decimation=int(self.get_radio_source_bw()),
+            interpolation=interpolation,
+            decimation=decimation,
             taps=None,
             fractional_bw=None,
         )
+        self._connect_translation_stage(r_resampler)
+
+    def _connect_translation_stage(self, stage):
+        """Append a stage to the frequency translation
+        stage -- the stage's block"""
 
         try:
-            self._gr_top_block.connect(self._freq_translation_filter_input,
-                                       r_resampler)
+            self._gr_top_block.connect(self._freq_translation_filter_output,
+                                       stage)
         except Exception, exc:
-            msg = ('Failed connecting input filter to rational resampler'
+            msg = ('Failed connecting frequency translation stage'
                    ' {m}').format(m=str(exc))
             logging.debug(msg)
             raise
 
-        msg = 'Input filter connected to rational resampler.'
+        self._freq_translation_filter_output = stage
+
+        msg = 'Frequency translation stage connected.'
         logging.debug(msg)
 
+    def _config_channel_translation(self):
+        """Configure the frequency translation filter for a channel of the
+        radio source's channelizer, the channel is already filtered and at
+        a low rate, only the offset from it's center is left to shift."""
+
+        # a single tap, the filter only shifts the frequency
+        _filter_taps = (1,)
+
+        self._freq_translation_filter_input = (
+            grfilter.freq_xlating_fir_filter_ccc(
+                1, _filter_taps, self._channel_offset,
+                self._radio_source.get_channel_rate()))
         self._freq_translation_filter_output = (
-            grfilter.freq_xlating_fir_filter_ccc(self._decimation,
-                                                 (_filter_taps),
-                                                 0,
-                                                 filter_samp_rate))
-        try:
-            self._gr_top_block.connect(r_resampler,
-                                       self._freq_translation_filter_output)
-        except Exception, exc:
-            msg = ('Failed connecting rational resampler to output filter'
-                   ' {m}').format(m=str(exc))
-            logging.debug(msg)
-            raise
+            self._freq_translation_filter_input)
 
-        msg = 'Input rational resampler connected to output filter.'
-        logging.debug(msg)
+        self._connect_audio_resampler()
 
-        msg = 'Frequency translation set.'
+        msg = 'Channel frequency translation set.'
         logging.debug(msg)
 
     def get_spectrum_analyser_tap_enable(self):
@@ -768,7 +1245,11 @@ class FreqListener(object):
         """
 
         if isinstance(self._radio_source, radiosource.RadioSource):
-            radio_source_block = self._radio_source.get_source_block()
+            if self._channel is not None:
+                radio_source_block = self._radio_source.get_channel_output(
+                    self._channel)
+            else:
+                radio_source_block = self._radio_source.get_source_block()
         else:
             msg = ('RadioSource for this listener not set,'
                    ' Unable to obtain source block')
@@ -797,7 +1278,8 @@ class FreqListener(object):
                 ref_scale=self._fft_ref_scale,
                 frame_rate=self._fft_frame_rate,
                 avg_alpha=self._fft_avg_alpha,
-                average=self._fft_average
+                average=self._fft_average,
+                win=getattr(window, self._fft_window)
             )
         except Exception, exc:
             msg = ('Failed setting up fft for listener {id} with'
@@ -813,6 +1295,7 @@ class FreqListener(object):
         try:
             self._gr_top_block.connect(self._freq_translation_filter_output,
                                        self._log_fft)
+            self._gr_top_block.set_block_role(self._log_fft, 'fft')
         except Exception, exc:
             msg = ('Failed to connect the fft to freq translation, with:'
                    ' {m}').format(m=str(exc))
@@ -822,52 +1305,46 @@ class FreqListener(object):
         msg = 'FFT connected to Frequency translation.'
         logging.debug(msg)
 
-    def _check_signal_present(self, fft_val, current_time):
-        """Check if the signal is present by comparing the power to the power
-        threshold, evaluating the average level on a slice of the FFT around
-        the center frequency.
-        fft_val -- fft tuple/array to be checked
-        current_time -- time when the signal was collected
+    def check_signal_level(self, signal_avg, current_time):
+        """Check if the signal is present by comparing the power to the
+        power threshold, and notify the signal state or level.
+        Called by the radio source on wideband detection.
+        signal_avg -- average level on the listener's band
+        current_time -- time when the signal was collected, seconds since
+            epoch
         """
 
-        # slice lenght to evaluate (%)
-        slice_percentage = 10
-
-        fft_len = len(fft_val)
-
-        slice_len = (fft_len * slice_percentage) / 100
-
-        slice_start = (fft_len / 2) - int(slice_len / 2)
-        slice_end = (fft_len / 2) + int(slice_len / 2)
-
-        # compute average for the slice
-        signal_avg = numpy.mean(fft_val[slice_start:slice_end])
-
-        # update signal collection
-        self._avg_sig_col.pop()
-        self._avg_sig_col.appendleft(signal_avg)
-
-        # calculate running average for the signal:
-        running_avg = sum(self._avg_sig_col) / float(len(self._avg_sig_col))
-
-        msg = ('{lid} Signal:{s}, running avg:{ra}, asg:{asq} ,'
-               ' threshold:{t}').format(lid=self.get_id(), s=signal_avg,
-                                        ra=running_avg, asq=self._avg_sig_col,
-                                        t=self.get_signal_pwr_threshold())
-        logging.debug(msg)
+        # update signal collection and running average for the signal:
+        running_avg = self._avg_sig.add(signal_avg)
+
+        # this runs on every tick, only build the message when it's logged
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            msg = ('{lid} Signal:{s}, running avg:{ra}, asg:{asq} ,'
+                   ' threshold:{t}, off threshold:{ot},'
+                   ' floor:{nf}').format(
+                       lid=self.get_id(), s=signal_avg, ra=running_avg,
+                       asq=self._avg_sig.get_samples(),
+                       t=self._sig_detector.get_on_threshold(),
+                       ot=self._sig_detector.get_off_threshold(),
+                       nf=self._noise_floor)
+            logging.debug(msg)
 
         if signal_avg == 0:
+            # no signal at all, below any threshold
             sig_level = 0
-            sig_status = dia_aux.DiaSigStatus.ABSENT
-        elif running_avg >= self.get_signal_pwr_threshold():
-            sig_status = dia_aux.DiaSigStatus.PRESENT
-            sig_level = signal_avg
+            running_avg = float('-inf')
         else:
-            sig_status = dia_aux.DiaSigStatus.ABSENT
             sig_level = signal_avg
 
+        sig_status = self._sig_detector.check(running_avg, current_time)
+
         new_sig_info = dia_aux.DiaSigInfo(sig_status, sig_level,
                                           current_time)
+        new_sig_info.set_metrics(*self._metrics)
+
+        if self._level_table is not None:
+            self._level_table.write(self._level_slot, sig_status, sig_level,
+                                    current_time, self._metrics)
 
         # check if signal state changed:
 
@@ -876,43 +1353,100 @@ class FreqListener(object):
             self._sig_state.set_new(new_sig_info)
 
             self._notify_sig_state_change()
+            self._report_rules.reset(sig_level, current_time)
         else:
             # state did not change, update only level
             self._sig_state.update_current(new_sig_info)
-            self._notify_sig_level()
-
-    def _retrieve_fft(self, stop_event):
-        """Retrieve fft values"""
-
-        low_freq = self.get_lower_frequency()
-        high_freq = self.get_upper_frequency()
-        band_w = self.get_bandwidth()
-
-        while not stop_event.is_set():
-
-            current_time = datetime.utcnow().isoformat()
-
-            # logpower fft swaps the lower and upper halfs of
-            # the spectrum, this fixes it
-            vraw = self._fft_signal_probe.level()
-            val = vraw[len(vraw)/2:]+vraw[:len(vraw)/2]
-
-            # check if the signal is present
-            self._check_signal_present(val, current_time)
 
-            # update taps
-            if self.get_spectrum_analyser_tap_enable():
-                tap_value = '{t};{bw};{lf};{hf};{v}\n'.format(t=current_time,
-                                                              v=val, bw=band_w,
-                                                              lf=low_freq,
-                                                              hf=high_freq)
-
-                self._freq_analyzer_tap.update_value(tap_value)
-
-                msg = 'updating data tap'
-                logging.debug(msg)
-
-            stop_event.wait(1.0 / self._probe_poll_rate)
+            # levels are read from the level table, when there's one,
+            # otherwise they are notified when the report rules say so
+            if (self._level_table is None and
+                    self._report_rules.check(sig_level, current_time)):
+                self._notify_sig_level()
+
+    def _setup_fft_slices(self):
+        """Set up the slices of the FFT frames where the signal level, the
+        signal quality metrics and the noise floor are evaluated"""
+
+        # slice of the FFT around the center frequency where the signal
+        # level is evaluated, at least a bin on each side
+        half_slice = max(int(self._fft_size * self._slice_percentage / 200),
+                         1)
+        self._fft_slice = dia_aux.DiaFrameSlice(
+            self._fft_size, (self._fft_size / 2) - half_slice,
+            (self._fft_size / 2) + half_slice)
+
+        # bins of the listener's bandwidth, where the signal quality
+        # metrics are evaluated
+        bin_width = float(self._samp_rate) / self._fft_size
+        half_band = min(max(int(self.get_bandwidth() / bin_width / 2), 1),
+                        self._fft_size / 2)
+        self._band_slice = dia_aux.DiaFrameSlice(
+            self._fft_size, (self._fft_size / 2) - half_band,
+            (self._fft_size / 2) + half_band)
+        self._sig_metrics = dia_aux.DiaSigMetrics(2 * half_band, bin_width)
+
+        # bins where the noise floor is estimated, outside the listener's
+        # bandwidth, so that it's own signal does not raise the floor, or
+        # outside the level slice when the bandwidth fills the FFT
+        self._floor_ranges = self._band_slice.get_outside_ranges()
+        if not self._floor_ranges:
+            self._floor_ranges = self._fft_slice.get_outside_ranges()
+
+    def _get_floor_bins(self, frames):
+        """Return the bins of the frames where the noise floor is estimated
+        frames -- 2D numpy array, a frame on each row, as sent by the FFT"""
+
+        return dia_aux.join_bin_ranges(frames, self._floor_ranges)
+
+    def _process_fft_frames(self, frames):
+        """Check if the signal is present on each fft frame, evaluating
+        the average level on a slice of the FFT around the center frequency.
+        Called by the fft sink, from the flowgraph's thread.
+        frames -- 2D numpy array, a frame on each row, as sent by the FFT"""
+
+        with self._fft_frames_lock:
+            if self._probe_stop.is_set():
+                return
+
+            current_time = time.time()
+
+            # estimate the noise floor outside the listener's bandwidth
+            self.set_noise_floor(
+                self._floor_estimator.update(self._get_floor_bins(frames)))
+
+            # update signal metrics and taps, at the probe poll rate
+            if current_time - self._poll_time >= 1.0 / self._probe_poll_rate:
+                self._poll_time = current_time
+
+                self.set_signal_metrics(*self._sig_metrics.get_metrics(
+                    self._band_slice.get_spectrum(frames), self._noise_floor))
+
+                if self.get_spectrum_analyser_tap_enable():
+                    # logpower fft swaps the lower and upper halfs of
+                    # the spectrum, this fixes it
+                    val = tuple(numpy.fft.fftshift(frames[-1]).tolist())
+                    self.update_freq_analyzer_tap(val, current_time)
+
+            # compute average for the slice, on every frame
+            for signal_avg in self._fft_slice.get_levels(frames):
+                self.check_signal_level(signal_avg, current_time)
+
+    def update_freq_analyzer_tap(self, fft_val, current_time):
+        """Write the latest fft values to the frequency analyzer tap
+        fft_val -- fft values for the listener's band
+        current_time -- time when the signal was collected, seconds since
+            epoch"""
+
+        tap_value = '{t};{bw};{lf};{hf};{v}\n'.format(
+            t=dia_aux.format_time(current_time), v=fft_val,
+            bw=self.get_bandwidth(),
+            lf=self.get_lower_frequency(), hf=self.get_upper_frequency())
+
+        self._freq_analyzer_tap.update_value(tap_value)
+
+        msg = 'updating data tap'
+        logging.debug(msg)
 
     def _setup_freq_analyzer_tap(self):
         """Setup a tap to provide live frequency analyzer values.
@@ -943,57 +1477,59 @@ class FreqListener(object):
 
         self._freq_analyzer_tap.stop()
 
-    def _setup_rf_fft_probe(self):
-        """Setup probe to retrieve the fft data"""
+    def _setup_rf_fft_sink(self):
+        """Setup a sink receiving every fft frame, on the flowgraph's
+        thread"""
 
         try:
-            self._fft_signal_probe = blocks.probe_signal_vf(self._fft_size)
+            self._fft_sink = dia_aux.DiaFrameSink(self._fft_size,
+                                                  self._process_fft_frames)
         except Exception, exc:
-            msg = ('Failed to create fft probe, with:'
+            msg = ('Failed to create fft sink, with:'
                    ' {m}').format(m=str(exc))
             logging.debug(msg)
             raise Exception(msg)
 
-        # connect the signal probe to the fft
+        # connect the sink to the fft
         try:
-            self._gr_top_block.connect(self._log_fft,
-                                       self._fft_signal_probe)
+            self._gr_top_block.connect(self._log_fft, self._fft_sink)
+            self._gr_top_block.set_block_role(self._fft_sink, 'fft')
         except Exception, exc:
-            msg = ('Failed to connect the fft to freq translation, with:'
+            msg = ('Failed to connect the fft to the fft sink, with:'
                    ' {m}').format(m=str(exc))
             logging.debug(msg)
             raise Exception(msg)
 
-        msg = ('Listener {id}, Launching fft data retrieval'
-               ' thread.').format(id=self.get_id())
-        logging.debug(msg)
-
-        # set the fft retrieval on it's own thread
-        self._retrieve_fft_thread = threading.Thread(target=self._retrieve_fft,
-                                                     name=self.get_id(),
-                                                     args=(self._probe_stop,))
-        self._retrieve_fft_thread.daemon = True
-        self._retrieve_fft_thread.start()
-
-        msg = ('Listener {id} signal probe setup'
+        msg = ('Listener {id} fft sink setup'
                ' done.').format(id=self.get_id())
         logging.debug(msg)
 
     def _stop_signal_probe(self):
-        """Stop the fft data probe"""
+        """Stop checking the fft frames"""
 
-        # send the stop event to the thread
+        # frames still reaching the sink are ignored
         self._probe_stop.set()
 
+        # the signal state must not change once the listener is stopped,
+        # wait for frames being processed
+        with self._fft_frames_lock:
+            pass
+
     def start(self):
         """Start the frequency listener."""
 
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.START,
-                                             current_time)
+        current_time = time.time()
+
+        # a new run, on the radio source's subprocess, the sequence numbers
+        # used before by the parent process are left behind
+        self._msg_run = '{p}-{t:.6f}'.format(p=os.getpid(), t=current_time)
+        self._msg_seqs = itertools.count(1)
+
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.START, current_time))
         self._notify_sys_state_change()
 
-        current_time = datetime.utcnow().isoformat()
+        current_time = time.time()
         level = 0
         new_sig_state = dia_aux.DiaSigInfo(dia_aux.DiaSigStatus.START, level,
                                            current_time)
@@ -1003,32 +1539,39 @@ class FreqListener(object):
         # set the top block
         self.set_top_block(self._radio_source.get_gr_top_block())
 
-        # configure frequency translator
-        try:
-            self._config_frequency_translation()
-        except Exception, exc:
-            msg = ('Failed configuring frequency translation with'
-                   ' {m}').format(m=str(exc))
-            logging.debug(msg)
-            raise Exception(msg)
+        # on wideband detection the radio source passes this listener it's
+        # band level, the frequency translator is only needed for audio
+        wideband = (self._radio_source.get_detection_mode() ==
+                    radiosource.RadioSource.DETECTION_WIDEBAND)
 
-        # connect frequency translator to source
-        try:
-            self._connect_frequency_translator_to_source()
-        except Exception, exc:
-            msg = ('Failed connecting frequency translation to source'
-                   'with {m}').format(m=str(exc))
-            logging.debug(msg)
-            raise Exception(msg)
+        if self.get_band_filter_enable():
+            # configure frequency translator
+            try:
+                self._config_frequency_translation()
+            except Exception, exc:
+                msg = ('Failed configuring frequency translation with'
+                       ' {m}').format(m=str(exc))
+                logging.debug(msg)
+                raise Exception(msg)
 
-        # setup fft and connect it to frequency translator
-        try:
-            self._setup_rf_fft()
-        except Exception, exc:
-            msg = ('Failed to setup RF FFT'
-                   ' with {m}').format(m=str(exc))
-            logging.debug(msg)
-            raise Exception(msg)
+            # connect frequency translator to source
+            try:
+                self._connect_frequency_translator_to_source()
+            except Exception, exc:
+                msg = ('Failed connecting frequency translation to source'
+                       'with {m}').format(m=str(exc))
+                logging.debug(msg)
+                raise Exception(msg)
+
+        if not wideband:
+            # setup fft and connect it to frequency translator
+            try:
+                self._setup_rf_fft()
+            except Exception, exc:
+                msg = ('Failed to setup RF FFT'
+                       ' with {m}').format(m=str(exc))
+                logging.debug(msg)
+                raise Exception(msg)
 
         # handle the fft tap creation
         # thread for data tap must be present before
@@ -1044,21 +1587,22 @@ class FreqListener(object):
 
         # obtain the fft values
         # this is needed even if the spectrum analyzer is not enabled
-        try:
-            self._setup_rf_fft_probe()
-        except Exception, exc:
-            msg = ('Failed to setup signal probe'
-                   ' with {m}').format(m=str(exc))
-            logging.debug(msg)
-            raise Exception(msg)
+        if not wideband:
+            try:
+                self._setup_rf_fft_sink()
+            except Exception, exc:
+                msg = ('Failed to setup fft sink'
+                       ' with {m}').format(m=str(exc))
+                logging.debug(msg)
+                raise Exception(msg)
 
         # start sound output
         if self.get_audio_enable():
             self.do_snd_output()
 
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.RUN,
-                                             current_time)
+        current_time = time.time()
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.RUN, current_time))
         self._notify_sys_state_change()
 
     def stop(self):
@@ -1067,19 +1611,25 @@ class FreqListener(object):
         msg = 'stopping frequency listener {id}'.format(id=self.get_id())
         logging.debug(msg)
 
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.SHUTDOWN,
-                                             current_time)
+        msg = ('{id} signal status transitions:'
+               ' {st}').format(id=self.get_id(),
+                               st=self.get_signal_detection_stats())
+        logging.info(msg)
+
+        current_time = time.time()
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.SHUTDOWN, current_time))
         self._notify_sys_state_change()
 
-        current_time = datetime.utcnow().isoformat()
+        current_time = time.time()
         level = 0
         new_sig_state = dia_aux.DiaSigInfo(dia_aux.DiaSigStatus.SHUTDOWN,
                                            level, current_time)
         self._sig_state.set_new(new_sig_state)
         self._notify_sig_state_change()
 
-        if self._sys_state.get_status() == dia_aux.DiaSysStatus.RUN:
+        sys_status = self._sys_state.get_current().get_status()
+        if sys_status == dia_aux.DiaSysStatus.RUN:
 
             if self.get_spectrum_analyser_tap_enable():
                 # stop the fft tap
@@ -1100,14 +1650,14 @@ class FreqListener(object):
 
         else:
             msg = ("Will not stop listener, as status is"
-                   " {s}").format(s=self._sys_state.get_status().name)
+                   " {s}").format(s=sys_status.name)
             logging.error(msg)
             msg = 'not yet done'
             raise FreqListenerError(msg)
 
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.STOP,
-                                             current_time)
+        current_time = time.time()
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.STOP, current_time))
 
         self._notify_sys_state_change()
 
@@ -1125,8 +1675,9 @@ class FreqListener(object):
     def _demodulate(self):
         """Apply the selected demodulation"""
 
-        samp_rate = 500000
-        audio_decimation = 10
+        # the listener's rate is a multiple of the audio rate
+        samp_rate = self._samp_rate
+        audio_decimation = max(int(samp_rate / self.AUDIO_RATE), 1)
 
         # define input and output blocks
         demod_in_blk = self._freq_translation_filter_output
@@ -1150,8 +1701,10 @@ class FreqListener(object):
 
         lnr_id = self.get_id()
         sig_type = dia_aux.DiaMsgType.LNR_SYS_STATE_CHANGE
-        payload = self._sys_state.get_json()
-        new_msg = dia_aux.DiaListenerMsg(sig_type, lnr_id, payload)
+        payload = self._sys_state.get_snapshot()
+        new_msg = dia_aux.DiaMsg(sig_type, payload, listener_id=lnr_id,
+                                 seq=self._msg_seqs.next(),
+                                 run=self._msg_run)
 
         msg = ('listener {lnr} sending sys state'
                ' change message:{m}').format(lnr=lnr_id, m=new_msg)
@@ -1164,8 +1717,10 @@ class FreqListener(object):
 
         lnr_id = self.get_id()
         sig_type = dia_aux.DiaMsgType.LNR_SIG_STATUS_CHANGE
-        payload = self._sig_state.get_json()
-        new_msg = dia_aux.DiaListenerMsg(sig_type, lnr_id, payload)
+        payload = self._sig_state.get_snapshot()
+        new_msg = dia_aux.DiaMsg(sig_type, payload, listener_id=lnr_id,
+                                 seq=self._msg_seqs.next(),
+                                 run=self._msg_run)
 
         msg = ('listener {lnr} sending sig state'
                ' change message:{m}').format(lnr=lnr_id, m=new_msg)
@@ -1178,8 +1733,10 @@ class FreqListener(object):
 
         lnr_id = self.get_id()
         sig_type = dia_aux.DiaMsgType.LNR_SIG_STATE
-        payload = self._sig_state.get_json()
-        new_msg = dia_aux.DiaListenerMsg(sig_type, lnr_id, payload)
+        payload = self._sig_state.get_snapshot()
+        new_msg = dia_aux.DiaMsg(sig_type, payload, listener_id=lnr_id,
+                                 seq=self._msg_seqs.next(),
+                                 run=self._msg_run)
 
         msg = ('listener {lnr} sending sig level'
                ' message:{m}').format(lnr=lnr_id, m=new_msg)
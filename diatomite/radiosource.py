@@ -20,6 +20,7 @@
 """
 
 import os
+import time
 import logging
 import threading
 import sys
@@ -27,7 +28,7 @@ import signal
 from multiprocessing import Process, Queue
 from multiprocessing import queues as mp_queues
 from string import ascii_letters, digits
-from datetime import datetime
+import numpy
 import osmosdr
 from gnuradio import gr
 from gnuradio import blocks
@@ -75,6 +76,9 @@ class RadioSources(object):
     # Queues where each radio source will receive messages
     _radio_source_input_queue_dict = {}
 
+    # maximum number of commands waiting on a radio source's input queue
+    _input_queue_size = 100
+
     def __init__(self, conf, out_queue, log_dir_path, tap_dir_path):
         """Configure the radio sources collection
         conf -- a dictionary with a valid configuration
@@ -187,6 +191,47 @@ class RadioSources(object):
         for radio_source_id in self._radio_source_dict:
             self._radio_source_dict[radio_source_id].stop()
 
+    def join(self):
+        """Wait for all radio source subprocesses to end"""
+        for radio_source_id in self._radio_source_dict:
+            self._radio_source_dict[radio_source_id].join()
+
+    def set_level_table(self, level_table):
+        """Set the shared memory table where the listeners write their
+        signal levels
+        level_table -- a DiaLevelTable object, None to send messages"""
+
+        for radio_source_id in self._radio_source_dict:
+            self._radio_source_dict[radio_source_id].set_level_table(level_table)
+
+    def set_fir_tap_cache_path(self, path):
+        """Set the directory where the radio sources cache designed FIR
+        taps
+        path -- the directory, None to keep them only in memory"""
+
+        for radio_source_id in self._radio_source_dict:
+            self._radio_source_dict[radio_source_id].set_fir_tap_cache_path(
+                path)
+
+    def set_fftw_wisdom_path(self, path):
+        """Set the FFTW wisdom file the radio sources load before planning
+        their FFTs
+        path -- path to the wisdom file, None for GNU Radio's own only"""
+
+        for radio_source_id in self._radio_source_dict:
+            self._radio_source_dict[radio_source_id].set_fftw_wisdom_path(
+                path)
+
+    def set_route_ids(self, probe_id, site_id):
+        """Set the probe and site ids stamped on every message sent by the
+        radio sources
+        probe_id -- id of the probe the radio sources belong to
+        site_id -- id of the site the probe belongs to"""
+
+        for radio_source_id in self._radio_source_dict:
+            self._radio_source_dict[radio_source_id].set_route_ids(probe_id,
+                                                                   site_id)
+
     def append(self, conf):
         """Append a new radio source
         conf -- a dictionary with a valid configuration
@@ -200,7 +245,8 @@ class RadioSources(object):
             raise RadioSourceListIdNotUniqueError(msg)
 
         # prepare the sources input queue
-        source_input_queue = Queue()
+        source_input_queue = dia_aux.DiaQueue(r_source_id + '_input',
+                                              self._input_queue_size)
 
         self._radio_source_input_queue_dict[r_source_id] = source_input_queue
 
@@ -225,6 +271,28 @@ class RadioSource(object):
     # subclass registry
     _subclasses = {}
 
+    # signal detection modes, either each listener runs it's own filters
+    # and FFT, or the radio source runs a single FFT over it's whole
+    # bandwidth, from which every listener's band level is taken
+    DETECTION_LISTENER = 'listener'
+    DETECTION_WIDEBAND = 'wideband'
+    DETECTION_MODES = (DETECTION_LISTENER, DETECTION_WIDEBAND)
+
+    # channelizer front end, channels are output at this many times the
+    # channel spacing, the channel filter passes CHANNEL_PASSBAND times the
+    # spacing on each side of a channel's center, and nothing aliases into
+    # it
+    CHANNEL_OVERSAMPLE = 2
+    CHANNEL_PASSBAND = 0.75
+
+    # time without reads after which a tap reader is taken as gone, and
+    # the fft slows down, in seconds
+    TAP_READER_TIMEOUT = 2.0
+
+    # message types gathered and sent once per polling tick, state changes
+    # are sent right away
+    BATCH_MSG_TYPES = (dia_aux.DiaMsgType.LNR_SIG_STATE,)
+
     # set the spectrum limits to RF
     # define minimum and maximum frequencies that are
     # tunable by the radio source, in hz
@@ -287,11 +355,54 @@ class RadioSource(object):
         self._fft_avg_alpha = 1.0
         self._fft_average = False
 
-        # probe poll rate in hz
+        # probe poll rate in hz, the rate at which taps are updated
         self._probe_poll_rate = 10
+
+        # the fft runs at the frame rate it's consumers read, wideband
+        # detection and a tap reader, the averaging factor is set for
+        # _fft_frame_rate
+        self._frame_demand = dia_aux.DiaFrameDemand(self._fft_avg_alpha,
+                                                    self._fft_frame_rate)
         self._fft_signal_level = None
 
-        self._sys_state = None
+        # time of the last listener signal metrics and tap update
+        self._poll_time = 0
+
+        # signal detection mode, and for wideband detection, the map of
+        # the FFT bins on each listener's band and the listeners, in the
+        # order of the map's bands
+        self._detection_mode = self.DETECTION_LISTENER
+        self._band_map = None
+        self._band_listeners = []
+        self._band_metrics = []
+
+        # noise floor estimate outside the listeners' bands, and the FFT
+        # bins it is estimated on, for wideband detection
+        self._floor_estimator = dia_aux.DiaNoiseFloor()
+        self._floor_ranges = None
+
+        # polyphase channelizer splitting the band in channels, shared by
+        # the listeners, and the channelizer output of each channel in use,
+        # 0 channels for no channelizer
+        self._channel_count = 0
+        self._channel_splitter = None
+        self._channelizer = None
+        self._channel_ports = {}
+
+        # scheduler tuning, applied once the flowgraph is built: maximum
+        # items on each block's output buffers and per call to a block's
+        # work, 0 for GNU Radio's defaults, and cores the block threads
+        # run on, None for any
+        self._max_output_buffer = 0
+        self._max_noutput_items = 0
+        self._block_affinity = None
+
+        # subprocess tuning, cores it runs on, None for any, and niceness
+        self._cpu_affinity = None
+        self._niceness = 0
+
+        # the component's system state, a DiaSysState object
+        self._sys_state = dia_aux.DiaSysState()
 
         self._audio_enable = False
         self._spectrum_analyzer_enable = False
@@ -301,19 +412,39 @@ class RadioSource(object):
         self._audio_sink = None
         self._audio_sink_connection_qty = 0
 
-        self._retrieve_fft_thread = None
+        # sink receiving the fft frames, and a lock held while processing
+        # them
+        self._fft_sink = None
+        self._fft_frames_lock = threading.Lock()
 
         self._subprocess_in = Queue()
         self._subprocess_out = None
 
         self._source_subprocess = None
 
-        self._fft_signal_probe = None
+        # ids of the probe and site routing this source's messages,
+        # stamped on every message
+        self._route_probe_id = None
+        self._route_site_id = None
+
+        # level messages to send on the next tick, None when not batching
+        self._out_batch = None
+        self._out_batch_lock = threading.Lock()
+        self._out_batch_stop = threading.Event()
+        self._out_batch_thread = None
 
         self._log_dir_path = None
 
         self._tap_dir_path = None
 
+        # directory where designed FIR taps are cached, None to keep them
+        # only in memory
+        self._fir_tap_cache_path = None
+
+        # FFTW wisdom file loaded before the FFTs are planned, None for
+        # GNU Radio's own only
+        self._fftw_wisdom_path = None
+
         if (conf is not None and in_queue is not None
                 and out_queue is not None and
                 log_dir_path is not None and tap_dir_path is not None):
@@ -381,13 +512,21 @@ class RadioSource(object):
 
         self.set_spectrum_analyzer_tap_enable(conf['freq_analyzer_tap'])
 
+        self.set_detection_mode(conf['detection_mode'])
+        self.set_fft_size(conf['fft_size'])
+        self.set_channel_count(conf['channels'])
+        self.set_scheduler_tuning(conf['max_output_buffer'],
+                                  conf['max_noutput_items'],
+                                  conf['block_affinity'])
+        self.set_process_tuning(conf['cpu_affinity'], conf['niceness'])
+
         # leave radio initialization to derived classes !!
         # leave listener's configuration to the derived classes !!
 
     def _radio_init(self):
         """Initialize the radio hw."""
 
-        self._gr_top_block = gr.top_block()
+        self._gr_top_block = dia_aux.DiaTopBlock()
         # specific radio initialization to be added on this method on derived
         # classes
         self._radio_state = RadioSourceSate.STATE_OK
@@ -395,14 +534,24 @@ class RadioSource(object):
     def _setup_rf_fft(self):
         """Setup an fft to check the RF status."""
 
+        # wideband detection checks every frame, at the listeners' rate,
+        # the tap is only read once a reader connects
+        if self.get_detection_mode() == self.DETECTION_WIDEBAND:
+            detection_rate = 0
+            for listener_id in self._listeners.get_listener_id_list():
+                listener = self._listeners.get_listener_by_id(listener_id)
+                detection_rate = max(detection_rate,
+                                     listener.get_fft_frame_rate())
+            self._frame_demand.set_demand('detection', detection_rate)
+
         # start the fft
         try:
             self._log_fft = logpwrfft.logpwrfft_c(
                 sample_rate=self._cap_bw,
                 fft_size=self._fft_size,
                 ref_scale=self._fft_ref_scale,
-                frame_rate=self._fft_frame_rate,
-                avg_alpha=self._fft_avg_alpha,
+                frame_rate=self._frame_demand.get_rate(),
+                avg_alpha=self._frame_demand.get_avg_alpha(),
                 average=self._fft_average
             )
         except Exception, exc:
@@ -419,6 +568,7 @@ class RadioSource(object):
         try:
             self._gr_top_block.connect(self.get_source_block(),
                                        self._log_fft)
+            self._gr_top_block.set_block_role(self._log_fft, 'fft')
         except Exception, exc:
             msg = ('Failed to connect the fft to the source, with:'
                    ' {m}').format(m=str(exc))
@@ -428,35 +578,150 @@ class RadioSource(object):
         msg = 'FFT connected to Frequency translation.'
         logging.debug(msg)
 
-    def _retrieve_fft(self, stop_event):
-        """Retrieve fft values"""
+    def _process_fft_frames(self, frames):
+        """Check the listener's bands and update the taps with the fft
+        frames. Called by the fft sink, from the flowgraph's thread.
+        frames -- 2D numpy array, a frame on each row, as sent by the FFT"""
 
-        low_freq = self.get_lower_frequency()
-        high_freq = self.get_upper_frequency()
-        band_w = self.get_bandwidth_capability()
-
-        while not stop_event.is_set():
+        with self._fft_frames_lock:
+            if self._probe_stop.is_set():
+                return
 
-            current_time = datetime.utcnow().isoformat()
+            current_time = time.time()
 
             # logpower fft swaps the lower and upper halfs
             # of the spectrum, this fixes it
-            vraw = self._fft_signal_probe.level()
-            val = vraw[len(vraw)/2:]+vraw[:len(vraw)/2]
+            frames = numpy.fft.fftshift(frames, axes=1)
+
+            # signal metrics and taps are updated at the probe poll rate
+            poll_update = False
+            if current_time - self._poll_time >= 1.0 / self._probe_poll_rate:
+                self._poll_time = current_time
+                poll_update = True
+
+            if self._band_map is not None:
+                self._check_listener_bands(frames, current_time, poll_update)
 
             # update taps
-            if self.get_spectrum_analyzer_tap_enable():
-                tap_value = '{t};{bw};{lf};{hf};{v}\n'.format(t=current_time,
-                                                              v=val, bw=band_w,
-                                                              lf=low_freq,
-                                                              hf=high_freq)
+            if self.get_spectrum_analyzer_tap_enable() and poll_update:
+                self._update_tap_demand()
+
+                tap_value = '{t};{bw};{lf};{hf};{v}\n'.format(
+                    t=dia_aux.format_time(current_time),
+                    v=tuple(frames[-1].tolist()),
+                    bw=self.get_bandwidth_capability(),
+                    lf=self.get_lower_frequency(),
+                    hf=self.get_upper_frequency())
 
                 self._freq_analyzer_tap.update_value(tap_value)
 
                 msg = 'updating data tap'
                 logging.debug(msg)
 
-            stop_event.wait(1.0 / self._probe_poll_rate)
+    def _update_tap_demand(self):
+        """Run the fft at the tap rate while a reader reads the tap, and
+        at the rate of the other consumers otherwise"""
+
+        # a reader is gone after missing a few updates
+        reader = self._freq_analyzer_tap.has_reader(
+            max(self.TAP_READER_TIMEOUT, 3.0 / self._frame_demand.get_rate()))
+
+        if not self._frame_demand.set_demand(
+                'tap', self._probe_poll_rate if reader else 0):
+            return
+
+        self._log_fft.set_vec_rate(self._frame_demand.get_rate())
+        if self._fft_average:
+            self._log_fft.set_avg_alpha(self._frame_demand.get_avg_alpha())
+
+        # keep the listeners' averaging windows in time
+        for listener in self._band_listeners:
+            listener.set_level_rate(self._frame_demand.get_rate())
+
+        msg = ('Radio source {id} fft frame rate set to {r}, for'
+               ' {d}').format(id=self.get_id(),
+                              r=self._frame_demand.get_rate(),
+                              d=self._frame_demand.get_demands())
+        logging.debug(msg)
+
+    def _setup_band_map(self):
+        """Map the FFT bins on each listener's band, for wideband
+        detection"""
+
+        band_map = dia_aux.DiaBandMap(self._fft_size,
+                                      self.get_lower_frequency(),
+                                      self.get_upper_frequency())
+        band_listeners = []
+        band_metrics = []
+        bin_width = ((self.get_upper_frequency() -
+                      self.get_lower_frequency()) / float(self._fft_size))
+
+        for listener_id in self._listeners.get_listener_id_list():
+            listener = self._listeners.get_listener_by_id(listener_id)
+            bins = band_map.add_band(listener_id,
+                                     listener.get_lower_frequency(),
+                                     listener.get_upper_frequency())
+            band_listeners.append(listener)
+            band_metrics.append(dia_aux.DiaSigMetrics(bins[1] - bins[0],
+                                                      bin_width))
+
+            msg = ('Radio source {id}, listener {lid} mapped to FFT bins'
+                   ' {s} to {e}').format(id=self.get_id(), lid=listener_id,
+                                         s=bins[0], e=bins[1])
+            logging.debug(msg)
+
+        # bins where the noise floor is estimated, outside every listener's
+        # band, or the whole band when the listeners cover all of it
+        self._floor_ranges = (band_map.get_outside_ranges() or
+                              ((0, self._fft_size),))
+
+        # the listeners are passed a level on each of this source's frames
+        for listener in band_listeners:
+            listener.set_level_rate(self._frame_demand.get_rate())
+
+        # the fft sink checks the bands once the map is set
+        self._band_listeners = band_listeners
+        self._band_metrics = band_metrics
+        self._band_map = band_map
+
+    def _check_listener_bands(self, frames, current_time, poll_update):
+        """Pass each listener the average level on it's band, for each
+        frame
+        frames -- 2D numpy array of wideband fft frames, lower frequencies
+            first
+        current_time -- time when the signal was collected, seconds since
+            epoch
+        poll_update -- True to update the listener's signal metrics and
+            taps"""
+
+        # noise floor outside the listeners' bands, shared by them
+        noise_floor = self._floor_estimator.update(
+            dia_aux.join_bin_ranges(frames, self._floor_ranges))
+        for listener in self._band_listeners:
+            listener.set_noise_floor(noise_floor)
+
+        if poll_update:
+            spectrum = numpy.add.reduce(frames, axis=0,
+                                        dtype=numpy.float64) / len(frames)
+            for listener, metrics in zip(self._band_listeners,
+                                         self._band_metrics):
+                start, end = self._band_map.get_bins(listener.get_id())
+                listener.set_signal_metrics(*metrics.get_metrics(
+                    spectrum[start:end], noise_floor))
+
+        # a row of band levels for each frame
+        for levels in self._band_map.get_levels(frames):
+            for listener, level in zip(self._band_listeners, levels):
+                listener.check_signal_level(level, current_time)
+
+        if not poll_update:
+            return
+
+        for listener in self._band_listeners:
+            if listener.get_spectrum_analyser_tap_enable():
+                start, end = self._band_map.get_bins(listener.get_id())
+                listener.update_freq_analyzer_tap(
+                    tuple(frames[-1, start:end].tolist()), current_time)
 
     def _setup_freq_analyzer_tap(self):
         """Setup a tap to provide live frequency analyzer plot.
@@ -487,48 +752,43 @@ class RadioSource(object):
 
         self._freq_analyzer_tap.stop()
 
-    def _setup_rf_fft_probe(self):
-        """Setup probe to retrieve the fft data"""
+    def _setup_rf_fft_sink(self):
+        """Setup a sink receiving every fft frame, on the flowgraph's
+        thread"""
 
         try:
-            self._fft_signal_probe = blocks.probe_signal_vf(self._fft_size)
+            self._fft_sink = dia_aux.DiaFrameSink(self._fft_size,
+                                                  self._process_fft_frames)
         except Exception, exc:
-            msg = ('Failed to create fft probe, with:'
+            msg = ('Failed to create fft sink, with:'
                    ' {m}').format(m=str(exc))
             logging.debug(msg)
             raise Exception(msg)
 
-        # connect the signal probe to the fft
+        # connect the sink to the fft
         try:
-            self._gr_top_block.connect(self._log_fft,
-                                       self._fft_signal_probe)
+            self._gr_top_block.connect(self._log_fft, self._fft_sink)
+            self._gr_top_block.set_block_role(self._fft_sink, 'fft')
         except Exception, exc:
             msg = ('Failed to connect the fft to radio source {id}, with:'
                    ' {m}').format(id=self.get_id(), m=str(exc))
             logging.debug(msg)
             raise Exception(msg)
 
-        msg = ('Radio Source {id}, Launching fft data retrieval'
-               ' thread.').format(id=self.get_id())
-        logging.debug(msg)
-
-        # set the fft retrieval on it's own thread
-        self._retrieve_fft_thread = threading.Thread(target=self._retrieve_fft,
-                                                     name=self.get_id(),
-                                                     args=(self._probe_stop,))
-        self._retrieve_fft_thread.daemon = True
-        self._retrieve_fft_thread.start()
-
-        msg = ('Radio Source {id} signal probe setup'
+        msg = ('Radio Source {id} fft sink setup'
                ' done.').format(id=self.get_id())
         logging.debug(msg)
 
     def _stop_signal_probe(self):
-        """Stop the fft data probe"""
+        """Stop processing the fft frames"""
 
-        # send the stop event to the thread
         self._probe_stop.set()
 
+        # listeners must not be passed levels once they are stopped, wait
+        # for frames being processed
+        with self._fft_frames_lock:
+            pass
+
     def set_log_dir_path(self, log_dir_path):
         """Set the probe's log path
         log_dir_path - path to the logs directory"""
@@ -547,15 +807,14 @@ class RadioSource(object):
 
     def set_ouptut_queue(self, queue):
         """Set this radio source's output queue
-        queue -- the output queue (multiprocessing.Queue)"""
+        queue -- the output queue (diatomite_aux.DiaQueue)"""
 
         type_queue = type(queue)
-        print 'qt={qt}'.format(qt=type_queue)
 
         # check if we were given an object of the right type
-        if not isinstance(queue, mp_queues.Queue):
+        if not isinstance(queue, dia_aux.DiaQueue):
 
-            msg = ('Queue must be a queue of multiprocessing.queues.Queue,'
+            msg = ('Queue must be a queue of diatomite_aux.DiaQueue,'
                    ' was {tgtb}').format(tgtb=type_queue)
             raise TypeError(msg)
 
@@ -713,6 +972,221 @@ class RadioSource(object):
 
         logging.debug(msg)
 
+    def set_detection_mode(self, mode):
+        """Set how the listener's signals are detected
+        mode -- one of DETECTION_MODES, DETECTION_LISTENER for a filter and
+            FFT on each listener, DETECTION_WIDEBAND for a single FFT over
+            the radio source's bandwidth"""
+
+        if mode not in self.DETECTION_MODES:
+            msg = 'Invalid detection mode {m}'.format(m=mode)
+            raise RadioSourceError(msg)
+
+        self._detection_mode = mode
+
+        msg = ('Radio source {id} detection mode set to'
+               ' {m}').format(m=mode, id=self.get_id())
+        logging.debug(msg)
+
+    def set_fft_size(self, fft_size):
+        """Set the number of bins of the radio source's FFT, used by the
+        frequency analyzer tap and wideband detection
+        fft_size -- number of bins, a power of two"""
+
+        if fft_size < 2 or fft_size & (fft_size - 1):
+            msg = 'FFT size must be a power of two, was {s}'.format(s=fft_size)
+            raise RadioSourceError(msg)
+
+        self._fft_size = fft_size
+
+    def set_channel_count(self, channel_count):
+        """Set the number of channels the band is split in by the
+        channelizer front end, listeners then filter their channel instead
+        of the whole band
+        channel_count -- number of channels, even, 0 for no channelizer"""
+
+        if channel_count < 0 or channel_count == 1 or channel_count % 2:
+            msg = ('Channel count must be 0 or even, was'
+                   ' {c}').format(c=channel_count)
+            raise RadioSourceError(msg)
+
+        self._channel_count = channel_count
+
+    def set_scheduler_tuning(self, max_output_buffer, max_noutput_items,
+                             block_affinity):
+        """Set the GNU Radio scheduler settings for this source's
+        flowgraph, applied when it's built
+        max_output_buffer -- maximum items on each block's output buffers,
+            smaller buffers lower the detection latency, 0 for the default.
+            Either a single value, or a dict with the value for each
+            dia_aux.DiaTopBlock.BLOCK_ROLES
+        max_noutput_items -- maximum items per call to a block's work,
+            0 for the default
+        block_affinity -- list of CPU cores the block threads run on, None
+            for any. Either a single list, or a dict with the list for each
+            block role"""
+
+        if isinstance(max_output_buffer, dict):
+            output_buffers = max_output_buffer.values()
+        else:
+            output_buffers = [max_output_buffer]
+
+        if min(output_buffers + [0]) < 0 or max_noutput_items < 0:
+            msg = ('Invalid scheduler settings, max_output_buffer {b},'
+                   ' max_noutput_items {n}').format(b=max_output_buffer,
+                                                    n=max_noutput_items)
+            raise RadioSourceError(msg)
+
+        self._max_output_buffer = max_output_buffer
+        self._max_noutput_items = max_noutput_items
+        self._block_affinity = block_affinity
+
+    def set_process_tuning(self, cpu_affinity, niceness):
+        """Set the CPU affinity and niceness of this source's subprocess,
+        so sources on the same host do not compete for the same cores
+        cpu_affinity -- list of CPU cores, None for any
+        niceness -- niceness increment, 0 to 19"""
+
+        if not 0 <= niceness <= 19:
+            msg = 'Niceness must be 0 to 19, was {n}'.format(n=niceness)
+            raise RadioSourceError(msg)
+
+        self._cpu_affinity = cpu_affinity
+        self._niceness = niceness
+
+    def _apply_process_tuning(self):
+        """Apply the CPU affinity and niceness to the running process"""
+
+        if self._cpu_affinity is not None:
+            try:
+                dia_aux.set_process_affinity(self._cpu_affinity)
+            except OSError, exc:
+                msg = ('Radio source {id} unable to set CPU affinity with'
+                       ' {m}').format(id=self.get_id(), m=str(exc))
+                logging.error(msg)
+
+        if self._niceness:
+            os.nice(self._niceness)
+
+        msg = ('Radio source {id} running on cores {c} with niceness'
+               ' {n}').format(id=self.get_id(), c=self._cpu_affinity,
+                              n=self._niceness)
+        logging.debug(msg)
+
+    def get_channel(self, frequency_offset):
+        """Return the (channel, center offset) of the channel closest to a
+        frequency, the center offset being the channel's center frequency
+        offset from the radio source's center frequency, in Hz
+        frequency_offset -- offset from the radio source's center frequency,
+            in Hz"""
+
+        spacing = self.get_channel_spacing()
+        position = int(round(frequency_offset / spacing))
+
+        # channels above half the band are the negative frequencies
+        return (position % self._channel_count, position * spacing)
+
+    def _setup_channelizer(self):
+        """Setup the channelizer front end, splitting the band in channels
+        once for all the listeners, and connect it to the source"""
+
+        spacing = self.get_channel_spacing()
+
+        # channels the listeners are on, each gets a channelizer output, on
+        # wideband detection only listeners with audio output filter their
+        # band
+        channels = []
+        for listener_id in self._listeners.get_listener_id_list():
+            listener = self._listeners.get_listener_by_id(listener_id)
+            channel = listener.get_channel()
+            if channel is not None and channel not in channels:
+                channels.append(channel)
+
+        # a channelizer without outputs would stop the flowgraph from
+        # starting
+        if not channels:
+            msg = ('Radio source {id} channelizer not set up, no listener'
+                   ' uses a channel').format(id=self.get_id())
+            logging.debug(msg)
+            return
+
+        # prototype filter, passes CHANNEL_PASSBAND of the spacing and stops
+        # where aliases would land on it
+        taps = dia_aux.fir_tap_cache.low_pass(
+            1, self._cap_bw, spacing,
+            2 * (1 - self.CHANNEL_PASSBAND) * spacing, 60)
+
+        try:
+            self._channel_splitter = blocks.stream_to_streams(
+                gr.sizeof_gr_complex, self._channel_count)
+            self._channelizer = grfilter.pfb_channelizer_ccf(
+                self._channel_count, taps, self.CHANNEL_OVERSAMPLE)
+            self._channelizer.set_channel_map(channels)
+
+            self._gr_top_block.connect(self.get_source_block(),
+                                       self._channel_splitter)
+            for channel in xrange(self._channel_count):
+                self._gr_top_block.connect((self._channel_splitter, channel),
+                                           (self._channelizer, channel))
+            self._gr_top_block.set_block_role(self._channel_splitter,
+                                              'channelizer')
+            self._gr_top_block.set_block_role(self._channelizer,
+                                              'channelizer')
+        except Exception, exc:
+            msg = ('Failed to setup the channelizer, with:'
+                   ' {m}').format(m=str(exc))
+            logging.debug(msg)
+            raise Exception(msg)
+
+        self._channel_ports = dict((channel, port) for port, channel
+                                   in enumerate(channels))
+
+        msg = ('Radio source {id} channelizer set up, {c} channels of'
+               ' {s}Hz, channels in use {u}').format(id=self.get_id(),
+                                                     c=self._channel_count,
+                                                     s=spacing, u=channels)
+        logging.debug(msg)
+
+    def get_channel_output(self, channel):
+        """Return the channelizer (block, port) carrying a channel
+        channel -- the channel, as returned by get_channel"""
+
+        if self._channelizer is None or channel not in self._channel_ports:
+            msg = 'Channel {c} not set up'.format(c=channel)
+            raise RadioSourceError(msg)
+
+        return (self._channelizer, self._channel_ports[channel])
+
+    def set_level_table(self, level_table):
+        """Set the shared memory table where this source's listeners
+        write their signal levels
+        level_table -- a DiaLevelTable object, None to send messages"""
+
+        self._listeners.set_level_table(level_table)
+
+    def set_fir_tap_cache_path(self, path):
+        """Set the directory where designed FIR taps are cached, shared by
+        restarts and other radio sources
+        path -- the directory, None to keep them only in memory"""
+
+        self._fir_tap_cache_path = path
+
+    def set_fftw_wisdom_path(self, path):
+        """Set the FFTW wisdom file loaded before planning this source's
+        and it's listeners' FFTs
+        path -- path to the wisdom file, None for GNU Radio's own only"""
+
+        self._fftw_wisdom_path = path
+
+    def set_route_ids(self, probe_id, site_id):
+        """Set the probe and site ids stamped on every message sent,
+        so that they are ready for the api service
+        probe_id -- id of the probe this radio source belongs to
+        site_id -- id of the site the probe belongs to"""
+
+        self._route_probe_id = probe_id
+        self._route_site_id = site_id
+
     def add_frequency_listener(self, listener):
         """Add a FreqListener to this Radio Source's listener list.
         listener -- FreqListener"""
@@ -823,6 +1297,32 @@ class RadioSource(object):
             msg = 'Radio Source not started'
             raise RadioSourceRadioFailureError(msg)
 
+    def get_detection_mode(self):
+        """Return the signal detection mode, one of DETECTION_MODES"""
+        return self._detection_mode
+
+    def get_fft_size(self):
+        """Return the number of bins of the radio source's FFT"""
+        return self._fft_size
+
+    def get_channel_count(self):
+        """Return the number of channels of the channelizer front end, 0
+        for no channelizer"""
+        return self._channel_count
+
+    def get_channel_spacing(self):
+        """Return the channelizer's channel spacing, in Hz"""
+        return float(self.get_bandwidth_capability()) / self._channel_count
+
+    def get_channel_rate(self):
+        """Return the sample rate of the channelizer's channels"""
+        return self.get_channel_spacing() * self.CHANNEL_OVERSAMPLE
+
+    def get_channel_passband(self):
+        """Return the bandwidth passed on each side of a channel's center,
+        in Hz"""
+        return self.get_channel_spacing() * self.CHANNEL_PASSBAND
+
     def get_spectrum_analyzer_tap_enable(self):
         """Return True if the spectrum analyzer tap is to be enabled."""
         return self._spectrum_analyzer_enable
@@ -836,40 +1336,119 @@ class RadioSource(object):
             msg = 'Radio Source subprocess not set'
             logging.debug(msg)
 
+    def join(self):
+        """Wait for the radio source's subprocess to end"""
+
+        if self._source_subprocess is not None:
+            self._source_subprocess.join()
+
     def send_data(self, data):
         """Sends data output to the output pipe.
         data -- data to send"""
 
-        if isinstance(data, dia_aux.DiaListenerMsg):
+        if isinstance(data, dia_aux.DiaMsg):
+
+            # stamp the message with this source's id, and the ids of
+            # the probe and site routing it, the message itself is
+            # forwarded as is
+            data.set_source_id(self.get_id())
+            data.set_probe_id(self._route_probe_id)
+            data.set_site_id(self._route_site_id)
+
+            with self._out_batch_lock:
+                if self._out_batch is not None:
+                    if data.get_msg_type() in self.BATCH_MSG_TYPES:
+                        # will be sent on the next tick
+                        self._out_batch.append(data)
+                        return
+
+                    # the levels gathered so far go first, keeping the
+                    # order of each listener's messages
+                    if self._out_batch:
+                        data = dia_aux.DiaMsgBatch(self._out_batch +
+                                                   [data])
+                        self._out_batch = []
+
+            self._subprocess_out.put_msg(data)
+            msg = 'sending data to parent:{d}'.format(d=data)
+            logging.debug(msg)
 
-            rcv_id = self.get_id()
-            msg_type = data.get_msg_type()
-            payload = data
+    def _flush_out_batch(self):
+        """Send all the messages gathered since the last tick as a single
+        DiaMsgBatch."""
 
-            new_msg = dia_aux.DiaRadioReceiverMsg(msg_type, rcv_id, payload)
-            msg = ('receiver {rcv} sending sys state'
-                   ' change message:{m}').format(rcv=rcv_id, m=new_msg)
-            logging.debug(msg)
+        with self._out_batch_lock:
+            if not self._out_batch:
+                return
+            batch = dia_aux.DiaMsgBatch(self._out_batch)
+            self._out_batch = []
 
-            self._subprocess_out.put(new_msg)
-            msg = 'sending data to parent:{d}'.format(d=new_msg)
-            logging.debug(msg)
+        self._subprocess_out.put_msg(batch)
+        msg = ('sending batch of {n} messages to'
+               ' parent').format(n=len(batch))
+        logging.debug(msg)
+
+    def _send_out_batches(self, stop_event):
+        """Send the gathered messages once per polling tick"""
+
+        while not stop_event.is_set():
+            stop_event.wait(1.0 / self._probe_poll_rate)
+            self._flush_out_batch()
+
+    def _start_out_batching(self):
+        """Start gathering the level messages sent during each polling
+        tick, to be sent together as a single batch"""
+
+        with self._out_batch_lock:
+            self._out_batch = []
+
+        self._out_batch_stop.clear()
+        self._out_batch_thread = threading.Thread(target=self._send_out_batches,
+                                                  name=self.get_id(),
+                                                  args=(self._out_batch_stop,))
+        self._out_batch_thread.daemon = True
+        self._out_batch_thread.start()
+
+    def _stop_out_batching(self):
+        """Stop gathering messages, sending the ones still pending"""
+
+        self._out_batch_stop.set()
+        if self._out_batch_thread is not None:
+            self._out_batch_thread.join()
+            self._out_batch_thread = None
+
+        self._flush_out_batch()
+
+        with self._out_batch_lock:
+            self._out_batch = None
 
     def _run_source_subprocess(self, input_conn, output_conn):
         """start the subprocess for a  source.
         input_conn - input pipe
         output_conn - output pipe"""
 
+        # before any thread is started, so they inherit it
+        self._apply_process_tuning()
+
         if self.get_audio_enable():
             # for development purposes, output sound
             self.start_audio_sink()
 
+        dia_aux.fir_tap_cache.set_path(self._fir_tap_cache_path)
+
+        # the FFTs are planned as the flowgraph is built
+        if self._fftw_wisdom_path is not None:
+            dia_aux.load_fftw_wisdom(self._fftw_wisdom_path)
+
         self._radio_init()
 
+        wideband = self.get_detection_mode() == self.DETECTION_WIDEBAND
+
         # handle frequency analyzer tap creation
         # thread for data tap must be present before
         # the thread that starts the signal probe
-        if self.get_spectrum_analyzer_tap_enable():
+        # the same fft is used for wideband detection
+        if self.get_spectrum_analyzer_tap_enable() or wideband:
 
             # setup fft and connect it to the source
             try:
@@ -883,18 +1462,19 @@ class RadioSource(object):
                    'finished').format(id=self.get_id())
             logging.debug(msg)
 
-            try:
-                self._setup_freq_analyzer_tap()
-            except Exception, exc:
-                msg = ('Failed to setup fft TAP'
-                       'with {m}').format(m=str(exc))
-                logging.debug(msg)
-                raise Exception(msg)
+            if self.get_spectrum_analyzer_tap_enable():
+                try:
+                    self._setup_freq_analyzer_tap()
+                except Exception, exc:
+                    msg = ('Failed to setup fft TAP'
+                           'with {m}').format(m=str(exc))
+                    logging.debug(msg)
+                    raise Exception(msg)
 
             try:
-                self._setup_rf_fft_probe()
+                self._setup_rf_fft_sink()
             except Exception, exc:
-                msg = ('Failed to setup signal probe'
+                msg = ('Failed to setup fft sink'
                        'with {m}').format(m=str(exc))
                 logging.debug(msg)
                 raise Exception(msg)
@@ -908,13 +1488,37 @@ class RadioSource(object):
                    'requested').format(id=self.get_id())
             logging.debug(msg)
 
+        # listener level messages are sent in batches, once per polling tick
+        self._start_out_batching()
+
+        # the listeners attach to their channel outputs once started
+        if self._channel_count:
+            self._setup_channelizer()
+
         msg = 'starting frequency listeners'
         logging.debug(msg)
 
         self.start_frequency_listeners()
 
+        msg = ('Radio Source {id}, FIR taps (memory hits, disk hits,'
+               ' designs): {s}').format(id=self.get_id(),
+                                        s=dia_aux.fir_tap_cache.get_stats())
+        logging.debug(msg)
+
+        # listeners are passed their band levels once started
+        if wideband:
+            self._setup_band_map()
+
+        # the flowgraph is built, tune it's blocks
+        self._gr_top_block.set_block_role(self.get_source_block(), 'source')
+        self._gr_top_block.set_block_tuning(self._max_output_buffer,
+                                            self._block_affinity)
+
         # wait for the end of the top block
-        self._gr_top_block.start()
+        if self._max_noutput_items:
+            self._gr_top_block.start(self._max_noutput_items)
+        else:
+            self._gr_top_block.start()
 
         stop = False
         # wait for the stop command
@@ -924,7 +1528,9 @@ class RadioSource(object):
                 stop = True
 
         if stop:
+            self._stop_signal_probe()
             self.stop_frequency_listeners()
+            self._stop_out_batching()
             self._gr_top_block.stop()
             os.killpg(os.getpgid(self._source_subprocess.pid),
                       signal.SIGTERM)
@@ -939,9 +1545,9 @@ class RadioSource(object):
         Returns the handle to the subprocess."""
 
         # setup and start the subprocess for this source
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.START,
-                                             current_time)
+        current_time = time.time()
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.START, current_time))
         self._notify_sys_state_change()
 
         self._source_subprocess = Process(target=self._run_source_subprocess,
@@ -956,9 +1562,9 @@ class RadioSource(object):
             logging.debug(msg)
             raise
 
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.RUN,
-                                             current_time)
+        current_time = time.time()
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.RUN, current_time))
         self._notify_sys_state_change()
 
     def stop(self):
@@ -966,9 +1572,9 @@ class RadioSource(object):
         msg = 'Stopping radio source {id}'.format(id=self.get_id())
         logging.debug(msg)
 
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.SHUTDOWN,
-                                             current_time)
+        current_time = time.time()
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.SHUTDOWN, current_time))
         self._notify_sys_state_change()
 
         self._subprocess_in.put('STOP')
@@ -1107,8 +1713,8 @@ class RadioSource(object):
 
         rcv_id = self.get_id()
         sig_type = dia_aux.DiaMsgType.RCV_SYS_STATE_CHANGE
-        payload = self._sys_state.get_json()
-        new_msg = dia_aux.DiaListenerMsg(sig_type, rcv_id, payload)
+        payload = self._sys_state.get_snapshot()
+        new_msg = dia_aux.DiaMsg(sig_type, payload, source_id=rcv_id)
 
         msg = ('receiver {rcv} sending sys state'
                ' change message:{m}').format(rcv=rcv_id, m=new_msg)
@@ -1168,9 +1774,9 @@ class RTL2832URadioSource(RadioSource):
                                                tp=tap_dir_path)
             raise RadioSourceError(msg)
 
-        current_time = datetime.utcnow().isoformat()
-        self._sys_state = dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.INIT,
-                                             current_time)
+        current_time = time.time()
+        self._sys_state.set_curent(
+            dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.INIT, current_time))
 
         self._notify_sys_state_change()
 
@@ -0,0 +1,186 @@
+#!/usr/bin/env python2
+"""
+    Tests for the diatomite monitoring system.
+    Copyright (C) 2017 Duarte Alencastre
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+                    GNU AFFERO GENERAL PUBLIC LICENSE
+                       Version 3, 19 November 2007
+"""
+
+from multiprocessing import Queue
+import diatomite.diatomite_aux as dia_aux
+import diatomite.diatomite_api as dia_api
+
+
+class TestApiSvcIngestion:
+    """test diatomite_api.ApiSvc input queue ingestion"""
+
+    def __init__(self):
+        self.site_conf = {
+            'test_site_1': {
+                'probes': {
+                    'test_probe_1': {
+                        'RadioSources': {
+                            'rs1': {
+                                'listeners': {
+                                    'ln11': {},
+                                    'ln12': {}
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+
+    def new_api_svc(self):
+        """Return an api service for the test site"""
+
+        return dia_api.ApiSvc({}, self.site_conf, Queue(), Queue())
+
+    def new_sig_msg(self, listener_id, level, seq=None, run=None):
+        """Return a signal state message for a listener
+        listener_id -- the listener id
+        level -- signal level
+        seq -- the message sequence number
+        run -- the listener's run id"""
+
+        sig_info = dia_aux.DiaSigInfo(dia_aux.DiaSigStatus.PRESENT, level,
+                                      1483228800.25)
+        sig_state = dia_aux.DiaSigState()
+        sig_state.set_new(sig_info)
+
+        return dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SIG_STATE, sig_state,
+                              'rs1', listener_id, 'test_probe_1',
+                              'test_site_1', seq, run)
+
+    def get_listener(self, api_svc, listener_id):
+        """Return the api service data for a listener"""
+
+        site = api_svc.get_site()['test_site_1']
+        rsrc = site['probes']['test_probe_1']['RadioSources']['rs1']
+
+        return rsrc['listeners'][listener_id]
+
+    def test_batch_keeps_latest_state(self):
+        """Test that a batch applies the latest state of each listener"""
+
+        api_svc = self.new_api_svc()
+        batch = [self.new_sig_msg('ln11', -60),
+                 self.new_sig_msg('ln12', -50),
+                 self.new_sig_msg('ln11', -40)]
+
+        api_svc._ingest_batch(batch)
+
+        ln11 = self.get_listener(api_svc, 'ln11')['signal_state']
+        ln12 = self.get_listener(api_svc, 'ln12')['signal_state']
+        assert ln11.get_current().get_level() == -40
+        assert ln12.get_current().get_level() == -50
+
+        stats = api_svc.get_ingestion_stats().data_dump()
+        assert stats['messages'] == 3
+        assert stats['batches'] == 1
+        assert stats['coalesced'] == 1
+        assert stats['lag_p50'] is not None
+
+    def test_msg_batch_is_unpacked(self):
+        """Test that a DiaMsgBatch from a radio source is ingested as its
+        individual messages"""
+
+        api_svc = self.new_api_svc()
+        batch = []
+        api_svc._add_to_batch(batch, self.new_sig_msg('ln11', -60))
+        api_svc._add_to_batch(batch, dia_aux.DiaMsgBatch(
+            [self.new_sig_msg('ln12', -50), self.new_sig_msg('ln11', -40)]))
+
+        assert len(batch) == 3
+
+        api_svc._ingest_batch(batch)
+
+        ln11 = self.get_listener(api_svc, 'ln11')['signal_state']
+        assert ln11.get_current().get_level() == -40
+
+    def test_stale_level_skipped(self):
+        """Test that a level update older than the applied state change is
+        skipped, as the priority lane may overtake it"""
+
+        api_svc = self.new_api_svc()
+
+        api_svc._ingest_batch([self.new_sig_msg('ln11', -60, 1),
+                               self.new_sig_msg('ln11', -20, 3)])
+        api_svc._ingest_batch([self.new_sig_msg('ln11', -40, 2)])
+
+        ln11 = self.get_listener(api_svc, 'ln11')['signal_state']
+        assert ln11.get_current().get_level() == -20
+
+        stats = api_svc.get_ingestion_stats().data_dump()
+        assert stats['coalesced'] == 2
+
+    def test_delivery_accounting(self):
+        """Test that gaps, duplicates, reordering and restarts on a
+        listener's sequence numbers are counted"""
+
+        api_svc = self.new_api_svc()
+        seqs = [(1, 'a'), (2, 'a'), (5, 'a'), (5, 'a'), (4, 'a'), (6, 'a'),
+                (1, 'b'), (2, 'b')]
+        api_svc._ingest_batch([self.new_sig_msg('ln11', -60, seq, run)
+                               for seq, run in seqs])
+
+        stats = api_svc.get_delivery_stats().data_dump()
+        assert stats['in_order'] == 5
+        assert stats['gaps'] == 1
+        assert stats['missing'] == 2
+        assert stats['duplicates'] == 1
+        assert stats['reordered'] == 1
+        assert stats['restarts'] == 1
+
+        key = ('test_site_1', 'test_probe_1', 'rs1', 'ln11')
+        assert api_svc.get_delivery_stats().get_last_seq(key) == 2
+
+    def test_first_msg_duplicate(self):
+        """Test that a duplicate of a listener's first message is not
+        taken as a restart"""
+
+        api_svc = self.new_api_svc()
+        api_svc._ingest_batch([self.new_sig_msg('ln11', -60, seq)
+                               for seq in [1, 1, 2]])
+
+        stats = api_svc.get_delivery_stats().data_dump()
+        assert stats['in_order'] == 2
+        assert stats['duplicates'] == 1
+        assert stats['restarts'] == 0
+
+    def test_restart_mid_sequence(self):
+        """Test that a listener restarted on a new run is followed, even
+        when it's sequence numbers do not start over at 1"""
+
+        api_svc = self.new_api_svc()
+
+        # sent by the parent process, before the listener's first run
+        api_svc._ingest_batch([self.new_sig_msg('ln11', -90, seq)
+                               for seq in [1, 2]])
+        api_svc._ingest_batch([self.new_sig_msg('ln11', -60 + seq, seq, 'a')
+                               for seq in range(1, 6)])
+        # a restart carrying on from the parent's sequence numbers
+        api_svc._ingest_batch([self.new_sig_msg('ln11', -40, seq, 'b')
+                               for seq in [3, 4]])
+
+        ln11 = self.get_listener(api_svc, 'ln11')['signal_state']
+        assert ln11.get_current().get_level() == -40
+
+        stats = api_svc.get_delivery_stats().data_dump()
+        assert stats['in_order'] == 9
+        assert stats['reordered'] == 0
+        assert stats['restarts'] == 1
@@ -0,0 +1,1029 @@
+#!/usr/bin/env python2
+"""
+    Tests for the diatomite monitoring system.
+    Copyright (C) 2017 Duarte Alencastre
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+                    GNU AFFERO GENERAL PUBLIC LICENSE
+                       Version 3, 19 November 2007
+"""
+
+import nose
+import json
+import numpy
+import threading
+import os
+import time
+import shutil
+import tempfile
+import cPickle as pickle
+from multiprocessing import queues as mp_queues
+from gnuradio import gr
+from gnuradio import blocks
+import diatomite.diatomite_aux as dia_aux
+
+
+class TestDiaMsg:
+    """test diatomite_aux.DiaMsg class"""
+
+    def __init__(self):
+        self.sig_state = dia_aux.DiaSigState()
+
+    def test_routing_stamps_ids(self):
+        """Test that a message keeps its payload while each hop stamps
+        its id"""
+
+        msg = dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SIG_STATE,
+                             self.sig_state, listener_id='ln11')
+        msg.set_source_id('rs1')
+        msg.set_probe_id('test_probe_1')
+        msg.set_site_id('test_site_1')
+
+        assert msg.get_msg_type() == dia_aux.DiaMsgType.LNR_SIG_STATE
+        assert msg.get_listener_id() == 'ln11'
+        assert msg.get_source_id() == 'rs1'
+        assert msg.get_probe_id() == 'test_probe_1'
+        assert msg.get_site_id() == 'test_site_1'
+        assert msg.get_payload() is self.sig_state
+
+    def test_pickle_round_trip(self):
+        """Test that a message survives a trip through a queue"""
+
+        msg = dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SIG_STATUS_CHANGE,
+                             self.sig_state, 'rs1', 'ln11', seq=7)
+        new_msg = pickle.loads(pickle.dumps(msg, pickle.HIGHEST_PROTOCOL))
+
+        assert new_msg.get_msg_type() == msg.get_msg_type()
+        assert new_msg.get_source_id() == 'rs1'
+        assert new_msg.get_listener_id() == 'ln11'
+        assert new_msg.get_seq() == 7
+
+        status = new_msg.get_payload().get_current().get_status()
+        assert status == dia_aux.DiaSigStatus.PRE_INIT
+
+    def test_get_json(self):
+        """Test that the message is serialized in a single pass"""
+
+        msg = dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SIG_STATE,
+                             self.sig_state, 'rs1', 'ln11', 'test_probe_1',
+                             'test_site_1')
+        data = json.loads(msg.get_json())
+
+        assert data['msg_type'] == 'LNR_SIG_STATE'
+        assert data['site_id'] == 'test_site_1'
+        assert data['payload']['current']['status'] == 'PRE_INIT'
+
+    def test_sys_state_get_json(self):
+        """Test that a system state message is serialized, and that the
+        snapshot it carries does not follow later state changes"""
+
+        sys_state = dia_aux.DiaSysState()
+        msg = dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SYS_STATE_CHANGE,
+                             sys_state.get_snapshot(), 'rs1', 'ln11')
+        sys_state.set_curent(dia_aux.DiaSysInfo(dia_aux.DiaSysStatus.RUN,
+                                                time.time()))
+        data = json.loads(msg.get_json())
+
+        init_name = dia_aux.DiaSysStatus.INIT.name
+        assert data['msg_type'] == 'LNR_SYS_STATE_CHANGE'
+        assert data['payload']['current']['status'] == init_name
+        assert data['payload']['previous']['status'] == init_name
+
+    @nose.tools.raises(TypeError)
+    def test_bad_msg_type(self):
+        """Test that an invalid message type is refused.
+        An exception should be raised"""
+
+        dia_aux.DiaMsg('LNR_SIG_STATE', self.sig_state)
+
+
+class TestDiaLevelTable:
+    """test diatomite_aux.DiaLevelTable class"""
+
+    def __init__(self):
+        self.keys = [('rs1', 'ln11'), ('rs1', 'LN12'), ('rs2', 'ln21')]
+
+    def test_slots(self):
+        """Test that each listener gets its own slot, ids are case
+        insensitive"""
+
+        level_table = dia_aux.DiaLevelTable(self.keys)
+        slots = [level_table.get_slot(s_id, l_id) for s_id, l_id in self.keys]
+
+        assert sorted(slots) == [0, 1, 2]
+        assert level_table.get_slot('RS1', 'ln12') == slots[1]
+        assert level_table.get_slot('rs1', 'ln99') is None
+
+    def test_write_read(self):
+        """Test reading back written levels"""
+
+        level_table = dia_aux.DiaLevelTable(self.keys)
+        slot = level_table.get_slot('rs2', 'ln21')
+
+        assert level_table.read(slot) is None
+
+        level_table.write(slot, dia_aux.DiaSigStatus.PRESENT, -55.5, 10.0)
+        level_table.write(slot, dia_aux.DiaSigStatus.ABSENT, -80.0, 11.0,
+                          (12.5, -1000.0, None))
+
+        status, level, timestamp, metrics = level_table.read(slot)
+        assert status == dia_aux.DiaSigStatus.ABSENT
+        assert level == -80.0
+        assert timestamp == 11.0
+        assert metrics == (12.5, -1000.0, None)
+        assert level_table.read(level_table.get_slot('rs1', 'ln11')) is None
+
+    def test_seq_wrap(self):
+        """Test that a slot is still read once it's sequence number wraps
+        around"""
+
+        level_table = dia_aux.DiaLevelTable(self.keys)
+        slot = level_table.get_slot('rs1', 'ln11')
+
+        # the last even sequence number before wrapping
+        level_table._seq_format.pack_into(
+            level_table._mmap, slot * level_table._slot_size, 0xfffffffe)
+        level_table.write(slot, dia_aux.DiaSigStatus.PRESENT, -55.5, 10.0)
+
+        assert level_table.read(slot)[1] == -55.5
+
+
+class TestDiaBandMap:
+    """test diatomite_aux.DiaBandMap class"""
+
+    def __init__(self):
+        # 16 bins of 100 hz, from 1000 hz
+        self.band_map = dia_aux.DiaBandMap(16, 1000, 2600)
+
+    def test_bins(self):
+        """Test that bands are mapped to the bins covering them, within
+        the frame"""
+
+        assert self.band_map.add_band('ln1', 1200, 1400) == (2, 4)
+        assert self.band_map.add_band('ln2', 1250, 1260) == (2, 3)
+        assert self.band_map.add_band('ln3', 500, 1150) == (0, 2)
+        assert self.band_map.add_band('ln4', 2500, 3000) == (15, 16)
+        assert self.band_map.get_keys() == ['ln1', 'ln2', 'ln3', 'ln4']
+
+    def test_levels(self):
+        """Test the average level on each band, bands may overlap"""
+
+        self.band_map.add_band('ln1', 1200, 1400)
+        self.band_map.add_band('ln2', 1000, 2600)
+        self.band_map.add_band('ln3', 1300, 1500)
+
+        fft_val = tuple(float(n) for n in range(16))
+        levels = self.band_map.get_levels(fft_val)
+
+        assert list(levels) == [2.5, 7.5, 3.5]
+
+        # the index is rebuilt when a band is added
+        self.band_map.add_band('ln4', 2500, 2600)
+        assert list(self.band_map.get_levels(fft_val)) == [2.5, 7.5, 3.5, 15]
+
+    def test_frame_batch(self):
+        """Test the band levels for a batch of frames, a row per frame"""
+
+        self.band_map.add_band('ln1', 1200, 1400)
+        self.band_map.add_band('ln2', 2500, 2600)
+
+        frames = numpy.array([range(16), range(16, 32)], dtype=numpy.float32)
+        levels = self.band_map.get_levels(frames)
+
+        assert levels.tolist() == [[2.5, 15], [18.5, 31]]
+
+    def test_outside_ranges(self):
+        """Test the bins outside every band, bands may overlap"""
+
+        self.band_map.add_band('ln1', 1200, 1400)
+        self.band_map.add_band('ln2', 1300, 1500)
+        self.band_map.add_band('ln3', 2500, 2600)
+
+        assert self.band_map.get_outside_ranges() == ((0, 2), (5, 15))
+
+        frames = numpy.array([range(16)], dtype=numpy.float32)
+        bins = dia_aux.join_bin_ranges(frames,
+                                       self.band_map.get_outside_ranges())
+
+        assert bins.tolist() == [[0, 1, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]]
+
+    @nose.tools.raises(ValueError)
+    def test_duplicate_band(self):
+        """Test that a band key is only mapped once.
+        An exception should be raised"""
+
+        self.band_map.add_band('ln1', 1200, 1400)
+        self.band_map.add_band('ln1', 1300, 1400)
+
+
+class TestDiaFrameSlice:
+    """test diatomite_aux.DiaFrameSlice class"""
+
+    def __init__(self):
+        # a 16 bin spectrum, and the frame as sent by the FFT, with it's
+        # halves swapped
+        self.spectrum = [float(n) for n in range(16)]
+        self.frame = tuple(self.spectrum[8:] + self.spectrum[:8])
+
+    def test_levels(self):
+        """Test the average level on slices below, above and across the
+        center of the spectrum, from tuples and numpy arrays"""
+
+        for start, end in [(2, 5), (9, 16), (6, 11), (0, 16)]:
+            frame_slice = dia_aux.DiaFrameSlice(16, start, end)
+            expected = sum(self.spectrum[start:end]) / (end - start)
+
+            assert frame_slice.get_level(self.frame) == expected
+            assert frame_slice.get_level(numpy.array(self.frame)) == expected
+
+    def test_frame_batch(self):
+        """Test the average level on a slice for a batch of frames"""
+
+        frames = numpy.array([self.frame, [n + 10 for n in self.frame]],
+                             dtype=numpy.float32)
+        frame_slice = dia_aux.DiaFrameSlice(16, 6, 11)
+
+        assert frame_slice.get_levels(frames).tolist() == [8, 18]
+
+    def test_spectrum(self):
+        """Test that the spectrum is averaged over the frames, lower
+        frequencies first"""
+
+        frames = numpy.array([numpy.fft.ifftshift(numpy.arange(16.0)),
+                              numpy.fft.ifftshift(numpy.arange(16.0) + 2)])
+        fft_slice = dia_aux.DiaFrameSlice(16, 6, 10)
+
+        assert fft_slice.get_spectrum(frames).tolist() == [7, 8, 9, 10]
+
+    def test_outside_ranges(self):
+        """Test the bins outside the slice on a swapped frame"""
+
+        assert dia_aux.DiaFrameSlice(16, 6, 10).get_outside_ranges() == \
+            ((2, 14),)
+        assert dia_aux.DiaFrameSlice(16, 2, 6).get_outside_ranges() == \
+            ((0, 10), (14, 16))
+
+    @nose.tools.raises(ValueError)
+    def test_bad_slice(self):
+        """Test that a slice outside the frame is refused.
+        An exception should be raised"""
+
+        dia_aux.DiaFrameSlice(16, 10, 17)
+
+
+class TestDiaFrameSink:
+    """test diatomite_aux.DiaFrameSink class"""
+
+    def __init__(self):
+        self.batches = []
+
+    def test_work(self):
+        """Test that every frame available is consumed and passed to the
+        callback"""
+
+        frame_sink = dia_aux.DiaFrameSink(16, self.batches.append)
+        frames = numpy.zeros((3, 16), dtype=numpy.float32)
+
+        assert frame_sink.work([frames], []) == 3
+        assert len(self.batches) == 1
+        assert self.batches[0].shape == (3, 16)
+
+    def test_callback_failure(self):
+        """Test that a failing callback does not stop the flowgraph"""
+
+        def callback(frames):
+            raise ValueError('bad frames')
+
+        frame_sink = dia_aux.DiaFrameSink(16, callback)
+        frames = numpy.zeros((2, 16), dtype=numpy.float32)
+
+        assert frame_sink.work([frames], []) == 2
+
+
+class TestDiaSigMetrics:
+    """test diatomite_aux.DiaSigMetrics class"""
+
+    def test_metrics(self):
+        """Test the metrics of a signal 20 dB above the floor, 10 bins
+        wide, 5 bins above the band's center"""
+
+        band = numpy.full(101, -90.0)
+        band[51:61] = -70.0
+        band[56] = -65.0
+        metrics = dia_aux.DiaSigMetrics(101, 1000)
+
+        snr, peak_offset, occupied_bw = metrics.get_metrics(band, -90.0)
+
+        assert 10 < snr < 12
+        assert peak_offset == 6000.0
+        assert occupied_bw == 10000.0
+
+    def test_noise(self):
+        """Test that noise at the floor has no snr and no occupied
+        bandwidth"""
+
+        metrics = dia_aux.DiaSigMetrics(11, 1000)
+
+        snr, _, occupied_bw = metrics.get_metrics(numpy.full(11, -90.0),
+                                                  -90.0)
+
+        assert abs(snr) < 1e-9
+        assert occupied_bw == 0.0
+
+    def test_no_floor(self):
+        """Test that without a noise floor there's no snr"""
+
+        metrics = dia_aux.DiaSigMetrics(11, 1000)
+
+        assert metrics.get_metrics(numpy.full(11, -90.0), None)[0] is None
+
+    @nose.tools.raises(ValueError)
+    def test_bad_band(self):
+        """Test that a band with the wrong number of bins is refused.
+        An exception should be raised"""
+
+        dia_aux.DiaSigMetrics(11, 1000).get_metrics(numpy.zeros(10), -90.0)
+
+
+class TestDiaNoiseFloor:
+    """test diatomite_aux.DiaNoiseFloor class"""
+
+    def test_floor(self):
+        """Test that the estimate follows the median of noise with a few
+        strong bins"""
+
+        numpy.random.seed(1)
+        floor = dia_aux.DiaNoiseFloor()
+
+        for _ in range(100):
+            frames = numpy.random.normal(-90, 3, (3, 512))
+            frames[:, 250:262] = -40
+            level = floor.update(frames)
+
+        assert abs(level + 90) < 1
+        assert floor.get_floor() == level
+
+    def test_tracking(self):
+        """Test that the estimate follows a drifting floor"""
+
+        numpy.random.seed(1)
+        floor = dia_aux.DiaNoiseFloor()
+
+        floor.update(numpy.random.normal(-90, 3, 512))
+        for _ in range(300):
+            level = floor.update(numpy.random.normal(-80, 3, 512))
+
+        assert abs(level + 80) < 1
+
+    @nose.tools.raises(ValueError)
+    def test_bad_quantile(self):
+        """Test that a quantile outside 0 to 1 is refused.
+        An exception should be raised"""
+
+        dia_aux.DiaNoiseFloor(quantile=1.5)
+
+
+class TestDiaDecimationPlan:
+    """test diatomite_aux.DiaDecimationPlan class"""
+
+    def test_stages(self):
+        """Test a 200kHz listener on a 2.4MHz source"""
+
+        plan = dia_aux.DiaDecimationPlan(2400000, 400000)
+
+        assert plan.get_decimation() == 6
+        assert plan.get_out_rate() == 400000
+        assert plan.get_passband() == 160000
+
+        stages = plan.get_stages()
+        assert [stage[:2] for stage in stages] == [(3, 2400000),
+                                                   (2, 800000)]
+
+        # the first stage only keeps aliases off the passband, the last
+        # one off the output band
+        assert stages[0][2] - stages[0][3] / 2 == 160000
+        assert stages[0][2] + stages[0][3] / 2 == 640000
+        assert stages[1][2] + stages[1][3] / 2 == 200000
+
+    def test_factors(self):
+        """Test that stages decimate by prime factors, largest first"""
+
+        plan = dia_aux.DiaDecimationPlan(2048000, 12500)
+
+        assert plan.get_decimation() == 163
+        assert [stage[0] for stage in plan.get_stages()] == [163]
+
+        plan = dia_aux.DiaDecimationPlan(2400000, 25000)
+
+        assert [stage[0] for stage in plan.get_stages()] == [3, 2, 2, 2,
+                                                             2, 2]
+
+    def test_no_decimation(self):
+        """Test that a source slower than the minimum rate is not
+        decimated"""
+
+        plan = dia_aux.DiaDecimationPlan(250000, 400000)
+
+        assert plan.get_decimation() == 1
+        assert plan.get_out_rate() == 250000
+        assert plan.get_stages() == []
+
+    @nose.tools.raises(ValueError)
+    def test_bad_passband(self):
+        """Test that a passband outside 0 to 1 is refused.
+        An exception should be raised"""
+
+        dia_aux.DiaDecimationPlan(2400000, 400000, passband=1)
+
+
+class TestDiaTapCache:
+    """test diatomite_aux.DiaTapCache class"""
+
+    def setup(self):
+        """Create a directory for the disk cache"""
+        self.cache_path = tempfile.mkdtemp()
+
+    def teardown(self):
+        """Remove the disk cache directory"""
+        shutil.rmtree(self.cache_path)
+
+    def test_memory(self):
+        """Test that the same design is only done once"""
+
+        cache = dia_aux.DiaTapCache()
+
+        taps = cache.low_pass(1, 2400000, 400000, 480000, 60)
+
+        assert cache.low_pass(1, 2400000, 400000, 480000, 60) is taps
+        assert cache.low_pass(1, 2400000, 400000, 240000, 60) != taps
+        assert cache.get_stats() == (1, 0, 2)
+
+    def test_disk(self):
+        """Test that designs are kept on disk, for another cache"""
+
+        cache = dia_aux.DiaTapCache(self.cache_path)
+        taps = cache.low_pass(1, 800000, 180000, 40000, 60)
+
+        other_cache = dia_aux.DiaTapCache(self.cache_path)
+
+        assert other_cache.low_pass(1, 800000, 180000, 40000, 60) == taps
+        assert other_cache.get_stats() == (0, 1, 0)
+
+    def test_malformed(self):
+        """Test that malformed files on disk are designed again"""
+
+        cache = dia_aux.DiaTapCache(self.cache_path)
+        taps = cache.low_pass(1, 800000, 180000, 40000)
+
+        for name in os.listdir(self.cache_path):
+            with open(os.path.join(self.cache_path, name), 'w') as taps_file:
+                taps_file.write('{')
+
+        other_cache = dia_aux.DiaTapCache(self.cache_path)
+
+        assert other_cache.low_pass(1, 800000, 180000, 40000) == taps
+        assert other_cache.get_stats() == (0, 0, 1)
+
+
+class TestDiaTopBlock:
+    """test diatomite_aux.DiaTopBlock class"""
+
+    def test_tuning(self):
+        """Test that scheduler settings reach every block connected"""
+
+        top_block = dia_aux.DiaTopBlock()
+        source = blocks.null_source(gr.sizeof_gr_complex)
+        head = blocks.head(gr.sizeof_gr_complex, 1000)
+        sink = blocks.null_sink(gr.sizeof_gr_complex)
+
+        top_block.connect(source, head)
+        top_block.connect((head, 0), (sink, 0))
+
+        assert ([id(block) for block in top_block.get_blocks()] ==
+                [id(source), id(head), id(sink)])
+
+        top_block.set_block_tuning(4096, [0])
+
+        assert head.max_output_buffer(0) == 4096
+        assert list(head.processor_affinity()) == [0]
+
+    def test_tuning_unsupported(self):
+        """Test that blocks without scheduler settings are skipped"""
+
+        top_block = dia_aux.DiaTopBlock()
+        source = blocks.null_source(gr.sizeof_gr_complex)
+        head = blocks.head(gr.sizeof_gr_complex, 1000)
+        top_block.connect(source, head)
+
+        # stands for a hierarchical block on older GNU Radio versions
+        top_block._dia_blocks.insert(0, object())
+        top_block.set_block_tuning(4096, [0])
+
+        assert head.max_output_buffer(0) == 4096
+        assert list(head.processor_affinity()) == [0]
+
+    def test_tuning_by_role(self):
+        """Test per block role scheduler settings"""
+
+        top_block = dia_aux.DiaTopBlock()
+        source = blocks.null_source(gr.sizeof_gr_complex)
+        head = blocks.head(gr.sizeof_gr_complex, 1000)
+        sink = blocks.null_sink(gr.sizeof_gr_complex)
+
+        top_block.connect(source, head, sink)
+        top_block.set_block_role(source, 'source')
+        top_block.set_block_role(sink, 'fft')
+
+        assert top_block.get_block_role(source) == 'source'
+        assert top_block.get_block_role(head) == top_block.DEFAULT_ROLE
+
+        # roles without settings are left to GNU Radio's default
+        top_block.set_block_tuning({'source': 16384, 'listener': 2048},
+                                   {'fft': [1]})
+
+        assert source.max_output_buffer(0) == 16384
+        assert head.max_output_buffer(0) == 2048
+        assert sink.max_output_buffer(0) not in (16384, 2048)
+        assert list(sink.processor_affinity()) == [1]
+        assert not list(source.processor_affinity())
+
+    @nose.tools.raises(ValueError)
+    def test_unknown_role(self):
+        """Test that an unknown block role is rejected"""
+
+        top_block = dia_aux.DiaTopBlock()
+        head = blocks.head(gr.sizeof_gr_complex, 1000)
+        top_block.set_block_role(head, 'demodulator')
+
+
+class TestDiaFrameDemand:
+    """test diatomite_aux.DiaFrameDemand class"""
+
+    def test_rate(self):
+        """Test that the frame rate follows the fastest consumer, and the
+        idle rate without consumers"""
+
+        demand = dia_aux.DiaFrameDemand(idle_rate=1.0)
+
+        assert demand.get_rate() == 1.0
+
+        assert demand.set_demand('detection', 10)
+        assert demand.set_demand('tap', 20)
+        assert not demand.set_demand('detection', 15)
+        assert demand.get_rate() == 20.0
+        assert demand.get_demands() == {'detection': 15.0, 'tap': 20.0}
+
+        assert demand.set_demand('tap', 0)
+        assert demand.get_rate() == 15.0
+
+        demand.set_demand('detection', 0)
+        assert demand.get_rate() == 1.0
+
+    def test_avg_alpha(self):
+        """Test that the averaging time is kept at other frame rates"""
+
+        demand = dia_aux.DiaFrameDemand(avg_alpha=0.2, ref_rate=30.0)
+
+        demand.set_demand('tap', 30)
+        assert abs(demand.get_avg_alpha() - 0.2) < 1e-9
+
+        # 3 frames at 30 fps are averaged as a frame at 10 fps
+        demand.set_demand('tap', 10)
+        assert abs(demand.get_avg_alpha() - (1 - 0.8 ** 3)) < 1e-9
+
+        assert dia_aux.DiaFrameDemand().get_avg_alpha() == 1.0
+
+    @nose.tools.raises(ValueError)
+    def test_bad_rate(self):
+        """Test that a negative frame rate is refused.
+        An exception should be raised"""
+
+        dia_aux.DiaFrameDemand().set_demand('tap', -1)
+
+
+class TestDiaRunningAverage:
+    """test diatomite_aux.DiaRunningAverage class"""
+
+    def test_average(self):
+        """Test that the average covers the latest samples only"""
+
+        running_avg = dia_aux.DiaRunningAverage(4)
+
+        assert running_avg.add(8) == 2
+        for sample in [1, 2, 3, 4, 5]:
+            running_avg.add(sample)
+
+        assert running_avg.get_average() == 3.5
+        assert running_avg.get_samples() == [5, 4, 3, 2]
+
+    def test_no_drift(self):
+        """Test that rounding errors don't build up on the running sum"""
+
+        running_avg = dia_aux.DiaRunningAverage(10)
+        for n in xrange(100000):
+            running_avg.add(-70.1 + (n % 7) * 0.3)
+        for _ in xrange(10):
+            running_avg.add(-55.5)
+
+        assert running_avg.get_average() == -55.5
+
+
+class TestTimeFormat:
+    """test diatomite_aux.format_time and parse_time functions"""
+
+    def test_format(self):
+        """Test timestamps formatting, on the same and on different
+        seconds"""
+
+        assert dia_aux.format_time(1483228800.5) == \
+            '2017-01-01T00:00:00.500000'
+        assert dia_aux.format_time(1483228800.75) == \
+            '2017-01-01T00:00:00.750000'
+        assert dia_aux.format_time(1483228861.0) == \
+            '2017-01-01T00:01:01.000000'
+        assert dia_aux.format_time(None) is None
+
+    def test_parse(self):
+        """Test parsing iso times, with and without microseconds"""
+
+        assert dia_aux.parse_time('2017-01-01T00:00:00.500000') == \
+            1483228800.5
+        assert dia_aux.parse_time('2017-01-01T00:01:01') == 1483228861.0
+        assert dia_aux.parse_time(None) is None
+
+
+class TestDiaSigInfo:
+    """test diatomite_aux.DiaSigInfo class"""
+
+    def __init__(self):
+        self.sig_info = dia_aux.DiaSigInfo(dia_aux.DiaSigStatus.PRESENT, -55.5,
+                                           1483228800.25)
+
+    def test_json_round_trip(self):
+        """Test that the status is kept through json"""
+
+        new_sig_info = dia_aux.DiaSigInfo()
+        new_sig_info.set_json(self.sig_info.get_json())
+
+        assert new_sig_info.get_status() == dia_aux.DiaSigStatus.PRESENT
+        assert new_sig_info.get_level() == -55.5
+        assert new_sig_info.get_time() == 1483228800.25
+        assert json.loads(new_sig_info.get_json())['level_units'] == 'DBm'
+        assert json.loads(new_sig_info.get_json())['time'] == \
+            '2017-01-01T00:00:00.250000'
+
+    def test_pickle_protocols(self):
+        """Test that the compact state survives all pickle protocols"""
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            new_sig_info = pickle.loads(pickle.dumps(self.sig_info, protocol))
+
+            assert new_sig_info.get_status() == dia_aux.DiaSigStatus.PRESENT
+            assert new_sig_info.get_level() == -55.5
+
+    def test_metrics(self):
+        """Test that the signal quality metrics are kept through json and
+        pickle"""
+
+        self.sig_info.set_metrics(18.5, -2500.0, 180000.0)
+
+        new_sig_info = dia_aux.DiaSigInfo()
+        new_sig_info.set_json(self.sig_info.get_json())
+        pickled_sig_info = pickle.loads(pickle.dumps(self.sig_info, 2))
+
+        for sig_info in (new_sig_info, pickled_sig_info):
+            assert sig_info.get_snr() == 18.5
+            assert sig_info.get_peak_offset() == -2500.0
+            assert sig_info.get_occupied_bw() == 180000.0
+
+        assert dia_aux.DiaSigInfo().get_snr() is None
+
+    def test_alias_status(self):
+        """Test that an aliased status decodes to its canonical member"""
+
+        sig_info = dia_aux.DiaSigInfo(dia_aux.DiaSigStatus.INOP, -90,
+                                      1483228800.25)
+
+        assert sig_info.get_status() is dia_aux.DiaSigStatus.ABSENT
+
+    def test_empty_status(self):
+        """Test that an empty info has no status"""
+
+        assert dia_aux.DiaSigInfo().get_status() is None
+
+    @nose.tools.raises(AttributeError)
+    def test_no_instance_dict(self):
+        """Test that no per instance dict is created.
+        An exception should be raised"""
+
+        self.sig_info.new_attribute = 1
+
+
+class QueueHelper(object):
+    """Helpers to test queues"""
+
+    def new_msg(self, msg_type, listener_id, level):
+        """Return a message from a listener
+        msg_type -- a DiaMsgType object
+        listener_id -- the listener id
+        level -- signal level"""
+
+        sig_info = dia_aux.DiaSigInfo(dia_aux.DiaSigStatus.PRESENT, level,
+                                      1483228800.25)
+        sig_state = dia_aux.DiaSigState()
+        sig_state.set_new(sig_info)
+
+        return dia_aux.DiaMsg(msg_type, sig_state, 'rs1', listener_id)
+
+    def new_level_msg(self, listener_id, level):
+        """Return a signal level message from a listener"""
+
+        return self.new_msg(dia_aux.DiaMsgType.LNR_SIG_STATE, listener_id,
+                            level)
+
+    def get_levels(self, queue):
+        """Return the levels of all messages on the queue"""
+
+        levels = []
+        while True:
+            try:
+                item = queue.get(True, 0.2)
+            except mp_queues.Empty:
+                break
+            if isinstance(item, dia_aux.DiaMsgBatch):
+                msgs = item.get_msgs()
+            else:
+                msgs = [item]
+            levels.extend([(msg.get_listener_id(),
+                            msg.get_payload().get_current().get_level())
+                           for msg in msgs])
+
+        return levels
+
+
+class TestDiaQueue(QueueHelper):
+    """test diatomite_aux.DiaQueue class"""
+
+    def test_coalesce(self):
+        """Test that levels are coalesced while the queue is full"""
+
+        queue = dia_aux.DiaQueue('test', 1)
+
+        queue.put_msg(self.new_level_msg('ln11', -60))
+        queue.put_msg(self.new_level_msg('ln11', -50))
+        queue.put_msg(self.new_level_msg('ln12', -70))
+        queue.put_msg(self.new_level_msg('ln11', -40))
+
+        # the held back levels are put once there's room, without
+        # another put
+        assert self.get_levels(queue) == [('ln11', -60), ('ln12', -70),
+                                          ('ln11', -40)]
+
+        stats = queue.get_stats()
+        assert stats['dropped'] == 1
+        assert stats['full'] == 1
+        assert stats['high_water'] == 1
+
+    def test_drop_oldest(self):
+        """Test that the oldest levels are dropped while the queue is
+        full"""
+
+        queue = dia_aux.DiaQueue('test', 1,
+                                 dia_aux.DiaQueue.POLICY_DROP_OLDEST)
+        queue._max_pending = 2
+
+        for level in range(-60, -55):
+            queue.put_msg(self.new_level_msg('ln11', level))
+
+        assert self.get_levels(queue) == [('ln11', -60), ('ln11', -57),
+                                          ('ln11', -56)]
+        assert queue.get_stats()['dropped'] == 2
+
+    def test_full_queue_not_blocking(self):
+        """Test that levels are held back, not blocking, while nothing
+        gets from the queue"""
+
+        queue = dia_aux.DiaQueue('test', 1)
+
+        start = time.time()
+        for level in range(-60, -50):
+            queue.put_msg(self.new_level_msg('ln11', level))
+        time.sleep(3 * queue._flush_interval)
+
+        assert time.time() - start < 1
+        assert self.get_levels(queue) == [('ln11', -60), ('ln11', -51)]
+        assert queue.get_stats()['dropped'] == 8
+
+    def test_state_change_not_dropped(self):
+        """Test that a state change is queued, superseding held back
+        levels for the same listener"""
+
+        queue = dia_aux.DiaQueue('test', 2)
+
+        queue.put_msg(self.new_level_msg('ln11', -60))
+        queue.put_msg(self.new_level_msg('ln12', -60))
+        queue.put_msg(self.new_level_msg('ln11', -50))
+
+        # the state change waits for room on the queue
+        timer = threading.Timer(0.2, queue.get)
+        timer.start()
+        queue.put_msg(self.new_msg(dia_aux.DiaMsgType.LNR_SIG_STATUS_CHANGE,
+                                   'ln11', -20))
+        timer.join()
+
+        assert self.get_levels(queue) == [('ln12', -60), ('ln11', -20)]
+        assert queue.get_stats()['dropped'] == 1
+
+    def test_sys_state_keeps_levels(self):
+        """Test that a system state change does not drop the held back
+        levels of it's listener"""
+
+        queue = dia_aux.DiaQueue('test', 1)
+
+        queue.put_msg(self.new_level_msg('ln11', -60))
+        queue.put_msg(self.new_level_msg('ln11', -50))
+        queue._discard_superseded(
+            [dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SYS_STATE_CHANGE,
+                            dia_aux.DiaSysState(), 'rs1', 'ln11')])
+
+        assert self.get_levels(queue) == [('ln11', -60), ('ln11', -50)]
+        assert queue.get_stats()['dropped'] == 0
+
+    def test_batch_puts(self):
+        """Test that the messages of a batch are each counted as put"""
+
+        queue = dia_aux.DiaQueue('test', 10)
+
+        queue.put_msg(dia_aux.DiaMsgBatch(
+            [self.new_level_msg('ln11', -60),
+             self.new_level_msg('ln12', -50)]))
+        queue.put_msg(self.new_level_msg('ln11', -40))
+
+        stats = queue.get_stats()
+        assert stats['puts'] == 3
+        assert stats['high_water'] <= 2
+
+    @nose.tools.raises(ValueError)
+    def test_bad_policy(self):
+        """Test that an unknown level policy is refused.
+        An exception should be raised"""
+
+        dia_aux.DiaQueue('test', 1, 'drop_newest')
+
+
+class TestDiaReportRules:
+    """test diatomite_aux.DiaReportRules class"""
+
+    def test_min_change(self):
+        """Test that only levels that moved enough are reported"""
+
+        rules = dia_aux.DiaReportRules(min_change=1)
+
+        reports = [rules.check(level, tick * 0.1) for tick, level in
+                   enumerate([-60, -60.01, -60.5, -61.2, -61.0, -60.1])]
+
+        assert reports == [True, False, False, True, False, True]
+
+    def test_min_interval(self):
+        """Test that levels are not reported more often than the minimum
+        interval"""
+
+        rules = dia_aux.DiaReportRules(min_change=0, min_interval=0.5)
+
+        reports = [rules.check(-60 - tick, tick * 0.1) for tick in range(11)]
+
+        assert reports.count(True) == 3
+
+    def test_max_silence(self):
+        """Test that a steady level is reported as an heartbeat"""
+
+        rules = dia_aux.DiaReportRules(min_change=1, max_silence=5)
+
+        reports = [rules.check(-60, tick * 0.1) for tick in range(101)]
+
+        assert reports.count(True) == 3
+
+    def test_reset(self):
+        """Test that a reset level counts as reported"""
+
+        rules = dia_aux.DiaReportRules(min_change=1)
+        rules.reset(-40, 0)
+
+        assert not rules.check(-40.5, 0.1)
+        assert rules.check(-60, 0.2)
+
+    @nose.tools.raises(ValueError)
+    def test_negative_rule(self):
+        """Test that negative rules are refused.
+        An exception should be raised"""
+
+        dia_aux.DiaReportRules(min_change=-1)
+
+
+class TestDiaSigDetector:
+    """test diatomite_aux.DiaSigDetector class"""
+
+    present = dia_aux.DiaSigStatus.PRESENT
+    absent = dia_aux.DiaSigStatus.ABSENT
+
+    def test_threshold(self):
+        """Test that without hysteresis or dwell the status follows the
+        threshold"""
+
+        detector = dia_aux.DiaSigDetector(on_threshold=-70)
+
+        states = [detector.check(level, tick * 0.1) for tick, level in
+                  enumerate([-80, -70, -71, -65])]
+
+        assert states == [self.absent, self.present, self.absent,
+                          self.present]
+        assert detector.get_stats() == {'to_present': 2, 'to_absent': 1,
+                                        'suppressed': 0}
+
+    def test_hysteresis(self):
+        """Test that a level between the thresholds keeps the status"""
+
+        detector = dia_aux.DiaSigDetector(on_threshold=-70,
+                                          off_threshold=-75)
+
+        states = [detector.check(level, tick * 0.1) for tick, level in
+                  enumerate([-80, -72, -69, -72, -74, -76, -72])]
+
+        assert states == [self.absent, self.absent, self.present,
+                          self.present, self.present, self.absent,
+                          self.absent]
+
+    def test_dwell(self):
+        """Test that crossings shorter than the dwell time are suppressed"""
+
+        detector = dia_aux.DiaSigDetector(on_threshold=-70, on_dwell=0.5,
+                                          off_dwell=0.15)
+
+        # flapping around the threshold, then a steady signal
+        levels = [-80, -65, -80, -65, -80] + 6 * [-65] + 3 * [-80]
+        states = [detector.check(level, tick * 0.1) for tick, level in
+                  enumerate(levels)]
+
+        assert states[:10] == 10 * [self.absent]
+        assert states[10] == self.present
+        assert states[11:] == [self.present, self.present, self.absent]
+        assert detector.get_stats() == {'to_present': 1, 'to_absent': 1,
+                                        'suppressed': 2}
+
+    @nose.tools.raises(ValueError)
+    def test_bad_thresholds(self):
+        """Test that an off threshold above the on threshold is refused.
+        An exception should be raised"""
+
+        dia_aux.DiaSigDetector(on_threshold=-70, off_threshold=-60)
+
+
+class TestDiaLaneQueue(QueueHelper):
+    """test diatomite_aux.DiaLaneQueue class"""
+
+    def test_priority_first(self):
+        """Test that state changes are taken before older level updates"""
+
+        queue = dia_aux.DiaLaneQueue('test', 10)
+
+        for level in (-60, -59, -58):
+            queue.put_msg(self.new_level_msg('ln11', level))
+        queue.put_msg(dia_aux.DiaMsgBatch(
+            [self.new_level_msg('ln12', -57),
+             self.new_msg(dia_aux.DiaMsgType.LNR_SIG_STATUS_CHANGE, 'ln12',
+                          -20)]))
+
+        # wait for the feeder threads to write everything
+        time.sleep(0.2)
+
+        assert self.get_levels(queue) == [('ln12', -20), ('ln11', -60),
+                                          ('ln11', -59), ('ln11', -58),
+                                          ('ln12', -57)]
+
+        stats = queue.get_stats()
+        assert stats['puts'] == 1
+        assert stats['bulk']['puts'] == 4
+
+    def test_get_timeout(self):
+        """Test that waiting on both lanes times out"""
+
+        queue = dia_aux.DiaLaneQueue('test', 10)
+        start = time.time()
+
+        try:
+            queue.get(True, 0.2)
+        except mp_queues.Empty:
+            assert time.time() - start >= 0.2
+        else:
+            assert False
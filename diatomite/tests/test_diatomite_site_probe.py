@@ -21,6 +21,7 @@
 
 import nose
 import os
+import copy
 import yaml
 import tempfile
 import diatomite.diatomite_site_probe as dia_sp
@@ -604,6 +605,18 @@ class TestDiaConfParser:
                 assert False
             if 'logging' not in this_probe:
                 assert False
+            if this_probe['shared_level_table'] is not False:
+                assert False
+            if this_probe['direct_api_path'] is not False:
+                assert False
+            if this_probe['fir_tap_cache'] is not False:
+                assert False
+            if this_probe['fftw_wisdom_path'] != '':
+                assert False
+            if this_probe['queue_size'] != 1000:
+                assert False
+            if this_probe['level_queue_policy'] != 'coalesce':
+                assert False
                 
             logging_conf = this_probe['logging']
             
@@ -612,6 +625,30 @@ class TestDiaConfParser:
             if 'dir_path' not in logging_conf:
                 assert False
                 
+    def test_probe_valid_values(self):
+        """Test if probe values are sane.
+        Tested with bad values for direct_api_path, fir_tap_cache,
+        queue_size and level_queue_policy"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        for option, value in [('direct_api_path', 'yes'),
+                              ('fir_tap_cache', 'yes'),
+                              ('queue_size', 'many'),
+                              ('queue_size', '-1'),
+                              ('level_queue_policy', 'drop_newest')]:
+
+            conf = copy.deepcopy(self.good_conf_01)
+            probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+            probe[option] = value
+
+            try:
+                dia_conf._good_conf = dia_conf._process_config(conf)
+            except dia_sp.DiaConfParserError:
+                assert True
+            else:
+                assert False
+
     @nose.tools.raises(dia_sp.DiaConfParserError)
     def test_parse_missing_RadioSources_section(self):
         """Test to parse a configuration missing RadioSources section.
@@ -652,6 +689,220 @@ class TestDiaConfParser:
                 assert False
             if 'freq_analyzer_tap' not in this_rs:
                 assert False
+            if this_rs['detection_mode'] != 'listener':
+                assert False
+            if this_rs['fft_size'] != 1024:
+                assert False
+            if this_rs['channels'] != 0:
+                assert False
+            if this_rs['cpu_affinity'] is not None:
+                assert False
+            if this_rs['block_affinity'] is not None:
+                assert False
+            if this_rs['max_output_buffer'] != 0:
+                assert False
+            if this_rs['max_noutput_items'] != 0:
+                assert False
+            if this_rs['niceness'] != 0:
+                assert False
+
+    def test_radio_source_tuning(self):
+        """Test if radio source scheduler and process tuning options are
+        parsed, and bad values refused"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        conf = copy.deepcopy(self.good_conf_01)
+        probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+        r_source = probe['RadioSources']['rs1']
+        r_source['cpu_affinity'] = '2, 3'
+        r_source['block_affinity'] = '3'
+        r_source['max_output_buffer'] = '8192'
+        r_source['niceness'] = '5'
+        conf = dia_conf._process_config(conf)
+
+        assert r_source['cpu_affinity'] == [2, 3]
+        assert r_source['block_affinity'] == [3]
+        assert r_source['max_output_buffer'] == 8192
+        assert r_source['max_noutput_items'] == 0
+        assert r_source['niceness'] == 5
+
+        # block settings by block role
+        conf = copy.deepcopy(self.good_conf_01)
+        probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+        r_source = probe['RadioSources']['rs1']
+        r_source['block_affinity'] = {'source': '0', 'listener': '1,2'}
+        r_source['max_output_buffer'] = {'fft': '1024'}
+        conf = dia_conf._process_config(conf)
+
+        assert r_source['block_affinity'] == {'source': [0],
+                                              'listener': [1, 2]}
+        assert r_source['max_output_buffer'] == {'fft': 1024}
+
+        for option, value in [('cpu_affinity', 'all'),
+                              ('cpu_affinity', '-1'),
+                              ('block_affinity', '0;1'),
+                              ('block_affinity', {'demodulator': '1'}),
+                              ('max_output_buffer', 'small'),
+                              ('max_output_buffer', {'fft': '-1'}),
+                              ('max_noutput_items', '-1'),
+                              ('niceness', '20')]:
+
+            conf = copy.deepcopy(self.good_conf_01)
+            probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+            probe['RadioSources']['rs1'][option] = value
+
+            try:
+                dia_conf._good_conf = dia_conf._process_config(conf)
+            except dia_sp.DiaConfParserError:
+                assert True
+            else:
+                assert False
+
+    def test_radio_source_detection_valid_values(self):
+        """Test if radio source detection values are sane.
+        Tested with bad values for detection_mode, fft_size and channels"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        for option, value in [('detection_mode', 'narrowband'),
+                              ('fft_size', 'big'),
+                              ('fft_size', '1000'),
+                              ('fft_size', '0'),
+                              ('channels', 'many'),
+                              ('channels', '1'),
+                              ('channels', '7'),
+                              ('channels', '-2')]:
+
+            conf = copy.deepcopy(self.good_conf_01)
+            probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+            probe['RadioSources']['rs1'][option] = value
+
+            try:
+                dia_conf._good_conf = dia_conf._process_config(conf)
+            except dia_sp.DiaConfParserError:
+                assert True
+            else:
+                assert False
+
+    def test_detection_profile_defaults(self):
+        """Test if listeners get the default detection profile, or the
+        probe's, when none is set"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        conf = copy.deepcopy(self.good_conf_01)
+        probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+        conf = dia_conf._process_config(conf)
+        listener = probe['RadioSources']['rs1']['listeners']['ln11']
+
+        assert listener['detection_profile'] == 'default'
+        assert listener['detection']['fft_size'] == 1024
+        assert listener['detection']['frame_rate'] == 30.0
+
+        conf = copy.deepcopy(self.good_conf_01)
+        probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+        probe['detection_profile'] = 'lightweight'
+        conf = dia_conf._process_config(conf)
+        listener = probe['RadioSources']['rs1']['listeners']['ln11']
+
+        assert listener['detection_profile'] == 'lightweight'
+        assert listener['detection']['fft_size'] == 256
+
+    def test_detection_profile_custom(self):
+        """Test if configured detection profiles are validated, and missing
+        options filled from the default profile"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        conf = copy.deepcopy(self.good_conf_01)
+        probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+        probe['detection_profiles'] = {
+            'critical': {'fft_size': '2048', 'frame_rate': '50',
+                         'window': 'Hamming'}}
+        listener = probe['RadioSources']['rs1']['listeners']['ln11']
+        listener['detection_profile'] = 'critical'
+        conf = dia_conf._process_config(conf)
+
+        profile = listener['detection']
+        assert profile['fft_size'] == 2048
+        assert profile['frame_rate'] == 50.0
+        assert profile['window'] == 'hamming'
+        assert profile['avg_time'] == 1.0
+        assert profile['slice_percentage'] == 10.0
+
+    def test_detection_profile_override(self):
+        """Test if an overridden built in detection profile keeps the
+        options not set from the built in profile"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        conf = copy.deepcopy(self.good_conf_01)
+        probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+        probe['detection_profiles'] = {'lightweight': {'frame_rate': '5'}}
+        listener = probe['RadioSources']['rs1']['listeners']['ln11']
+        listener['detection_profile'] = 'lightweight'
+        conf = dia_conf._process_config(conf)
+
+        profile = listener['detection']
+        assert profile['frame_rate'] == 5.0
+        assert profile['fft_size'] == 256
+        assert profile['window'] == 'hamming'
+
+    def test_fft_sizes(self):
+        """Test if a probe's FFT sizes are taken from it's radio sources
+        and listeners"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        conf = copy.deepcopy(self.good_conf_01)
+        probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+        listener = probe['RadioSources']['rs1']['listeners']['ln11']
+        listener['detection_profile'] = 'lightweight'
+        conf = dia_conf._process_config(conf)
+
+        assert dia_sp.DiatomiteProbe.get_fft_sizes(probe) == [256, 1024]
+
+    def test_detection_profile_valid_values(self):
+        """Test if detection profile values are sane.
+        Tested with bad profile options and unknown profiles"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        for option, value in [('fft_size', '1000'),
+                              ('fft_size', '8'),
+                              ('frame_rate', '0'),
+                              ('window', 'kaiser'),
+                              ('avg_alpha', '1.5'),
+                              ('avg_time', 'long'),
+                              ('slice_percentage', '101'),
+                              ('tap_rate', '-1'),
+                              ('fft_size', None),
+                              ('avg_time', None),
+                              ('decimation', '2')]:
+
+            conf = copy.deepcopy(self.good_conf_01)
+            probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+            probe['detection_profiles'] = {'bad': {option: value}}
+
+            try:
+                dia_conf._good_conf = dia_conf._process_config(conf)
+            except dia_sp.DiaConfParserError:
+                assert True
+            else:
+                assert False
+
+        conf = copy.deepcopy(self.good_conf_01)
+        probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+        listener = probe['RadioSources']['rs1']['listeners']['ln11']
+        listener['detection_profile'] = 'unknown'
+
+        try:
+            dia_conf._good_conf = dia_conf._process_config(conf)
+        except dia_sp.DiaConfParserError:
+            assert True
+        else:
+            assert False
 
     def test_radio_source_valid_values(self):
         """Test if radio source values are sane.
@@ -705,6 +956,99 @@ class TestDiaConfParser:
                 assert False
             if 'freq_analyzer_tap' not in this_l:
                 assert False           
+            if this_l['report_min_change'] != 1.0:
+                assert False
+            if this_l['report_min_interval'] != 0.0:
+                assert False
+            if this_l['report_max_silence'] != 5.0:
+                assert False
+            if this_l['level_threshold_off'] != this_l['level_threshold']:
+                assert False
+            if this_l['dwell_present'] != 0.0:
+                assert False
+            if this_l['dwell_absent'] != 0.0:
+                assert False
+
+    def test_listener_report_rules_valid_values(self):
+        """Test if listener report rules are sane.
+        Tested with bad values for report_min_change, report_min_interval
+        and report_max_silence"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        for option, value in [('report_min_change', 'little'),
+                              ('report_min_interval', '-1'),
+                              ('report_max_silence', 'never')]:
+
+            conf = copy.deepcopy(self.good_conf_01)
+            probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+            probe['RadioSources']['rs1']['listeners']['ln11'][option] = value
+
+            try:
+                dia_conf._good_conf = dia_conf._process_config(conf)
+            except dia_sp.DiaConfParserError:
+                assert True
+            else:
+                assert False
+
+    def test_listener_hysteresis_valid_values(self):
+        """Test if listener hysteresis and dwell times are sane.
+        Tested with bad values for level_threshold_off, dwell_present and
+        dwell_absent"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        for option, value in [('level_threshold_off', 'low'),
+                              ('level_threshold_off', '-60'),
+                              ('dwell_present', '-1'),
+                              ('dwell_absent', 'long')]:
+
+            conf = copy.deepcopy(self.good_conf_01)
+            probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+            probe['RadioSources']['rs1']['listeners']['ln11'][option] = value
+
+            try:
+                dia_conf._good_conf = dia_conf._process_config(conf)
+            except dia_sp.DiaConfParserError:
+                assert True
+            else:
+                assert False
+
+    def test_listener_floor_thresholds(self):
+        """Test if thresholds relative to the noise floor replace
+        level_threshold"""
+
+        dia_conf = dia_sp.DiaConfParser()
+
+        conf = copy.deepcopy(self.good_conf_01)
+        probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+        listener = probe['RadioSources']['rs1']['listeners']['ln11']
+        del listener['level_threshold']
+        listener['threshold_above_floor'] = '10'
+        listener['threshold_off_above_floor'] = '7'
+        dia_conf._process_config(conf)
+
+        assert listener['level_threshold'] is None
+        assert listener['level_threshold_off'] is None
+        assert listener['threshold_above_floor'] == 10.0
+        assert listener['threshold_off_above_floor'] == 7.0
+
+        for option, value in [('threshold_above_floor', '0'),
+                              ('threshold_above_floor', 'high'),
+                              ('threshold_off_above_floor', '12')]:
+
+            conf = copy.deepcopy(self.good_conf_01)
+            probe = conf['sites']['test_site_1']['probes']['test_probe_1']
+            listener = probe['RadioSources']['rs1']['listeners']['ln11']
+            listener['threshold_above_floor'] = '10'
+            listener[option] = value
+
+            try:
+                dia_conf._good_conf = dia_conf._process_config(conf)
+            except dia_sp.DiaConfParserError:
+                assert True
+            else:
+                assert False
 
     @nose.tools.raises(dia_sp.DiaConfParserError)
     def test_parse_missing_listener_missing_radio_source_mandatorys(self):
@@ -0,0 +1,142 @@
+#!/usr/bin/env python2
+"""
+    Tests for the diatomite monitoring system.
+    Copyright (C) 2017 Duarte Alencastre
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+                    GNU AFFERO GENERAL PUBLIC LICENSE
+                       Version 3, 19 November 2007
+"""
+
+import threading
+import numpy
+import diatomite.diatomite_aux as dia_aux
+import diatomite.freqlistener as freqlistener
+
+
+class TestFreqListener:
+    """test freqlistener.FreqListener class"""
+
+    def __init__(self):
+        # a listener with only the attributes used to slice FFT frames,
+        # configuring one needs a radio source
+        self.listener = freqlistener.FreqListener.__new__(
+            freqlistener.FreqListener)
+        self.listener._fft_size = 512
+        self.listener._samp_rate = 256000
+        self.listener._bandwidth = 128000
+        self.listener._slice_percentage = 10
+        self.listener._setup_fft_slices()
+        self.listener._id = 'ln11'
+        self.listener._avg_time = 2.0
+        self.listener._avg_sig = None
+
+    def test_floor_outside_band(self):
+        """Test that a strong signal filling the listener's bandwidth does
+        not move the noise floor"""
+
+        quiet_floor = dia_aux.DiaNoiseFloor()
+        signal_floor = dia_aux.DiaNoiseFloor()
+
+        numpy.random.seed(1)
+        for _ in range(100):
+            frames = numpy.random.normal(-90, 3, (3, 512))
+            quiet_level = quiet_floor.update(
+                self.listener._get_floor_bins(frames))
+
+            # the FFT sends the center frequency on the first bin, the
+            # band is the first and last quarters of the frames
+            frames[:, :128] = -30
+            frames[:, 384:] = -30
+            signal_level = signal_floor.update(
+                self.listener._get_floor_bins(frames))
+
+        assert abs(quiet_level + 90) < 1
+        assert signal_level == quiet_level
+
+    def test_floor_ranges(self):
+        """Test that the noise floor is estimated on every bin outside the
+        listener's bandwidth"""
+
+        assert self.listener._floor_ranges == ((128, 384),)
+
+    def test_audio_resampling(self):
+        """Test that a rate that is not a multiple of the audio rate is
+        resampled to one, as for a channel of a radio source's
+        channelizer"""
+
+        self.listener._audio_enable = True
+        self.listener._samp_rate = 480000.0
+        self.listener._set_audio_resampling(400000)
+
+        assert self.listener._audio_resampling == (5, 6)
+        assert self.listener._samp_rate == 400000
+
+        self.listener._samp_rate = 500000
+        self.listener._set_audio_resampling(400000)
+
+        assert self.listener._audio_resampling is None
+        assert self.listener._samp_rate == 500000
+
+    def test_radio_source_top_block(self):
+        """Test that the radio source's top block is accepted"""
+
+        top_block = dia_aux.DiaTopBlock()
+        self.listener.set_top_block(top_block)
+
+        assert self.listener._gr_top_block is top_block
+
+    def test_avg_window(self):
+        """Test that the levels are averaged over avg_time, on the
+        listener's own fft frame rate"""
+
+        self.listener._fft_frame_rate = 10
+        self.listener.set_level_rate(self.listener.get_fft_frame_rate())
+
+        assert self.listener._avg_sig.get_size() == 20
+        assert self.listener.get_avg_window() == 2.0
+
+        # a new rate keeps the window, and the current average
+        self.listener._avg_sig.add(-60)
+        average = self.listener._avg_sig.get_average()
+        self.listener.set_level_rate(30)
+
+        assert self.listener._avg_sig.get_size() == 60
+        assert self.listener.get_avg_window() == 2.0
+        assert self.listener._avg_sig.get_average() == average
+
+    def test_stop_waits_for_frames(self):
+        """Test that stopping waits for the frames being processed, and
+        frames arriving after are ignored"""
+
+        self.listener._probe_stop = threading.Event()
+        self.listener._fft_frames_lock = threading.Lock()
+
+        # frames being processed
+        self.listener._fft_frames_lock.acquire()
+        stop = threading.Thread(target=self.listener._stop_signal_probe)
+        stop.start()
+        stop.join(0.2)
+
+        assert stop.is_alive()
+
+        self.listener._fft_frames_lock.release()
+        stop.join(1.0)
+
+        assert not stop.is_alive()
+
+        # with the listener stopped frames are not checked, the floor
+        # estimator would be needed otherwise
+        self.listener._floor_estimator = None
+        self.listener._process_fft_frames(numpy.zeros((3, 512)))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python2
+"""
+    Tests for the diatomite monitoring system.
+    Copyright (C) 2017 Duarte Alencastre
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+                    GNU AFFERO GENERAL PUBLIC LICENSE
+                       Version 3, 19 November 2007
+"""
+
+import numpy
+import diatomite.diatomite_aux as dia_aux
+import diatomite.radiosource as radiosource
+import diatomite.freqlistener as freqlistener
+
+
+class BandListener(object):
+    """Stands for a listener on wideband detection, keeping what the radio
+    source passes it"""
+
+    def __init__(self, listener_id):
+        self.listener_id = listener_id
+        self.noise_floor = None
+        self.levels = []
+
+    def get_id(self):
+        return self.listener_id
+
+    def set_noise_floor(self, noise_floor):
+        self.noise_floor = noise_floor
+
+    def check_signal_level(self, level, current_time):
+        self.levels.append(level)
+
+
+class Listeners(object):
+    """Stands for the radio source's listener container"""
+
+    def __init__(self, listeners):
+        self.listeners = listeners
+
+    def get_listener_id_list(self):
+        return [listener.get_id() for listener in self.listeners]
+
+    def get_listener_by_id(self, listener_id):
+        return [listener for listener in self.listeners
+                if listener.get_id() == listener_id][0]
+
+
+class TestRadioSource:
+    """test radiosource.RadioSource class"""
+
+    def new_band_source(self):
+        """Return a radio source with only the attributes used to check
+        the listener bands on wideband detection, configuring one needs a
+        radio"""
+
+        source = radiosource.RadioSource.__new__(radiosource.RadioSource)
+        source._fft_size = 512
+        source._floor_estimator = dia_aux.DiaNoiseFloor()
+
+        # a band of 128 bins in the middle of the FFT
+        band_map = dia_aux.DiaBandMap(512, 0, 512000)
+        band_map.add_band('ln11', 192000, 320000)
+        source._floor_ranges = band_map.get_outside_ranges()
+        source._band_map = band_map
+        source._band_listeners = [BandListener('ln11')]
+
+        return source
+
+    def test_floor_outside_bands(self):
+        """Test that a strong signal filling a listener's band does not
+        move the wideband noise floor"""
+
+        quiet_source = self.new_band_source()
+        signal_source = self.new_band_source()
+
+        numpy.random.seed(1)
+        for _ in range(100):
+            frames = numpy.random.normal(-90, 3, (3, 512))
+            quiet_source._check_listener_bands(frames, 0, False)
+
+            frames[:, 192:320] = -30
+            signal_source._check_listener_bands(frames, 0, False)
+
+        quiet_floor = quiet_source._band_listeners[0].noise_floor
+        signal_floor = signal_source._band_listeners[0].noise_floor
+
+        assert abs(quiet_floor + 90) < 1
+        assert signal_floor == quiet_floor
+        assert signal_source._band_listeners[0].levels[-1] == -30
+
+    def test_band_avg_window(self):
+        """Test that on wideband detection the listeners average their
+        levels over avg_time at the radio source's fft frame rate, not
+        their own"""
+
+        # a listener averaging 2s of levels, on it's own 10 frames/s
+        listener = freqlistener.FreqListener.__new__(
+            freqlistener.FreqListener)
+        listener._id = 'ln11'
+        listener._frequency = 256000
+        listener._bandwidth = 128000
+        listener._avg_time = 2.0
+        listener._avg_sig = None
+        listener.set_level_rate(10)
+
+        source = radiosource.RadioSource.__new__(radiosource.RadioSource)
+        source._id = 'rs1'
+        source._fft_size = 512
+        source._center_freq = 256000
+        source._cap_bw = 512000
+        source._listeners = Listeners([listener])
+        source._frame_demand = dia_aux.DiaFrameDemand()
+        source._frame_demand.set_demand('detection', 30)
+        source._setup_band_map()
+
+        assert listener.get_level_rate() == 30
+        assert listener._avg_sig.get_size() == 60
+        assert listener.get_avg_window() == 2.0
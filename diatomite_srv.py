@@ -42,6 +42,11 @@ def arg_parser():
                         help='Run the server as a Daemon',
                         dest='daemonize', action='store_true',
                         default=False)
+    parser.add_argument('--plan-fft',
+                        help='Plan the FFTs on the configuration, save'
+                        ' their FFTW wisdom and exit',
+                        dest='plan_fft', action='store_true',
+                        default=False)
     parser.add_argument('-v', '--verbose',
                         help='Increase logging verbosity',
                         dest='verbose', action='store_true',
@@ -51,6 +56,27 @@ def arg_parser():
     return args
 
 
+def plan_fft(conf):
+    """Plan the FFTs of every probe on a configuration and save their
+    FFTW wisdom
+    conf -- a dictionary with a valid configuration"""
+
+    for site_conf in conf['sites'].values():
+        for probe_conf in site_conf['probes'].values():
+            if dia_sp.DiatomiteProbe.plan_fftw_wisdom(probe_conf):
+                msg = 'FFTW wisdom for probe {p} saved to {f}'.format(
+                    p=probe_conf['id'], f=probe_conf['fftw_wisdom_path'])
+                logging.info(msg)
+            elif probe_conf['fftw_wisdom_path']:
+                msg = 'Unable to save FFTW wisdom for probe {p}'.format(
+                    p=probe_conf['id'])
+                logging.error(msg)
+            else:
+                msg = ('FFTW wisdom for probe {p} kept on GNU Radio\'s'
+                       ' wisdom file only').format(p=probe_conf['id'])
+                logging.info(msg)
+
+
 def main():
     """Main processing block for the server"""
 
@@ -70,6 +96,10 @@ def main():
         msg = 'FATAL: Unable to process configurations:{m}'.format(m=exc)
         raise
 
+    if args.plan_fft:
+        plan_fft(dia_conf.get_config())
+        return
+
     this_site = dia_sp.DiatomiteSite(conf=dia_conf.get_config())
 
     this_site.start()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python2
+"""
+    Benchmark the diatomite listener channel extraction chain.
+    Copyright (C) 2017 Duarte Alencastre
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+                    GNU AFFERO GENERAL PUBLIC LICENSE
+                       Version 3, 19 November 2007
+"""
+
+# Times the CPU a listener uses taking it's band out of the radio source's
+# signal, without radio hardware, a noise source feeds each chain as fast
+# as it can take it:
+#  - legacy: a frequency translating filter at the source rate, a
+#    rational resampler to 500kHz and a second filter at 500kHz, as
+#    FreqListener did before DiaDecimationPlan
+#  - staged: the frequency translating filter decimating by the first
+#    stage of a DiaDecimationPlan and real tap filters for the others, as
+#    FreqListener does now
+# CPU times are per second of signal, with the time taken by the noise
+# source alone taken out, so 1.0 is a whole core
+
+import os
+import sys
+import argparse
+import importlib
+from gnuradio import gr
+from gnuradio import analog
+from gnuradio import blocks
+from gnuradio import filter as grfilter
+
+# the diatomite modules being benchmarked, see load_diatomite
+dia_aux = None
+freqlistener = None
+
+# frequency offset of the listener from the source's center, in Hz
+FREQUENCY_OFFSET = 300000
+
+
+def load_diatomite(repo_path):
+    """Import diatomite_aux and freqlistener from a diatomite tree
+    repo_path -- path to the root of the diatomite tree"""
+
+    global dia_aux
+    global freqlistener
+
+    sys.path.insert(0, repo_path)
+    dia_aux = importlib.import_module('diatomite.diatomite_aux')
+    freqlistener = importlib.import_module('diatomite.freqlistener')
+
+
+def legacy_chain(source_rate):
+    """Return a (blocks, tap quantity, output rate) tuple for the legacy
+    chain, blocks in order
+    source_rate -- the radio source's sample rate, in Hz"""
+
+    filter_samp_rate = 500e3
+    taps = grfilter.firdes.low_pass(1, filter_samp_rate,
+                                    filter_samp_rate / 2, 2000)
+
+    chain = [grfilter.freq_xlating_fir_filter_ccc(1, taps, FREQUENCY_OFFSET,
+                                                  source_rate),
+             grfilter.rational_resampler_ccc(
+                 interpolation=int(filter_samp_rate),
+                 decimation=int(source_rate),
+                 taps=None,
+                 fractional_bw=None),
+             grfilter.freq_xlating_fir_filter_ccc(1, taps, 0,
+                                                  filter_samp_rate)]
+
+    return (chain, 2 * len(taps), filter_samp_rate)
+
+
+def staged_chain(source_rate, bandwidth):
+    """Return a (blocks, tap quantity, output rate) tuple for the staged
+    chain, blocks in order
+    source_rate -- the radio source's sample rate, in Hz
+    bandwidth -- the listener's bandwidth, in Hz"""
+
+    plan = dia_aux.DiaDecimationPlan(
+        source_rate, freqlistener.FreqListener.RATE_OVERSAMPLE * bandwidth,
+        freqlistener.FreqListener.DECIMATION_PASSBAND)
+
+    stages = plan.get_stages()
+    if not stages:
+        chain = [grfilter.freq_xlating_fir_filter_ccc(1, (1,),
+                                                      FREQUENCY_OFFSET,
+                                                      source_rate)]
+        return (chain, 1, plan.get_out_rate())
+
+    chain = []
+    tap_qty = 0
+    for decimation, rate, cutoff, transition in stages:
+        taps = grfilter.firdes.low_pass_2(1, rate, cutoff, transition, 60)
+        tap_qty += len(taps)
+        if not chain:
+            chain.append(grfilter.freq_xlating_fir_filter_ccc(
+                decimation, taps, FREQUENCY_OFFSET, source_rate))
+        else:
+            chain.append(grfilter.fir_filter_ccf(decimation, taps))
+
+    return (chain, tap_qty, plan.get_out_rate())
+
+
+def run_chain(chain, source_rate, duration):
+    """Run a chain on duration seconds of noise, return the CPU time
+    used, in seconds
+    chain -- list of the chain's blocks, in order, empty to time the
+        noise source alone
+    source_rate -- the radio source's sample rate, in Hz
+    duration -- seconds of signal"""
+
+    top_block = gr.top_block()
+    source = analog.fastnoise_source_c(analog.GR_GAUSSIAN, 1, 0, 8192)
+    head = blocks.head(gr.sizeof_gr_complex, int(source_rate * duration))
+    sink = blocks.null_sink(gr.sizeof_gr_complex)
+
+    top_block.connect(source, head)
+    previous = head
+    for block in chain:
+        top_block.connect(previous, block)
+        previous = block
+    top_block.connect(previous, sink)
+
+    start = os.times()
+    top_block.run()
+    end = os.times()
+
+    return (end[0] - start[0]) + (end[1] - start[1])
+
+
+def chain_bench_main(args):
+    """Run the benchmarks"""
+
+    print ('{d}s of signal per run, CPU seconds per second of signal,'
+           ' filter taps on each chain').format(d=args.duration)
+    print '{s:>10} {b:>8} {l:>8} {lt:>6} {lr:>8} {g:>8} {gt:>6} {gr:>8}'\
+        ' {x:>8}'.format(s='source hz', b='bw hz', l='legacy', lt='taps',
+                         lr='rate', g='staged', gt='taps', gr='rate',
+                         x='speedup')
+
+    for source_rate in args.source_rates:
+        base_time = run_chain([], source_rate, args.duration)
+
+        # the legacy chain does not depend on the bandwidth
+        chain, legacy_taps, legacy_rate = legacy_chain(source_rate)
+        legacy_time = (run_chain(chain, source_rate, args.duration) -
+                       base_time) / args.duration
+
+        for bandwidth in args.bandwidths:
+            chain, staged_taps, staged_rate = staged_chain(source_rate,
+                                                           bandwidth)
+            staged_time = (run_chain(chain, source_rate, args.duration) -
+                           base_time) / args.duration
+
+            print '{s:10d} {b:8d} {l:8.3f} {lt:6d} {lr:8d} {g:8.3f}'\
+                ' {gt:6d} {gr:8d} {x:7.1f}x'.format(
+                    s=source_rate, b=bandwidth, l=legacy_time,
+                    lt=legacy_taps, lr=int(legacy_rate), g=staged_time,
+                    gt=staged_taps, gr=int(staged_rate),
+                    x=legacy_time / max(staged_time, 1e-6))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark diatomite'
+                                     ' listener channel extraction.')
+    parser.add_argument('-d', '--duration', help='seconds of signal per'
+                        ' run', dest='duration', type=float, default=10)
+    parser.add_argument('-s', '--source-rate', help='radio source sample'
+                        ' rates to run, in Hz', dest='source_rates',
+                        type=int, nargs='+', default=[2400000, 2048000])
+    parser.add_argument('-b', '--bandwidth', help='listener bandwidths to'
+                        ' run, in Hz', dest='bandwidths', type=int,
+                        nargs='+', default=[200000, 25000, 12500])
+    parser.add_argument('-r', '--repo', help='root of the diatomite tree to'
+                        ' benchmark, defaults to the one holding this tool',
+                        dest='repo', default=os.path.join(
+                            os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir))
+    args = parser.parse_args()
+    load_diatomite(args.repo)
+    chain_bench_main(args)
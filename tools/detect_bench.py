@@ -0,0 +1,234 @@
+#!/usr/bin/env python2
+"""
+    Benchmark the diatomite listener signal detection.
+    Copyright (C) 2017 Duarte Alencastre
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+                    GNU AFFERO GENERAL PUBLIC LICENSE
+                       Version 3, 19 November 2007
+"""
+
+# Times the work a listener does on each tick to turn an FFT frame into
+# a signal level and it's running average, without radio hardware:
+#  - legacy: unswapping the frame halves with tuple slices, numpy.mean on
+#    a tuple slice, a deque running average and an eagerly built log message,
+#    as FreqListener did before DiaFrameSlice and DiaRunningAverage
+#  - kernel: DiaFrameSlice on the frame as sent by the FFT, and
+#    DiaRunningAverage
+#  - sink: the kernels on batches of frames, as received by a DiaFrameSink,
+#    where every frame is checked instead of the latest one on each poll
+# frames are tuples, as returned by a signal probe, or numpy arrays
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import importlib
+import collections
+import numpy
+
+# the diatomite_aux module being benchmarked, see load_dia_aux
+dia_aux = None
+
+# probe poll rate of a listener, in hz, also the running average size
+POLL_RATE = 10
+
+# fft frame rate, frames reach a sink in batches of FRAME_RATE / POLL_RATE
+FRAME_RATE = 30
+
+
+def load_dia_aux(repo_path):
+    """Import diatomite_aux from a diatomite tree
+    repo_path -- path to the root of the diatomite tree"""
+
+    global dia_aux
+
+    sys.path.insert(0, repo_path)
+    dia_aux = importlib.import_module('diatomite.diatomite_aux')
+
+
+def new_frames(fft_size, count):
+    """Return a list of count noise FFT frames, as tuples
+    fft_size -- number of bins on each frame
+    count -- number of frames"""
+
+    return [tuple(random.gauss(-80, 3) for _ in xrange(fft_size))
+            for _ in xrange(count)]
+
+
+def legacy_detector():
+    """Return a function running a legacy listener tick on a frame"""
+
+    avg_sig_col = collections.deque(POLL_RATE * [0], POLL_RATE)
+
+    def tick(vraw):
+        """Run a tick on a frame"""
+
+        val = vraw[len(vraw)/2:]+vraw[:len(vraw)/2]
+
+        slice_percentage = 10
+        fft_len = len(val)
+        slice_len = (fft_len * slice_percentage) / 100
+        slice_start = (fft_len / 2) - int(slice_len / 2)
+        slice_end = (fft_len / 2) + int(slice_len / 2)
+
+        signal_avg = numpy.mean(val[slice_start:slice_end])
+
+        avg_sig_col.pop()
+        avg_sig_col.appendleft(signal_avg)
+        running_avg = sum(avg_sig_col) / float(len(avg_sig_col))
+
+        msg = ('{lid} Signal:{s}, running avg:{ra}, asg:{asq} ,'
+               ' threshold:{t}').format(lid='ln11', s=signal_avg,
+                                        ra=running_avg, asq=avg_sig_col,
+                                        t=-70)
+        logging.debug(msg)
+
+        return running_avg
+
+    return tick
+
+
+def kernel_detector(fft_size):
+    """Return a function running a listener tick on a frame with the
+    detection kernels
+    fft_size -- number of bins on each frame"""
+
+    avg_sig = dia_aux.DiaRunningAverage(POLL_RATE)
+    slice_len = (fft_size * 10) / 100
+    fft_slice = dia_aux.DiaFrameSlice(fft_size,
+                                      (fft_size / 2) - (slice_len / 2),
+                                      (fft_size / 2) + (slice_len / 2))
+
+    def tick(vraw):
+        """Run a tick on a frame"""
+
+        signal_avg = fft_slice.get_level(vraw)
+        running_avg = avg_sig.add(signal_avg)
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            msg = ('{lid} Signal:{s}, running avg:{ra}, asg:{asq} ,'
+                   ' threshold:{t}').format(lid='ln11', s=signal_avg,
+                                            ra=running_avg,
+                                            asq=avg_sig.get_samples(),
+                                            t=-70)
+            logging.debug(msg)
+
+        return running_avg
+
+    return tick
+
+
+def sink_detector(fft_size):
+    """Return a function checking a batch of frames with the detection
+    kernels, as a listener's fft sink does
+    fft_size -- number of bins on each frame"""
+
+    avg_sig = dia_aux.DiaRunningAverage(FRAME_RATE)
+    slice_len = (fft_size * 10) / 100
+    fft_slice = dia_aux.DiaFrameSlice(fft_size,
+                                      (fft_size / 2) - (slice_len / 2),
+                                      (fft_size / 2) + (slice_len / 2))
+
+    def tick(frames):
+        """Check a batch of frames"""
+
+        for signal_avg in fft_slice.get_levels(frames):
+            running_avg = avg_sig.add(signal_avg)
+
+        return running_avg
+
+    return tick
+
+
+def run_bench(tick, frames, count):
+    """Time count ticks, return the time per tick, in seconds
+    tick -- function running a tick on a frame
+    frames -- frames to cycle through
+    count -- number of ticks"""
+
+    frame_qty = len(frames)
+
+    start = time.time()
+    for n in xrange(count):
+        tick(frames[n % frame_qty])
+    elapsed = time.time() - start
+
+    return elapsed / count
+
+
+def detect_bench_main(args):
+    """Run the benchmarks"""
+
+    batch_size = FRAME_RATE / POLL_RATE
+
+    print ('{c} ticks per run, per tick times, sink times are per frame on'
+           ' batches of {b}').format(c=args.count, b=batch_size)
+    print '{f:>6} {l:>12} {k:>12} {a:>12} {s:>8} {b:>12}'.format(
+        f='bins', l='legacy us', k='kernel us', a='array us', s='speedup',
+        b='sink us')
+
+    for fft_size in args.fft_sizes:
+        frames = new_frames(fft_size, 16)
+        array_frames = [numpy.array(frame, dtype=numpy.float32)
+                        for frame in frames]
+
+        # both must agree on the level
+        legacy = legacy_detector()
+        kernel = kernel_detector(fft_size)
+        for frame in frames:
+            legacy_avg = legacy(frame)
+            kernel_avg = kernel(frame)
+        if abs(legacy_avg - kernel_avg) > 1e-6:
+            msg = 'Kernel level {k} differs from legacy {l}'.format(
+                k=kernel_avg, l=legacy_avg)
+            raise AssertionError(msg)
+
+        legacy_time = run_bench(legacy_detector(), frames, args.count)
+        kernel_time = run_bench(kernel_detector(fft_size), frames,
+                                args.count)
+        array_time = run_bench(kernel_detector(fft_size), array_frames,
+                               args.count)
+
+        batches = [numpy.array(frames[n:n + batch_size], dtype=numpy.float32)
+                   for n in xrange(0, len(frames) - batch_size + 1,
+                                   batch_size)]
+        sink_time = run_bench(sink_detector(fft_size), batches,
+                              args.count / batch_size) / batch_size
+
+        print '{f:6d} {l:12.2f} {k:12.2f} {a:12.2f} {s:7.1f}x {b:12.2f}'.format(
+            f=fft_size, l=legacy_time * 1e6, k=kernel_time * 1e6,
+            a=array_time * 1e6, s=legacy_time / kernel_time,
+            b=sink_time * 1e6)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark diatomite'
+                                     ' listener signal detection.')
+    parser.add_argument('-c', '--count', help='number of ticks per run',
+                        dest='count', type=int, default=20000)
+    parser.add_argument('-f', '--fft-size', help='FFT sizes to run, in'
+                        ' bins', dest='fft_sizes', type=int, nargs='+',
+                        default=[512, 1024, 4096])
+    parser.add_argument('-r', '--repo', help='root of the diatomite tree to'
+                        ' benchmark, defaults to the one holding this tool',
+                        dest='repo', default=os.path.join(
+                            os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir))
+    args = parser.parse_args()
+    load_dia_aux(args.repo)
+    detect_bench_main(args)
@@ -0,0 +1,330 @@
+#!/usr/bin/env python2
+"""
+    Benchmark the diatomite message envelopes.
+    Copyright (C) 2017 Duarte Alencastre
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+                    GNU AFFERO GENERAL PUBLIC LICENSE
+                       Version 3, 19 November 2007
+"""
+
+import os
+import sys
+import gc
+import time
+import json
+import argparse
+import importlib
+import cPickle as pickle
+
+# the diatomite_aux module being benchmarked, see load_dia_aux
+dia_aux = None
+
+
+def load_dia_aux(repo_path):
+    """Import diatomite_aux from a diatomite tree, allows benchmarking
+    another checkout against this one
+    repo_path -- path to the root of the diatomite tree"""
+
+    global dia_aux
+
+    sys.path.insert(0, repo_path)
+    dia_aux = importlib.import_module('diatomite.diatomite_aux')
+
+
+class NestedMsg(object):
+    """Base class for the nested envelopes diatomite routed before DiaMsg,
+    each one carrying the message of the previous component as a json
+    payload, kept to compare against"""
+
+    __slots__ = ('_msg_type', '_id', '_payload')
+
+    # class of the message that may be given as payload, it's json will
+    # be the payload
+    _payload_class = None
+
+    def __init__(self, msg_type=None, objid=None, payload=None):
+        """initialize the object
+        msg_type -- message type, a DiaMsgType object
+        objid -- id of the sending component
+        payload -- data to send, either a json string or a message of the
+            payload class"""
+
+        # the type of signal to send, the name of a DiaMsgType object
+        self._msg_type = None
+
+        # the id for the component that originated the message
+        self._id = None
+
+        # the payload of the message, json or dict
+        self._payload = None
+
+        if (msg_type is not None and objid is not None and
+                payload is not None):
+
+            self._id = objid
+            self._msg_type = msg_type.name
+
+            if (self._payload_class is not None and
+                    isinstance(payload, self._payload_class)):
+                self._payload = payload.get_json()
+            else:
+                self._payload = payload
+
+    def get_msg_type(self):
+        """Return the message type, a DiaMsgType"""
+        return dia_aux.DiaMsgType[self._msg_type]
+
+    def get_payload(self):
+        """Return the payload"""
+        return self._payload
+
+    def get_json(self):
+        """Return a json representation of this data"""
+
+        return json.dumps({
+            'msg_type': self._msg_type,
+            'id': self._id,
+            'payload': self._payload
+        })
+
+    def set_json(self, data):
+        """Sets the data from json"""
+
+        t_data = json.loads(data)
+
+        self._msg_type = t_data.get('msg_type')
+        self._id = t_data.get('id')
+        self._payload = t_data.get('payload')
+
+    def __getstate__(self):
+        return (self._msg_type, self._id, self._payload)
+
+    def __setstate__(self, state):
+        self._msg_type, self._id, self._payload = state
+
+
+class ListenerMsg(NestedMsg):
+    """Envelope for data sent by a listener"""
+
+    __slots__ = ()
+
+
+class RadioReceiverMsg(NestedMsg):
+    """Envelope for data sent by a radio receiver"""
+
+    __slots__ = ()
+
+    _payload_class = ListenerMsg
+
+
+class ProbeMsg(NestedMsg):
+    """Envelope for data sent by a probe"""
+
+    __slots__ = ()
+
+    _payload_class = RadioReceiverMsg
+
+
+class SiteMsg(NestedMsg):
+    """Envelope for data sent by a site"""
+
+    __slots__ = ()
+
+    _payload_class = ProbeMsg
+
+
+def queue_hop(obj):
+    """Pickle and unpickle an object, as a multiprocessing queue does."""
+
+    return pickle.loads(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+
+def new_sig_state():
+    """Return a signal state like the ones sent by a listener on each tick"""
+
+    sig_state = dia_aux.DiaSigState()
+    current_time = time.time()
+    sig_info = dia_aux.DiaSigInfo(dia_aux.DiaSigStatus.PRESENT, -54.3,
+                                  current_time)
+    sig_state.update_current(sig_info)
+
+    return sig_state
+
+
+def nested_chain(sig_state):
+    """Send a signal state through the nested, JSON in JSON, envelopes:
+    listener -> radio source -> probe -> site -> api service."""
+
+    msg_type = dia_aux.DiaMsgType.LNR_SIG_STATE
+
+    # listener
+    lnr_msg = ListenerMsg(msg_type, 'ln11', sig_state.get_json())
+
+    # radio source, then the queue to the probe
+    rcv_msg = RadioReceiverMsg(msg_type, 'rs1', lnr_msg)
+    rcv_msg = queue_hop(rcv_msg)
+
+    # probe and site, then the queue to the api service
+    prb_msg = ProbeMsg(rcv_msg.get_msg_type(), 'test_probe_1', rcv_msg)
+    site_msg = SiteMsg(rcv_msg.get_msg_type(), 'test_site_1', prb_msg)
+    site_msg = queue_hop(site_msg)
+
+    # api service, unpack each envelope
+    site_msg.get_msg_type()
+    dia_probe_msg = ProbeMsg()
+    dia_probe_msg.set_json(site_msg.get_payload())
+    dia_receiver_msg = RadioReceiverMsg()
+    dia_receiver_msg.set_json(dia_probe_msg.get_payload())
+    dia_lnr_msg = ListenerMsg()
+    dia_lnr_msg.set_json(dia_receiver_msg.get_payload())
+
+    api_sig_state = dia_aux.DiaSigState()
+    api_sig_state.set_json(dia_lnr_msg.get_payload())
+
+    return api_sig_state
+
+
+def flat_chain(sig_state):
+    """Send a signal state through the flat DiaMsg envelope:
+    listener -> radio source -> probe -> site -> api service."""
+
+    msg_type = dia_aux.DiaMsgType.LNR_SIG_STATE
+
+    # listener
+    msg = dia_aux.DiaMsg(msg_type, sig_state.get_snapshot(),
+                         listener_id='ln11')
+
+    # radio source, then the queue to the probe
+    msg.set_source_id('rs1')
+    msg = queue_hop(msg)
+
+    # probe and site, then the queue to the api service
+    msg.set_probe_id('test_probe_1')
+    msg.set_site_id('test_site_1')
+    msg = queue_hop(msg)
+
+    # api service
+    msg.get_msg_type()
+
+    return msg.get_payload()
+
+
+def listener_tick(sig_state):
+    """Return the message a listener sends on each tick, with the objects
+    it allocates for it"""
+
+    sig_info = dia_aux.DiaSigInfo(dia_aux.DiaSigStatus.PRESENT, -54.3,
+                                  '2017-01-01T00:00:00')
+    sig_state.update_current(sig_info)
+
+    return dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SIG_STATE,
+                          sig_state.get_snapshot(), listener_id='ln11')
+
+
+def instance_size(obj):
+    """Return the size of an object, including it's instance and _data
+    dicts, if it has them"""
+
+    size = sys.getsizeof(obj)
+    for name in ('__dict__', '_data'):
+        attr = getattr(obj, name, None)
+        if isinstance(attr, dict):
+            size += sys.getsizeof(attr)
+
+    return size
+
+
+def alloc_bench(count):
+    """Measure the objects allocated for each listener message, print
+    the gc tracked objects, memory and pickled size per message
+    count -- number of messages to create"""
+
+    sig_state = new_sig_state()
+
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    msgs = [listener_tick(sig_state) for _ in xrange(count)]
+    objects = (len(gc.get_objects()) - objects_before) / float(count)
+
+    msg = msgs[0]
+    payload = msg.get_payload()
+    size = (instance_size(msg) + instance_size(payload) +
+            instance_size(payload.get_current()))
+    pickled_size = len(pickle.dumps(msg, pickle.HIGHEST_PROTOCOL))
+
+    print ('   alloc: {o:8.2f} gc objects/msg, {s:5d} bytes/msg,'
+           ' {p:5d} bytes pickled').format(o=objects, s=size, p=pickled_size)
+
+    del msgs
+
+
+def run_bench(name, func, count):
+    """Time count runs of func, print and return the time per message
+    name -- name for the benchmark
+    func -- function to run, receives a signal state
+    count -- number of messages to send"""
+
+    sig_state = new_sig_state()
+
+    start = time.time()
+    for _ in xrange(count):
+        func(sig_state)
+    elapsed = time.time() - start
+
+    per_msg = elapsed / count
+    print '{n:>8}: {us:8.2f} us/msg, {r:10.0f} msg/s'.format(n=name,
+                                                             us=per_msg * 1e6,
+                                                             r=1 / per_msg)
+
+    return per_msg
+
+
+def msg_bench_main(args):
+    """Run the benchmarks"""
+
+    print 'Sending {c} LNR_SIG_STATE messages'.format(c=args.count)
+
+    nested = run_bench('nested', nested_chain, args.count)
+    flat = run_bench('flat', flat_chain, args.count)
+
+    print 'flat envelope speedup: {s:.1f}x'.format(s=nested / flat)
+
+    # the flat envelope is serialized once, when leaving the system
+    msg = dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SIG_STATE, new_sig_state(),
+                         'rs1', 'ln11', 'test_probe_1', 'test_site_1')
+    run_bench('edge', lambda _: msg.get_json(), args.count)
+
+    # what each listener tick costs, and decoding the enums back
+    alloc_bench(args.count)
+    run_bench('tick', listener_tick, args.count)
+    run_bench('decode', lambda _: (msg.get_msg_type(),
+                                   msg.get_payload().get_current().get_status()),
+              args.count)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark diatomite'
+                                     ' message envelopes.')
+    parser.add_argument('-c', '--count', help='number of messages to send',
+                        dest='count', type=int, default=20000)
+    parser.add_argument('-r', '--repo', help='root of the diatomite tree to'
+                        ' benchmark, defaults to the one holding this tool',
+                        dest='repo', default=os.path.join(
+                            os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir))
+    args = parser.parse_args()
+    load_dia_aux(args.repo)
+    msg_bench_main(args)
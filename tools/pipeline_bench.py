@@ -0,0 +1,379 @@
+#!/usr/bin/env python2
+"""
+    Benchmark the diatomite message pipeline.
+    Copyright (C) 2017 Duarte Alencastre
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+                    GNU AFFERO GENERAL PUBLIC LICENSE
+                       Version 3, 19 November 2007
+"""
+
+# Drives the real message path, radio source -> probe -> api service,
+# with synthetic listeners, no radio hardware or flowgraph is used:
+#  - each radio source subprocess sends it's listeners messages through
+#    RadioSource.send_data, batched per tick
+#  - the probe subprocess relays them with
+#    DiatomiteProbe._monitor_radio_sources (skipped with --direct)
+#  - the api service subprocess ingests them with
+#    ApiSvc._monitor_input_queue, and reports it's ingestion metrics
+
+import os
+import sys
+import time
+import random
+import itertools
+import argparse
+import threading
+import multiprocessing
+from multiprocessing import queues as mp_queues
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from diatomite import diatomite_aux as dia_aux
+from diatomite import radiosource
+from diatomite import diatomite_site_probe as dia_sp
+from diatomite import diatomite_api as dia_api
+
+SITE_ID = 'bench_site'
+PROBE_ID = 'bench_probe'
+
+
+class BenchRadioSource(radiosource.RadioSource):
+    """A radio source without radio hardware, it's listeners are
+    simulated"""
+
+    def __init__(self, source_id, listener_ids, out_queue):
+        """Initialize the radio source
+        source_id -- the radio source id
+        listener_ids -- list of ids of the simulated listeners
+        out_queue -- the radio source output queue, a DiaQueue"""
+
+        radiosource.RadioSource.__init__(self, {}, multiprocessing.Queue(),
+                                         out_queue, '', '')
+
+        self.set_id(source_id)
+        self.set_ouptut_queue(out_queue)
+        self.set_route_ids(PROBE_ID, SITE_ID)
+
+        self._listener_ids = listener_ids
+
+    def run(self, rate, change_rate, duration, start_time, sent):
+        """Send a signal level message for each listener, rate times per
+        second, as listeners do, and signal status changes
+        rate -- messages per second for each listener
+        change_rate -- signal status changes per second, on one of the
+            listeners at a time
+        duration -- time to run, in seconds
+        start_time -- time at which to start, so all sources start together
+        sent -- shared counter of messages sent"""
+
+        sig_states = dict((l_id, dia_aux.DiaSigState())
+                          for l_id in self._listener_ids)
+        sig_status = dict((l_id, dia_aux.DiaSigStatus.PRESENT)
+                          for l_id in self._listener_ids)
+        msg_seqs = dict((l_id, itertools.count(1))
+                        for l_id in self._listener_ids)
+
+        self._start_out_batching()
+
+        tick = 1.0 / rate
+        next_tick = start_time
+        end_time = start_time + duration
+        count = 0
+
+        change_ids = itertools.cycle(self._listener_ids)
+        next_change = None
+        if change_rate:
+            next_change = start_time
+
+        while next_tick < end_time:
+            delay = next_tick - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            current_time = time.time()
+
+            if next_change is not None and next_change <= time.time():
+                # flip the status of the next listener
+                l_id = change_ids.next()
+                if sig_status[l_id] == dia_aux.DiaSigStatus.PRESENT:
+                    sig_status[l_id] = dia_aux.DiaSigStatus.ABSENT
+                else:
+                    sig_status[l_id] = dia_aux.DiaSigStatus.PRESENT
+                sig_info = dia_aux.DiaSigInfo(sig_status[l_id],
+                                              random.gauss(-60, 0.5),
+                                              current_time)
+                sig_states[l_id].set_new(sig_info)
+                msg = dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SIG_STATUS_CHANGE,
+                                     sig_states[l_id].get_snapshot(),
+                                     listener_id=l_id,
+                                     seq=msg_seqs[l_id].next())
+                self.send_data(msg)
+                count += 1
+                next_change += 1.0 / change_rate
+
+            for l_id, sig_state in sig_states.iteritems():
+                sig_info = dia_aux.DiaSigInfo(sig_status[l_id],
+                                              random.gauss(-60, 0.5),
+                                              current_time)
+                sig_state.update_current(sig_info)
+                msg = dia_aux.DiaMsg(dia_aux.DiaMsgType.LNR_SIG_STATE,
+                                     sig_state.get_snapshot(),
+                                     listener_id=l_id,
+                                     seq=msg_seqs[l_id].next())
+                self.send_data(msg)
+
+            count += len(sig_states)
+            next_tick += tick
+
+        self._stop_out_batching()
+
+        with sent.get_lock():
+            sent.value += count
+
+
+def get_site_conf(source_ids, listener_ids):
+    """Return the site configuration known by the api service
+    source_ids -- list of radio source ids
+    listener_ids -- list of listener ids, the same for each source"""
+
+    sources = {}
+    for s_id in source_ids:
+        sources[s_id] = {'listeners': dict((l_id, {})
+                                           for l_id in listener_ids)}
+
+    return {SITE_ID: {'probes': {PROBE_ID: {'RadioSources': sources}}}}
+
+
+def get_api_stats(api_svc):
+    """Return the api service ingestion metrics, with the delivery
+    counters under 'delivery'"""
+
+    stats = api_svc.get_ingestion_stats().data_dump()
+    stats['delivery'] = api_svc.get_delivery_stats().data_dump()
+
+    return stats
+
+
+def run_api_svc(api_svc, interval, stop_event, results):
+    """Ingest messages on the api service, sending it's metrics to results
+    every interval
+    api_svc -- the ApiSvc object
+    interval -- time between metrics reports, in seconds
+    stop_event -- event to stop the api service
+    results -- queue where the metrics are sent"""
+
+    monitor = threading.Thread(target=api_svc._monitor_input_queue,
+                               args=(stop_event,))
+    monitor.daemon = True
+    monitor.start()
+
+    while not stop_event.is_set():
+        stop_event.wait(interval)
+        results.put(get_api_stats(api_svc))
+
+    monitor.join()
+    results.put(get_api_stats(api_svc))
+
+
+def format_lag(lag):
+    """Return a lag, in seconds, formated in ms"""
+
+    if lag is None:
+        return '{l:>8}'.format(l='-')
+
+    return '{l:8.2f}'.format(l=lag * 1000)
+
+
+def pipeline_bench_main(args):
+    """Run the benchmark"""
+
+    source_ids = ['rs{n}'.format(n=n) for n in range(args.sources)]
+    listener_ids = ['ln{n}'.format(n=n) for n in range(args.listeners)]
+
+    probe_conf = {
+        'queue_size': args.queue_size,
+        'level_queue_policy': args.policy,
+        'direct_api_path': args.direct
+        }
+
+    probe = dia_sp.DiatomiteProbe()
+    probe.configure_queues(probe_conf)
+
+    api_in = probe.get_api_svc_input_pipe()
+    source_out = probe.get_source_output_queue()
+
+    api_svc = dia_api.ApiSvc(probe_conf, get_site_conf(source_ids,
+                                                      listener_ids),
+                             api_in, probe.get_api_svc_output_pipe())
+
+    stop_api = multiprocessing.Event()
+    stop_probe = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    sent = multiprocessing.Value('l', 0)
+
+    processes = []
+
+    api_process = multiprocessing.Process(target=run_api_svc,
+                                          args=(api_svc, args.interval,
+                                                stop_api, results))
+    api_process.start()
+
+    probe_process = None
+    if not args.direct:
+        probe_process = multiprocessing.Process(
+            target=probe._monitor_radio_sources, args=(stop_probe,))
+        probe_process.start()
+
+    start_time = time.time() + 1
+    for s_id in source_ids:
+        source = BenchRadioSource(s_id, listener_ids, source_out)
+        process = multiprocessing.Process(target=source.run,
+                                          args=(args.rate, args.change_rate,
+                                                args.duration, start_time,
+                                                sent))
+        process.start()
+        processes.append(process)
+
+    offered = args.sources * args.listeners * args.rate
+    print ('{s} sources x {l} listeners at {r} Hz, offering {o} msg/s,'
+           ' {p} path').format(s=args.sources, l=args.listeners, r=args.rate,
+                               o=offered,
+                               p='direct' if args.direct else 'probe')
+    print '{t:>6} {m:>10} {p50:>8} {p99:>8} {c99:>8} {b:>8} {q:>8}'.format(
+        t='time', m='msg/s', p50='p50 ms', p99='p99 ms', c99='chg p99',
+        b='backlog', q='sources')
+
+    last = None
+    last_time = None
+    # time of the last report with newly ingested messages
+    ingest_end_time = start_time
+    stats = None
+    waiting = True
+
+    while waiting:
+        try:
+            stats = results.get(True, args.interval * 4)
+        except mp_queues.Empty:
+            break
+
+        now = time.time()
+        rate = 0
+        if last is not None:
+            rate = (stats['messages'] - last['messages']) / (now - last_time)
+
+        if args.direct:
+            source_backlog = '-'
+        else:
+            try:
+                source_backlog = source_out.qsize()
+            except NotImplementedError:
+                source_backlog = '-'
+
+        backlog = stats['backlog']
+        if backlog is None:
+            backlog = '-'
+
+        print '{t:6.1f} {m:10.0f} {p50} {p99} {c99} {b:>8} {q:>8}'.format(
+            t=now - start_time, m=rate, p50=format_lag(stats['lag_p50']),
+            p99=format_lag(stats['lag_p99']),
+            c99=format_lag(stats['priority_lag_p99']), b=backlog,
+            q=source_backlog)
+
+        if last is not None and stats['messages'] > last['messages']:
+            ingest_end_time = now
+
+        last = stats
+        last_time = now
+
+        # stop once the sources are done and everything was ingested
+        if not any(process.is_alive() for process in processes):
+            if stats['messages'] >= sent.value or not stats['backlog']:
+                waiting = False
+
+    for process in processes:
+        process.join()
+
+    stop_probe.set()
+    if probe_process is not None:
+        probe_process.join()
+
+    stop_api.set()
+    while api_process.is_alive():
+        try:
+            stats = results.get(True, args.interval)
+        except mp_queues.Empty:
+            pass
+    api_process.join()
+
+    print
+    print 'sent: {s}, ingested: {i}, coalesced: {c}'.format(
+        s=sent.value, i=stats['messages'], c=stats['coalesced'])
+    print 'throughput: {t:.0f} msg/s, offered {o} msg/s'.format(
+        t=stats['messages'] / max(ingest_end_time - start_time, args.duration),
+        o=offered)
+    print ('max lag: {m} ms, max status change lag: {c} ms,'
+           ' peak backlog: {b}').format(
+               m=format_lag(stats['max_lag']).strip(),
+               c=format_lag(stats['max_priority_lag']).strip(),
+               b=stats['max_backlog'])
+
+    delivery = stats['delivery']
+    print ('delivery: {i} in order, {g} gaps missing {m}, {d} duplicates,'
+           ' {r} reordered').format(i=delivery['in_order'], g=delivery['gaps'],
+                                    m=delivery['missing'],
+                                    d=delivery['duplicates'],
+                                    r=delivery['reordered'])
+
+    queues = [api_in]
+    if not args.direct:
+        queues.insert(0, source_out)
+    for queue in queues:
+        print 'queue {name}: {stats}'.format(name=queue.get_name(),
+                                             stats=queue.get_stats())
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the diatomite'
+                                     ' message pipeline with synthetic'
+                                     ' listeners.')
+    parser.add_argument('-s', '--sources', help='number of radio sources',
+                        dest='sources', type=int, default=2)
+    parser.add_argument('-l', '--listeners', help='number of listeners on'
+                        ' each radio source', dest='listeners', type=int,
+                        default=10)
+    parser.add_argument('-r', '--rate', help='messages per second sent by'
+                        ' each listener', dest='rate', type=float,
+                        default=10)
+    parser.add_argument('-c', '--change-rate', help='signal status changes'
+                        ' per second sent by each radio source',
+                        dest='change_rate', type=float, default=1)
+    parser.add_argument('-d', '--duration', help='time sending messages,'
+                        ' in seconds', dest='duration', type=float,
+                        default=10)
+    parser.add_argument('-i', '--interval', help='time between reports, in'
+                        ' seconds', dest='interval', type=float, default=1)
+    parser.add_argument('-q', '--queue-size', help='maximum items on each'
+                        ' queue, 0 for unbounded', dest='queue_size',
+                        type=int, default=1000)
+    parser.add_argument('-p', '--policy', help='level queue policy',
+                        dest='policy', default=dia_aux.DiaQueue.POLICY_COALESCE,
+                        choices=dia_aux.DiaQueue.LEVEL_POLICIES)
+    parser.add_argument('--direct', help='radio sources send straight to'
+                        ' the api service', dest='direct',
+                        action='store_true')
+    args = parser.parse_args()
+    pipeline_bench_main(args)